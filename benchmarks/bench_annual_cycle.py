@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark for the phases of Island.annual_cycle. Every phase is timed
+on its own over a sweep of map sizes, animal densities and carnivore
+ratios, in cell mode and flat mode. The throughput is reported in animal
+updates per second, that is the number of animals at the start of a phase
+divided by the time it took, together with the peak memory of a year
+as seen by tracemalloc. The results can be saved as JSON and compared
+with an earlier run.
+
+Run from the repository root with
+    python benchmarks/bench_annual_cycle.py --output new.json --compare old.json
+"""
+
+__author__ = 'Peter Langdalen'
+__email__ = 'pelangda@nmbu.no'
+
+import argparse
+import json
+import platform
+import sys
+import textwrap
+import time
+import timeit
+import tracemalloc
+import numpy as np
+
+from biosim.animals import Herbivore, Carnivore
+from biosim.island import Island
+from biosim.random_streams import RandomStreams
+
+check_sim_map = textwrap.dedent("""\
+    WWWWWWWWWWWWWWWWWWWWW
+    WWWWWWWWHWWWWLLLLLLLW
+    WHHHHHLLLLWWLLLLLLLWW
+    WHHHHHHHHHWWLLLLLLWWW
+    WHHHHHLLLLLLLLLLLLWWW
+    WHHHHHLLLDDLLLHLLLWWW
+    WHHLLLLLDDDLLLHHHHWWW
+    WWHHHHLLLDDLLLHWWWWWW
+    WHHHLLLLLDDLLLLLLLWWW
+    WHHHHLLLLDDLLLLWWWWWW
+    WWHHHHLLLLLLLLWWWWWWW
+    WWWHHHHLLLLLLLWWWWWWW
+    WWWWWWWWWWWWWWWWWWWWW""")
+
+
+def generate_map(rows, cols, rng):
+    """
+    Makes a map with water around the edge and random land inside
+
+    :param rows: int
+    :param cols: int
+    :param rng: numpy Generator
+
+    :return: multi line string
+    """
+    inside = rng.choice(np.array(list('LHDW')), size=(rows - 2, cols - 2),
+                        p=[0.45, 0.3, 0.15, 0.1])
+    grid = np.full((rows, cols), 'W')
+    grid[1:-1, 1:-1] = inside
+    return '\n'.join(''.join(row) for row in grid)
+
+
+def make_island(island_map, flat, density, carnivore_ratio, seed):
+    """
+    Makes an island with density animals in every land cell
+
+    :param island_map: multi line string
+    :param flat: bool, passed on to Island
+    :param density: int, animals per habitable cell
+    :param carnivore_ratio: float, the fraction of all the animals on the
+    island that are carnivores
+    :param seed: int
+
+    :return: Island
+    """
+    island = Island(island_map, flat=flat, streams=RandomStreams(seed))
+    rng = np.random.default_rng(seed)
+    all_cells = np.repeat(np.flatnonzero(island.habitable), density)
+    # The carnivores are counted over the whole island and spread at random,
+    # so a small ratio still gives carnivores at a low density
+    num_carns = int(round(len(all_cells) * carnivore_ratio))
+    if carnivore_ratio > 0 and num_carns == 0:
+        raise ValueError('Carnivore ratio {} gives no carnivores on this island'.format(
+            carnivore_ratio))
+    is_carn = np.zeros(len(all_cells), dtype=bool)
+    is_carn[rng.choice(len(all_cells), num_carns, replace=False)] = True
+    state = {'fodder': island.f_max_per_code()[island.landscape_codes]}
+    for species, chosen in ((Herbivore, ~is_carn), (Carnivore, is_carn)):
+        name = species.__name__
+        cells = all_cells[chosen]
+        state[name + '_cell'] = cells
+        state[name + '_age'] = rng.integers(0, 20, size=len(cells))
+        state[name + '_weight'] = rng.uniform(5, 50, size=len(cells))
+        state[name + '_fitness'] = species.fitness_kernel(state[name + '_age'],
+                                                          state[name + '_weight'])
+    island.set_state(state)
+    return island
+
+
+def num_animals(island):
+    """
+    :return: int, the number of animals on the island
+    """
+    return sum(island.count_animals().values())
+
+
+def time_phases(island, years):
+    """
+    Runs years annual cycles, timing each phase
+
+    :return: dict with the phase names as keys and dicts with the mean
+    seconds per year and the animal updates per second as values
+    """
+    seconds = dict.fromkeys(Island.phase_names, 0.)
+    updates = dict.fromkeys(Island.phase_names, 0)
+    for _ in range(years):
+        for name, phase in island.phases():
+            updates[name] += num_animals(island)
+            start = timeit.default_timer()
+            phase()
+            seconds[name] += timeit.default_timer() - start
+    return {name: {'seconds_per_year': seconds[name] / years,
+                   'updates_per_second': updates[name] / seconds[name]
+                   if seconds[name] else None}
+            for name in Island.phase_names}
+
+
+def peak_memory(island):
+    """
+    Runs one annual cycle under tracemalloc
+
+    :return: int, the peak number of bytes allocated during the year
+    """
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    island.annual_cycle()
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return peak
+
+
+def run_case(name, island_map, mode, density, carnivore_ratio, years, seed):
+    """
+    Benchmarks one combination of map, mode, density and carnivore ratio
+
+    :return: dict with the settings and the results
+    """
+    island = make_island(island_map, mode == 'flat', density, carnivore_ratio, seed)
+    island.annual_cycle()
+    start_animals = num_animals(island)
+    phases = time_phases(island, years)
+    total = sum(phase['seconds_per_year'] for phase in phases.values())
+    return {'map': name, 'shape': list(island.shape), 'mode': mode,
+            'density': density, 'carnivore_ratio': carnivore_ratio,
+            'years': years, 'animals': start_animals,
+            'seconds_per_year': total,
+            'updates_per_second': start_animals * len(phases) / total if total else None,
+            'peak_memory_bytes': peak_memory(island),
+            'phases': phases}
+
+
+def case_key(case):
+    """
+    :return: tuple that identifies a case across runs
+    """
+    return case['map'], case['mode'], case['density'], case['carnivore_ratio']
+
+
+def compare(results, old_results):
+    """
+    Prints the speedup of every case and phase that is in both runs
+    """
+    old = {case_key(case): case for case in old_results}
+    print('\n{:>12} {:>5} {:>8} {:>6} {:>12} '.format('map', 'mode', 'density', 'carn', 'phase') +
+          '{:>10}'.format('speedup'))
+    for case in results:
+        before = old.get(case_key(case))
+        if before is None:
+            continue
+        for phase in ['total'] + list(Island.phase_names):
+            new_s = case['seconds_per_year'] if phase == 'total' else \
+                case['phases'][phase]['seconds_per_year']
+            old_s = before['seconds_per_year'] if phase == 'total' else \
+                before['phases'][phase]['seconds_per_year']
+            print('{:>12} {:>5} {:>8} {:>6} {:>12} {:>10.2f}'.format(
+                case['map'], case['mode'], case['density'], case['carnivore_ratio'],
+                phase, old_s / new_s if new_s else float('nan')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='check_sim,100x100,300x300,1000x1000',
+                        help='comma separated list of check_sim or ROWSxCOLS')
+    parser.add_argument('--densities', default='5,20', help='animals per land cell')
+    parser.add_argument('--carnivore-ratios', default='0,0.1')
+    parser.add_argument('--modes', default='cell,flat')
+    parser.add_argument('--max-cell-mode-cells', type=int, default=100 * 100,
+                        help='cell mode is skipped for larger maps')
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='JSON file the results are written to')
+    parser.add_argument('--compare', help='JSON file from an earlier run')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    maps = {}
+    for size in args.sizes.split(','):
+        if size == 'check_sim':
+            maps[size] = check_sim_map
+        else:
+            rows, cols = (int(n) for n in size.split('x'))
+            maps[size] = generate_map(rows, cols, rng)
+
+    print('{:>12} {:>5} {:>8} {:>6} {:>10} {:>10} {:>12} {:>10}'.format(
+        'map', 'mode', 'density', 'carn', 'animals', 's/year', 'updates/s', 'peak MB'))
+    results = []
+    for name, island_map in maps.items():
+        lines = island_map.splitlines()
+        num_cells = len(lines) * len(lines[0])
+        for mode in args.modes.split(','):
+            if mode == 'cell' and num_cells > args.max_cell_mode_cells:
+                continue
+            for density in (int(d) for d in args.densities.split(',')):
+                for ratio in (float(r) for r in args.carnivore_ratios.split(',')):
+                    case = run_case(name, island_map, mode, density, ratio,
+                                    args.years, args.seed)
+                    results.append(case)
+                    print('{:>12} {:>5} {:>8} {:>6} {:>10} {:>10.3f} {:>12.3g} {:>10.1f}'.format(
+                        name, mode, density, ratio, case['animals'],
+                        case['seconds_per_year'], case['updates_per_second'] or 0,
+                        case['peak_memory_bytes'] / 2 ** 20))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'python': sys.version, 'numpy': np.__version__,
+                       'platform': platform.platform(),
+                       'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'arguments': vars(args), 'results': results}, output, indent=1)
+    if args.compare:
+        with open(args.compare) as old:
+            compare(results, json.load(old)['results'])
+
+
+if __name__ == '__main__':
+    main()
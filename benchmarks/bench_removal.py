@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark for death and removal of animals in a single cell.
+The time per animal should stay flat as the number of animals grows,
+which shows that the cost is linear and not quadratic.
+
+Run from the repository root with
+    python benchmarks/bench_removal.py
+"""
+
+__author__ = 'Peter Langdalen'
+__email__ = 'pelangda@nmbu.no'
+
+import timeit
+import numpy as np
+
+from biosim.landscape import Lowland
+
+
+def make_cell(num_animals):
+    """
+    Creates a lowland cell with num_animals herbivores of random age and weight
+    """
+    cell = Lowland()
+    cell.herbivore.add(np.random.randint(0, 50, size=num_animals),
+                       np.random.uniform(0, 50, size=num_animals))
+    return cell
+
+
+def time_death(num_animals, repeats=5):
+    """
+    Times Cell.animals_die, where about half the animals die
+    """
+    def run():
+        cell = make_cell(num_animals)
+        cell.herbivore.fitness[:] = 1 - 1 / (2 * cell.herbivore.species.parameters['omega'])
+        start = timeit.default_timer()
+        cell.animals_die()
+        return timeit.default_timer() - start
+
+    return min(run() for _ in range(repeats))
+
+
+def time_removal(num_animals, repeats=5):
+    """
+    Times Cell.remove_animals, removing every other animal
+    """
+    def run():
+        cell = make_cell(num_animals)
+        rows = {'Herbivore': np.arange(0, num_animals, 2)}
+        start = timeit.default_timer()
+        cell.remove_animals(rows)
+        return timeit.default_timer() - start
+
+    return min(run() for _ in range(repeats))
+
+
+if __name__ == '__main__':
+    np.random.seed(1)
+    print('{:>10} {:>18} {:>18}'.format('animals', 'death ns/animal', 'remove ns/animal'))
+    for num_animals in (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6):
+        death = time_death(num_animals)
+        removal = time_removal(num_animals)
+        print('{:>10} {:>18.1f} {:>18.1f}'.format(num_animals,
+                                                   1e9 * death / num_animals,
+                                                   1e9 * removal / num_animals))
@@ -7,7 +7,46 @@
 __author__ = 'Peter Langdalen'
 __email__ = 'pelangda@nmbu.no'
 
+from typing import NamedTuple
 import numpy as np
+from biosim.random_streams import resolve_generator
+
+
+class AnimalParameters(NamedTuple):
+    """
+    The parameters of a species compiled into an immutable block,
+    together with the constants that are derived from them
+    """
+    w_birth: float
+    sigma_birth: float
+    beta: float
+    eta: float
+    a_half: float
+    phi_age: float
+    w_half: float
+    phi_weight: float
+    mu: float
+    gamma: float
+    zeta: float
+    xi: float
+    omega: float
+    F: float
+    DeltaPhiMax: float
+    birth_weight_limit: float
+    inv_delta_phi_max: float
+
+    @classmethod
+    def compile(cls, parameters):
+        """
+        :param parameters: dict with the parameters of a species. Herbivores
+        have no DeltaPhiMax, they get infinity since they never hunt
+
+        :return: AnimalParameters
+        """
+        p = {key: float(value) for key, value in parameters.items()}
+        p.setdefault('DeltaPhiMax', np.inf)
+        return cls(birth_weight_limit=p['zeta'] * (p['w_birth'] + p['sigma_birth']),
+                   inv_delta_phi_max=1 / p['DeltaPhiMax'], **p)
 
 
 class Animal:
@@ -17,13 +56,22 @@ class Animal:
     """
 
     parameters = {}
+    params = None
+
+    def __init_subclass__(cls, **kwargs):
+        """
+        Compiles the parameters of every species when it is defined
+        """
+        super().__init_subclass__(**kwargs)
+        cls.params = AnimalParameters.compile(cls.parameters)
 
     @classmethod
     def set_parameters(cls, new_parameters):
         """
         This method allows the user to set the parameters for
         the animals themselves, if they dont want the default ones.
-        Only the values can be changed.
+        Only the values can be changed. The parameter block in params
+        is compiled again from the new values
 
         :param new_parameters: dict
         The dictionary shall have the parameters as keys and the
@@ -35,19 +83,26 @@ class Animal:
             raise TypeError('Parameters must be of type dict')
 
         # Heavily inspired by the biolab project
-        for key in new_parameters:
+        for key, value in new_parameters.items():
             if key not in cls.parameters:
                 raise KeyError('Invalid parameter name: ' + key)
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise TypeError('Parameter {} must be a number'.format(key))
+            if value < 0 or (key == 'DeltaPhiMax' and value == 0):
+                raise ValueError('Parameter {} can not be {}'.format(key, value))
 
+        cls.params = AnimalParameters.compile(dict(cls.parameters, **new_parameters))
         cls.parameters.update(new_parameters)
 
-    def __init__(self, age=0, weight=None):
+    def __init__(self, age=0, weight=None, rng=None):
         """
         Constructor for the Animal superclass
 
         :param age: Has to be a positive int
 
         :param weight: can be of either int or float, but has to be positive
+
+        :param rng: numpy Generator used for the birth weight if weight is None
         """
 
         if not isinstance(age, int):
@@ -64,7 +119,7 @@ class Animal:
 
         self.age = age
         if weight is None:
-            self.weight = self.weight_at_birth()
+            self.weight = self.weight_at_birth(rng)
         else:
             self.weight = weight
         self.fitness = self.compute_fitness()
@@ -100,12 +155,34 @@ class Animal:
 
         if self.weight == 0:
             self.fitness = 0
+            return self.fitness
         else:
-            p = self.parameters
-            fit = self.compute_q(+1, self.age, p['a_half'], p['phi_age']) * \
-                self.compute_q(-1, self.weight, p['w_half'], p['phi_weight'])
+            p = self.params
+            fit = self.compute_q(+1, self.age, p.a_half, p.phi_age) * \
+                self.compute_q(-1, self.weight, p.w_half, p.phi_weight)
             return fit
 
+    @classmethod
+    def fitness_kernel(cls, age, weight):
+        """
+        Computes the fitness of many animals of the species at once.
+        Gives the same values as compute_fitness, also for animals
+        with no weight, which get fitness 0
+
+        :param age: array of ages
+
+        :param weight: array of weights, same length as age
+
+        :return: array of floats with the fitness of each animal
+        """
+
+        p = cls.params
+        age = np.asarray(age)
+        weight = np.asarray(weight)
+        fit = cls.compute_q(+1, age, p.a_half, p.phi_age) * \
+            cls.compute_q(-1, weight, p.w_half, p.phi_weight)
+        return np.where(weight == 0, 0.0, fit)
+
     def recalculate_fitness(self):
         """
         recalculates and updates fitness based on
@@ -124,31 +201,34 @@ class Animal:
         self.age += 1
         self.recalculate_fitness()
 
-    def will_move(self):
+    def will_move(self, rng=None):
         """
         This method doesn't actually make the animals migrate,
         it only decide whether or not it will actually move and is called
         upon later
 
+        :param rng: numpy Generator, a shared one is used if None
+
         :return: bool
         If its False the animals simply stay in the cell, if its True
         The animals will migrate to one of four adjacent cells
         """
 
-        prob_move = self.parameters['mu'] * self.fitness
-        random_num = np.random.random()
+        prob_move = self.params.mu * self.fitness
+        random_num = resolve_generator(rng).random()
         return prob_move > random_num
 
-    def weight_at_birth(self):
+    def weight_at_birth(self, rng=None):
         """
         If a new animal is born or the age is put at 0
         (aka the animal placed is a newborn),
         We will assign a weight from a normal distribution.
+
+        :param rng: numpy Generator, a shared one is used if None
         """
-        return np.random.normal(self.parameters['w_birth'],
-                                self.parameters['sigma_birth'])
+        return resolve_generator(rng).normal(self.params.w_birth, self.params.sigma_birth)
 
-    def give_birth(self, num_animals):
+    def give_birth(self, num_animals, rng=None):
         """
         Here we calculate the probability for an animal to give birth.
         We also check a weight condition.
@@ -157,15 +237,17 @@ class Animal:
         if there are less than 2 no animals will be born, but that
         condition is checked in landscape
 
+        :param rng: numpy Generator, a shared one is used if None
+
         :return: bool
         If its False no animal is born, if its True an animal is born
         each animal can only give birth once per year.
         """
 
-        p = self.parameters
-        random_num = np.random.random()
-        prob_birth = np.min([1, p['gamma'] * self.fitness * (num_animals - 1)])
-        if self.weight < p['zeta'] * (p['w_birth'] + p['sigma_birth']):
+        p = self.params
+        random_num = resolve_generator(rng).random()
+        prob_birth = min(1, p.gamma * self.fitness * (num_animals - 1))
+        if self.weight < p.birth_weight_limit:
             return False
         else:
             return random_num < prob_birth
@@ -176,7 +258,7 @@ class Animal:
         based on certain parameters. The fitness is recalculated after
         """
 
-        self.weight -= self.weight * self.parameters['eta']
+        self.weight -= self.weight * self.params.eta
         self.recalculate_fitness()
 
     def weight_after_birth(self, weight):
@@ -187,15 +269,17 @@ class Animal:
         :param weight: int, float
         """
 
-        self.weight -= self.parameters['xi'] * weight
+        self.weight -= self.params.xi * weight
         self.recalculate_fitness()
 
-    def death(self):
+    def death(self, rng=None):
         """
         The animals will die if their weight is 0 or less
         (although it shouldn't be less than 0). If it has a positive weight
         the probability of death is calculated by certain parameters
 
+        :param rng: numpy Generator, a shared one is used if None
+
         :return: bool
         True means the animal dies, False means it lives
         """
@@ -203,8 +287,8 @@ class Animal:
         if self.weight <= 0:
             return True
         else:
-            prob_death = self.parameters['omega'] * (1 - self.fitness)
-            random_num = np.random.random()
+            prob_death = self.params.omega * (1 - self.fitness)
+            random_num = resolve_generator(rng).random()
             return prob_death > random_num
 
     def set_has_migrated(self, boolean):
@@ -232,12 +316,12 @@ class Herbivore(Animal):
                       0.1, 'mu': 0.25, 'gamma': 0.2, 'zeta': 3.5, 'xi': 1.2,
                   'omega': 0.4, 'F': 10.0}
 
-    def __init__(self, age=0, weight=None):
+    def __init__(self, age=0, weight=None, rng=None):
         """
         subclass constructor, inherits from the superclass
         """
 
-        super().__init__(age, weight)
+        super().__init__(age, weight, rng)
 
     def eat(self, food_available):
         """
@@ -253,11 +337,9 @@ class Herbivore(Animal):
         How much the animal has eaten
         """
 
-        if food_available < self.parameters['F']:
-            food_eaten = food_available
-        else:
-            food_eaten = self.parameters['F']
-        self.weight += self.parameters['beta'] * food_eaten
+        p = self.params
+        food_eaten = food_available if food_available < p.F else p.F
+        self.weight += p.beta * food_eaten
         self.recalculate_fitness()
         return food_eaten
 
@@ -273,14 +355,14 @@ class Carnivore(Animal):
                       3.5, 'xi': 1.1, 'omega': 0.8, 'F': 50.0, 'DeltaPhiMax':
                       10.0}
 
-    def __init__(self, age=0, weight=None):
+    def __init__(self, age=0, weight=None, rng=None):
         """
         subclass constructor, inherits from the Superclass
         """
 
-        super().__init__(age, weight)
+        super().__init__(age, weight, rng)
 
-    def will_kill_herb(self, herb):
+    def will_kill_herb(self, herb, rng=None):
         """
         checks several conditions to see if a Carnivore
         can/and or will kill a herbivore. This is called upon
@@ -288,20 +370,21 @@ class Carnivore(Animal):
 
         :param herb: An instance of Herbivore
 
+        :param rng: numpy Generator, a shared one is used if None
+
         :return: bool
         The kill is successful if it returns True.
         """
 
-        random_num = np.random.random()
+        random_num = resolve_generator(rng).random()
         if self.fitness <= herb.fitness:
             return False
-        elif 0 < (self.fitness - herb.fitness) < self.parameters['DeltaPhiMax']:
-            return ((self.fitness - herb.fitness)
-                    / self.parameters['DeltaPhiMax']) > random_num
+        elif 0 < (self.fitness - herb.fitness) < self.params.DeltaPhiMax:
+            return (self.fitness - herb.fitness) * self.params.inv_delta_phi_max > random_num
         else:
             return True
 
-    def eat_a_herb(self, sorted_herb_list):
+    def eat_a_herb(self, sorted_herb_list, rng=None):
         """
         The carnivores checks if it kills a herbivore.
         If it doess kill, it will eat the herbivore until there is
@@ -312,23 +395,26 @@ class Carnivore(Animal):
         from lowest to highest. The ones with lowest gets killed and eaten
         first
 
+        :param rng: numpy Generator, a shared one is used if None
+
         :return: list
         a list of surviving herbivores
         """
 
+        p = self.params
         dead_herbs = []
         surv_herbs = []
         eaten_amount = 0
         for herb in sorted_herb_list:
-            if self.will_kill_herb(herb):
-                eats = min(herb.weight, self.parameters['F'] - eaten_amount)
+            if self.will_kill_herb(herb, rng):
+                eats = min(herb.weight, p.F - eaten_amount)
                 eaten_amount += eats
-                self.weight += self.parameters['beta'] * eats
+                self.weight += p.beta * eats
                 self.recalculate_fitness()
                 dead_herbs.append(herb)
             else:
                 surv_herbs.append(herb)
 
-            if eaten_amount >= self.parameters['F']:
+            if eaten_amount >= p.F:
                 break
         return surv_herbs
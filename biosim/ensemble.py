@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+"""
+Runs the same simulation for many seeds in a process pool. The
+replicates step an Island directly, so no figures are made, and only
+the number of animals of each species per year is sent back.
+"""
+
+__author__ = 'Peter Langdalen'
+__email__ = 'pelangda@nmbu.no'
+
+import multiprocessing
+import os
+import queue
+import numpy as np
+
+from biosim.animals import Herbivore, Carnivore
+from biosim.landscape import Lowland, Highland
+from biosim.island import Island
+from biosim.random_streams import RandomStreams
+
+_parameter_classes = {'Herbivore': Herbivore, 'Carnivore': Carnivore,
+                      'L': Lowland, 'H': Highland}
+_progress = None
+_started = None
+
+
+def set_parameters(parameters):
+    """
+    Sets animal and landscape parameters
+
+    :param parameters: dict with species names or landscape code letters
+    as keys and parameter dicts as values, e.g. {'Herbivore': {'F': 8.}}
+    """
+    for name, params in (parameters or {}).items():
+        if name not in _parameter_classes:
+            raise KeyError('Invalid species or landscape: ' + name)
+        _parameter_classes[name].set_parameters(params)
+
+
+def run_replicate(island_map, ini_pop, seed, num_years, parameters=None,
+                  flat=True, index=0, report=None):
+    """
+    Runs one simulation without any visualization
+
+    :param island_map: Multi-line string specifying island geography
+    :param ini_pop: List of dictionaries specifying initial population
+    :param seed: the seed of the simulation
+    :param num_years: number of years to simulate
+    :param parameters: dict with parameter overrides, see set_parameters.
+    The parameters they override are set back when the replicate is done
+    :param flat: bool, passed on to Island
+    :param index: int, the number of the replicate in the ensemble
+    :param report: function called with index, the year and the counts
+    of the year, as soon as the year is done
+
+    :return: array with the number of herbivores and carnivores after each year
+    """
+    saved = {name: dict(_parameter_classes[name].parameters)
+             for name in (parameters or {}) if name in _parameter_classes}
+    try:
+        set_parameters(parameters)
+        island = Island(island_map, flat=flat, streams=RandomStreams(seed))
+        island.add_population(ini_pop)
+        counts = np.zeros((num_years, 2), dtype=np.int64)
+        for year in range(num_years):
+            island.annual_cycle()
+            counts[year] = [grid.sum() for grid in island.count_grids().values()]
+            if report is not None:
+                report(index, year + 1, counts[year])
+    finally:
+        set_parameters(saved)
+    return counts
+
+
+def _report_progress(index, year, counts):
+    """
+    Puts the counts of a year on the progress queue of a pool worker
+    """
+    _progress.put((index, year, counts))
+
+
+def _run_in_worker(*task):
+    """
+    Runs a replicate in a pool worker, reporting on the progress queue.
+    The replicate number and the process id of the worker are put on the
+    started queue first, so the worker can be watched
+    """
+    _started.put((task[-1], os.getpid()))
+    return run_replicate(*task, report=_report_progress)
+
+
+def _start_worker(progress, started):
+    """
+    Gives a pool worker the queues it reports progress on
+
+    :param progress: multiprocessing Queue
+    :param started: multiprocessing SimpleQueue, which is written to at
+    once, so it is not lost if the worker dies right after
+    """
+    global _progress, _started
+    _progress, _started = progress, started
+
+
+class EnsembleResult:
+    """
+    The yearly animal counts of every replicate in an ensemble
+    """
+    species = ('Herbivore', 'Carnivore')
+
+    def __init__(self, seeds, counts):
+        """
+        Constructor for the EnsembleResult class
+
+        :param seeds: list with the seed of each replicate
+        :param counts: array with shape (replicates, years, species)
+        """
+        self.seeds = list(seeds)
+        self.counts = counts
+
+    @property
+    def years(self):
+        """Array with the years of the counts, starting at 1."""
+        return np.arange(1, self.counts.shape[1] + 1)
+
+    def mean(self):
+        """
+        :return: dict with the species as keys and the mean count
+        of each year as values
+        """
+        mean = self.counts.mean(axis=0)
+        return {name: mean[:, n] for n, name in enumerate(self.species)}
+
+    def quantiles(self, q=(0.05, 0.5, 0.95)):
+        """
+        :param q: sequence of quantiles between 0 and 1
+
+        :return: dict with the species as keys and arrays with one row
+        per quantile and one column per year as values
+        """
+        values = np.quantile(self.counts, q, axis=0)
+        return {name: values[:, :, n] for n, name in enumerate(self.species)}
+
+
+class Ensemble:
+    """
+    The same simulation run for a list of seeds
+    """
+
+    def __init__(self, island_map, ini_pop, seeds, parameters=None,
+                 processes=None, flat=True):
+        """
+        Constructor for the Ensemble class
+
+        :param island_map: Multi-line string specifying island geography
+        :param ini_pop: List of dictionaries specifying initial population
+        :param seeds: list of seeds, one replicate is run for each
+        :param parameters: dict with parameter overrides, see set_parameters
+        :param processes: int, the size of the process pool. All cores are
+        used if None, and 0 runs the replicates in this process
+        :param flat: bool, passed on to Island
+        """
+        self.island_map = island_map
+        self.ini_pop = ini_pop
+        self.seeds = list(seeds)
+        self.parameters = parameters
+        self.processes = os.cpu_count() if processes is None else processes
+        self.flat = flat
+
+    def run(self, num_years, callback=None):
+        """
+        Runs every replicate
+
+        :param num_years: number of years to simulate
+        :param callback: function called with the replicate number, the year
+        and the counts of herbivores and carnivores, as soon as a year of a
+        replicate is done. Years of different replicates arrive in any order
+
+        :return: EnsembleResult, with no replicates if there are no seeds
+
+        :raises RuntimeError: if a pool worker stops in the middle of a
+        replicate, for instance when it is killed for running out of memory
+        """
+        counts = np.zeros((len(self.seeds), num_years, 2), dtype=np.int64)
+        tasks = [(self.island_map, self.ini_pop, seed, num_years,
+                  self.parameters, self.flat, index)
+                 for index, seed in enumerate(self.seeds)]
+
+        if self.processes == 0 or not tasks:
+            for task in tasks:
+                counts[task[-1]] = run_replicate(*task, report=callback)
+            return EnsembleResult(self.seeds, counts)
+
+        progress = multiprocessing.Queue()
+        started = multiprocessing.SimpleQueue()
+        with multiprocessing.Pool(min(self.processes, len(tasks)),
+                                  initializer=_start_worker,
+                                  initargs=(progress, started)) as pool:
+            results = [pool.apply_async(_run_in_worker, task) for task in tasks]
+            workers = {}
+            received = 0
+            while received < counts[..., 0].size:
+                try:
+                    index, year, year_counts = progress.get(timeout=0.1)
+                except queue.Empty:
+                    for result in results:
+                        if result.ready():
+                            result.get(timeout=0)
+                    while not started.empty():
+                        index, pid = started.get()
+                        workers[index] = pid
+                    alive = {process.pid for process in multiprocessing.active_children()}
+                    for index, pid in workers.items():
+                        if pid not in alive and not results[index].ready():
+                            raise RuntimeError('The worker running replicate {} '
+                                               'stopped'.format(index))
+                    continue
+                counts[index, year - 1] = year_counts
+                received += 1
+                if callback is not None:
+                    callback(index, year, year_counts)
+        return EnsembleResult(self.seeds, counts)
@@ -7,10 +7,14 @@
 __author__ = 'Peter Langdalen'
 __email__ = 'pelangda@nmbu.no'
 
-from biosim.landscape import Lowland, Highland, Desert, Water
+from biosim.landscape import Cell, Lowland, Highland, Desert, Water
 from biosim.animals import Herbivore, Carnivore
+from biosim.population import Population
+from biosim.random_streams import RandomStreams
+import functools
 import numpy as np
 import textwrap
+import warnings
 
 
 class Island:
@@ -20,72 +24,705 @@ class Island:
     type_of_landscape = {'W': Water, 'L': Lowland, 'H': Highland, 'D': Desert}
     valid_landscape_types = (Lowland, Highland, Desert)
     anim_species = {'Herbivore': Herbivore, 'Carnivore': Carnivore}
+    _code_of_byte = np.full(256, -1, dtype=np.int8)
+    _code_of_byte[[ord(letter) for letter in type_of_landscape]] = range(len(type_of_landscape))
 
-    def __init__(self, island_map_as_string):
+    def __init__(self, island_map_as_string, flat=False, streams=None):
         """
         The island class constructor
 
         :param island_map_as_string: multi line string
-        the map is created using a designated method
+        the map is created using a designated method.
+        The map can also be given as bytes or a uint8 buffer, see parse_map
+
+        :param flat: bool
+        If True the island keeps one population per species for the whole
+        island, with a cell index column, instead of one per cell.
+        The yearly phases then work on all animals of a species at once.
+        No Cell objects are made for a flat island until island is used.
+        Otherwise there is one Cell object for every land cell, in
+        land_cells, and none for the water. The fodder and the animals are
+        then only kept in those cells, so herbivores, carnivores and fodder are None
+
+        :param streams: RandomStreams
+        The random streams the phases draw from, new unseeded ones if None
         """
-        island_map_as_string = textwrap.dedent(island_map_as_string)
-        self.island = self.create_map(island_map_as_string)
+        self.code_grid = self.parse_map(island_map_as_string)
+        self.flat = flat
+        self.streams = RandomStreams() if streams is None else streams
+        self.shape = self.code_grid.shape
+        self._island = None
+
+        self.landscape_classes = list(self.type_of_landscape.values())
+        self.landscape_codes = self.code_grid.reshape(-1)
+        self.habitable = np.array([cls().habitable_cell
+                                   for cls in self.landscape_classes])[self.landscape_codes]
+        self.land = np.flatnonzero(self.habitable)
+        self.land_cells = None if flat else self.make_land_cells()
+        self.neighbour_offsets = np.array([-self.shape[1], self.shape[1], -1, 1])
+        self.count_work = False
+        self.work = dict.fromkeys(self.work_names, 0)
+
+        self.grids = {species.__name__: np.zeros(self.shape, dtype=np.int64)
+                      for species in (Herbivore, Carnivore)}
+        if self.flat:
+            self.fodder = np.zeros(self.landscape_codes.shape)
+            self.herbivores = Population(Herbivore)
+            self.carnivores = Population(Carnivore)
+            for pop in self.populations():
+                pop.track_counts(self.grids[pop.species.__name__].reshape(-1))
+        else:
+            self.fodder = self.herbivores = self.carnivores = None
+            for index, cell in zip(self.land.tolist(), self.land_cells):
+                for pop in cell.populations():
+                    pop.track_counts(
+                        self.grids[pop.species.__name__].reshape(-1)[index:index + 1])
+            self.active = np.zeros(0, dtype=np.int64)
+            self.feeds = 0
+            self.grown_at = np.zeros(len(self.land), dtype=np.int64)
+            self.retired_events = {species.__name__: dict.fromkeys(Population.event_names, 0)
+                                   for species in (Herbivore, Carnivore)}
+
+    @classmethod
+    def from_file(cls, path, flat=False, streams=None):
+        """
+        Makes an island from a map file. The file is memory mapped,
+        so it is read straight into the landscape codes
 
-    def create_map(self, multi_line_string):
+        :param path: str, a file with one line of landscape letters per row
+        :param flat: bool, see the constructor
+        :param streams: RandomStreams, see the constructor
+
+        :return: Island
         """
-        The map is created. First we do a bunch of checks to ensure
-        that the map we get is actually a valid map. Then the map is created
+        return cls(np.memmap(path, dtype=np.uint8, mode='r'), flat, streams)
 
-        :param multi_line_string: multi line string
+    @property
+    def island(self):
+        """
+        The map as a nested list of Cell objects, made the first time it
+        is asked for. The land cells are those in land_cells, and all
+        water cells are the same Water object, which never holds animals.
+        A flat island has no cells of its own, so it gives a new copy
+        from cell_view every time instead
+        """
+        if self.flat:
+            return self.cell_view()
+        if self._island is None:
+            self._island = self.nested_map(self.land_cells)
+        return self._island
 
-        :return: The output is a nested list
+    def nested_map(self, land_cells):
+        """
+        :param land_cells: list with a Cell object for every land cell, in the order of land
+        :return: nested list of Cell objects with the shape of the island
         """
+        cells = np.full(self.landscape_codes.size, Water(), dtype=object)
+        cells[self.land] = land_cells
+        return cells.reshape(self.shape).tolist()
 
-        multi_line_string = multi_line_string.strip()
-        list_of_lists = [list(cel) for cel in multi_line_string.splitlines()]
+    def cell_view(self, populations=None):
+        """
+        Copies the animals and the fodder of a flat island into new Cell
+        objects. Changes to the cells do not reach the island
 
-        top_row = list_of_lists[0]
-        bottom_row = list_of_lists[-1]
-        left_col = [cellcol[0] for cellcol in list_of_lists]
-        right_col = [cellcol[-1] for cellcol in list_of_lists]
+        :param populations: the herbivore and carnivore Population with
+        island cell indices, the island's own if None
 
-        if set(top_row + bottom_row + left_col + right_col) != {'W'}:
-            raise ValueError('edges has to be water!')
+        :return: nested list of Cell objects, see island
+        """
+        land_cells = self.make_land_cells()
+        for cel, fodder in zip(land_cells, self.fodder[self.land].tolist()):
+            cel.fodder = fodder
+        for n, pop in enumerate(self.populations() if populations is None else populations):
+            order = np.argsort(pop.cell, kind='stable')
+            cell_indices, starts = np.unique(pop.cell[order], return_index=True)
+            stops = np.append(starts[1:], len(order))
+            for slot, start, stop in zip(self.land_slots(cell_indices).tolist(), starts, stops):
+                rows = order[start:stop]
+                land_cells[slot].populations()[n].add(pop.age[rows], pop.weight[rows],
+                                                      pop.fitness[rows])
+        return self.nested_map(land_cells)
+
+    def make_land_cells(self):
+        """
+        :return: list with a new Cell object for every land cell,
+        in the order of land
+        """
+        classes = self.landscape_classes
+        return [classes[code]() for code in self.landscape_codes[self.land].tolist()]
+
+    def land_cells_of(self, input_island):
+        """
+        Picks the land cells out of a map
+
+        :param input_island: nested list of Cell objects with the shape of the island
+
+        :return: list with the land cells, in the order of land
+        """
+        if len(input_island) != self.shape[0] or \
+                any(len(row) != self.shape[1] for row in input_island):
+            raise ValueError('The map must be a nested list of cells '
+                             'with shape {}'.format(self.shape))
+        cells = [cel for row in input_island for cel in row]
+        return [cells[index] for index in self.land.tolist()]
+
+    def land_slots(self, cells):
+        """
+        Looks up cells in the compact index of the land cells
 
-        first_length = len(list_of_lists[0])
-        for listof in list_of_lists:
-            if len(listof) != first_length:
+        :param cells: array with flat cell indices, all of them land
+
+        :return: array with the position of each cell in land and land_cells
+        """
+        return np.searchsorted(self.land, cells)
+
+    @classmethod
+    def parse_map(cls, island_map):
+        """
+        Turns a map into a grid of landscape codes, checking that every
+        row has the same length, that every letter is a landscape and that
+        the edges are water. The checks are done on the whole map at once
+
+        :param island_map: multi line string, or bytes or a uint8 buffer
+        such as a np.memmap of a map file. A string is dedented first
+
+        :return: int8 array with the shape of the map and the index of each
+        landscape in type_of_landscape as values
+        """
+        if isinstance(island_map, str):
+            island_map = textwrap.dedent(island_map).encode()
+        raw = np.frombuffer(island_map, dtype=np.uint8) \
+            if isinstance(island_map, (bytes, bytearray, memoryview)) \
+            else np.asarray(island_map, dtype=np.uint8).reshape(-1)
+
+        whitespace = (ord(' '), ord('\t'), ord('\n'), ord('\r'))
+        start, stop = 0, len(raw)
+        while start < stop and raw[start] in whitespace:
+            start += 1
+        while stop > start and raw[stop - 1] in whitespace:
+            stop -= 1
+        raw = raw[start:stop]
+        if len(raw) == 0:
+            raise ValueError('The map is empty')
+        if (raw == ord('\r')).any():
+            raw = raw[raw != ord('\r')]
+
+        is_newline = raw == ord('\n')
+        num_cols = int(np.argmax(is_newline)) if is_newline.any() else len(raw)
+        if (len(raw) + 1) % (num_cols + 1):
+            raise ValueError('Map is not of equal length')
+        num_rows = (len(raw) + 1) // (num_cols + 1)
+        if not (raw[num_cols::num_cols + 1] == ord('\n')).all():
+            raise ValueError('Map is not of equal length')
+        letters = np.lib.stride_tricks.as_strided(raw, shape=(num_rows, num_cols),
+                                                  strides=(num_cols + 1, 1),
+                                                  writeable=False)
+
+        codes = cls._code_of_byte[letters]
+        if (codes < 0).any():
+            if (letters == ord('\n')).any():
                 raise ValueError('Map is not of equal length')
+            raise ValueError('Invalid landscape')
+        if (codes[[0, -1], :] != 0).any() or (codes[:, [0, -1]] != 0).any():
+            raise ValueError('edges has to be water!')
+        return codes
+
+    @classmethod
+    def cells_from_codes(cls, code_grid):
+        """
+        Makes one Cell object for every landscape code
 
-        for listof in list_of_lists:
-            for strings in listof:
-                if strings not in ['W', 'L', 'H', 'D']:
-                    raise ValueError('Invalid landscape')
+        :param code_grid: array from parse_map
 
-        cells_object_list_of_list = []
-        for i, row in enumerate(list_of_lists):
-            one_d_list = []
-            for j, cell in enumerate(row):
-                one_d_list.append(self.type_of_landscape[list_of_lists[i][j]]())
-            cells_object_list_of_list.append(one_d_list)
+        :return: nested list of Cell objects
+        """
+        classes = list(cls.type_of_landscape.values())
+        return [[classes[code]() for code in row] for row in code_grid.tolist()]
+
+    def create_map(self, multi_line_string):
+        """
+        The map is created. First we check that the map we get is
+        actually a valid map, see parse_map. Then the map is created
+
+        :param multi_line_string: multi line string
+
+        :return: The output is a nested list
+        """
+        return self.cells_from_codes(self.parse_map(multi_line_string))
 
-        return cells_object_list_of_list
+    phase_names = ('feed', 'procreate', 'migrate', 'age', 'weight_loss', 'die')
+    work_names = ('animals_processed', 'cells_visited')
 
-    def annual_cycle(self, input_island):
+    def annual_cycle(self, input_island=None):
         """
         The entire cycle is handled. This will repeat once every year
 
         :param input_island: When we call this in simulation the map
         that is initiated there will be passed in this method.
         Several of the other methods have this input_island
-        so i will simply refer to this param as the map
+        so i will simply refer to this param as the map.
+        It is a nested list of Cell objects with the shape of the island,
+        such as Island.island, and only its land cells are gone through.
+        The island's own cells are used if it is not given
+        """
+        for _, phase in self.phases(input_island):
+            phase()
+
+    def phases(self, input_island=None):
+        """
+        The phases of the annual cycle, so they can also be run
+        and timed one by one
+
+        :param input_island: the map, see annual_cycle. If it is not given
+        in cell mode, every phase only goes through the active cells
+
+        :return: list with a (name, function) pair for each phase, in the
+        order they happen. The names are those in phase_names
+        """
+        if self.flat:
+            functions = (self.flat_feed, self.flat_procreate, self.flat_migrate,
+                         self.flat_age, self.flat_weight_loss, self.flat_die)
+        elif input_island is None or input_island is self._island:
+            functions = (
+                self.active_feed,
+                functools.partial(self.on_active_cells, self.animals_procreate,
+                                  self.streams['procreate']),
+                functools.partial(self.start_migration, None, self.streams['migrate']),
+                functools.partial(self.on_active_cells, self.animals_age),
+                functools.partial(self.on_active_cells, self.animals_weightloss),
+                functools.partial(self.on_active_cells, self.animals_die,
+                                  self.streams['death']))
+        else:
+            input_island = self.land_cells_of(input_island)
+            functions = (
+                functools.partial(self.on_cells, self.animals_feed_all, input_island,
+                                  self.streams['feed']),
+                functools.partial(self.on_cells, self.animals_procreate, input_island,
+                                  self.streams['procreate']),
+                functools.partial(self.start_migration, input_island, self.streams['migrate']),
+                functools.partial(self.on_cells, self.animals_age, input_island),
+                functools.partial(self.on_cells, self.animals_weightloss, input_island),
+                functools.partial(self.on_cells, self.animals_die, input_island,
+                                  self.streams['death']))
+        return list(zip(self.phase_names, functions))
+
+    def flat_procreate(self):
+        """
+        Procreation for the island wide populations
+        """
+        self.add_work()
+        for pop in self.populations():
+            pop.procreate(self.streams['procreate'])
+
+    def flat_migrate(self):
+        """
+        Migration for the island wide populations
+        """
+        self.add_work()
+        for pop in self.populations():
+            pop.migrate(self.neighbour_offsets, self.habitable, self.streams['migrate'])
+
+    def flat_age(self):
+        """
+        Aging for the island wide populations
+        """
+        self.add_work()
+        for pop in self.populations():
+            pop.update_age()
+
+    def flat_weight_loss(self):
+        """
+        Weight loss for the island wide populations
+        """
+        self.add_work()
+        for pop in self.populations():
+            pop.yearly_weight_loss()
+
+    def flat_die(self):
+        """
+        Death for the island wide populations
+        """
+        self.add_work()
+        for pop in self.populations():
+            pop.keep(~pop.death(self.streams['death']))
+
+    def flat_feed(self):
+        """
+        The fodder grows in every cell, the herbivores graze and then
+        the carnivores hunt in the cells where there are herbivores
+        """
+        self.add_work()
+        self.fodder[:] = self.f_max_per_code()[self.landscape_codes]
+        rng = self.streams['feed']
+        self.herbivores.graze(self.fodder, rng)
+        self.hunt(self.herbivores, self.carnivores, rng)
+
+    def f_max_per_code(self):
+        """
+        :return: array with the current f_max of each landscape class,
+        in the order of the landscape codes
+        """
+        return np.array([cls.params.f_max for cls in self.landscape_classes], dtype=float)
+
+    @staticmethod
+    def hunt(herbs, carns, rng=None):
+        """
+        The carnivores of island wide populations hunt cell by cell.
+        Both populations are sorted by cell and fitness, so the animals
+        of each cell are a slice of the columns
+
+        :param herbs: herbivore Population with a cell index column
+        :param carns: carnivore Population with a cell index column
+        :param rng: numpy Generator, a shared one is used if None
+        """
+        if len(herbs) == 0 or len(carns) == 0:
+            return
+        carns.reorder(np.lexsort((-carns.fitness, carns.cell)))
+        herbs.reorder(np.lexsort((herbs.fitness, herbs.cell)))
+
+        killed = np.zeros(len(herbs), dtype=bool)
+        carn_cells, carn_starts = np.unique(carns.cell, return_index=True)
+        carn_stops = np.append(carn_starts[1:], len(carns))
+        herb_starts = np.searchsorted(herbs.cell, carn_cells, side='left')
+        herb_stops = np.searchsorted(herbs.cell, carn_cells, side='right')
+        for c_start, c_stop, h_start, h_stop in zip(carn_starts, carn_stops,
+                                                    herb_starts, herb_stops):
+            if h_start < h_stop:
+                killed[h_start:h_stop] = carns.prey_on(herbs, slice(c_start, c_stop),
+                                                       slice(h_start, h_stop), rng)
+        herbs.keep(~killed)
+
+    def populations(self):
+        """
+        :return: tuple with the island wide herbivore and
+        carnivore populations of a flat island. In cell mode the
+        animals are only kept in the populations of land_cells
+        """
+        return self.herbivores, self.carnivores
+
+    def add_population(self, population):
+        """
+        Add a population to each cell on the island
+
+        :param population: List of dictionaries specifying population.
+        Animals placed in water are left out with a warning, since
+        nothing is stored for the water cells
+        """
+        rng = self.streams['place']
+        for cell_coord in population:
+            x, y = cell_coord.get('loc')
+            if not (0 <= x < self.shape[0] and 0 <= y < self.shape[1]):
+                raise ValueError('{} is outside the island'.format((x, y)))
+            if not self.habitable[x * self.shape[1] + y]:
+                warnings.warn('No animals can live in water, those placed '
+                              'at {} are left out'.format((x, y)))
+                continue
+            if not self.flat:
+                slot = self.land_slots(x * self.shape[1] + y)
+                self.land_cells[slot].place_animals(cell_coord.get('pop'), rng)
+                self.activate([slot])
+                continue
+
+            cell = Cell()
+            cell.place_animals(cell_coord.get('pop'), rng)
+            for pop, new_pop in zip(self.populations(), cell.populations()):
+                new_pop.cell[:] = x * self.shape[1] + y
+                pop.extend(new_pop)
+
+    def count_grids(self):
         """
-        self.animals_feed_all(input_island)
-        self.animals_procreate(input_island)
-        self.start_migration(input_island)
-        self.animals_age(input_island)
-        self.animals_weightloss(input_island)
-        self.animals_die(input_island)
+        Counts the animals of each species in every cell. The grids are
+        kept up to date by the populations, so this is only a copy
+
+        :return: dict
+        The species are keys, arrays with the same shape as the map are values
+        """
+        return {species: grid.copy() for species, grid in self.grids.items()}
+
+    def count_animals(self):
+        """
+        :return: dict with the species as keys and the number
+        of animals on the island as values
+        """
+        if self.flat:
+            return {pop.species.__name__: len(pop) for pop in self.populations()}
+        return {species: int(grid.sum()) for species, grid in self.grids.items()}
+
+    def cells(self):
+        """
+        :return: list with the Cell objects of the land cells, in the order of land
+        """
+        return self.land_cells
+
+    def active_cells(self):
+        """
+        :return: list with the Cell objects of the active cells, in the order
+        of land. The active cells are those that have had animals since
+        the start of the year
+        """
+        return [self.land_cells[slot] for slot in self.active.tolist()]
+
+    def activate(self, slots):
+        """
+        Makes land cells active. The fodder of a cell that was idle the
+        last time the island was fed is settled first, by growing it
+        as it would have grown then
+
+        :param slots: array with positions in land_cells
+        """
+        new = np.setdiff1d(slots, self.active)
+        if len(new) == 0:
+            return
+        for slot in new[self.grown_at[new] < self.feeds].tolist():
+            self.land_cells[slot].grow_fodder()
+        self.grown_at[new] = self.feeds
+        self.active = np.union1d(self.active, new)
+
+    def refresh_active(self):
+        """
+        Makes the active cells those that have animals in the count grids,
+        so animals placed straight into a Cell object are also gone through.
+        The active cells that have no animals left become idle, and their
+        events since the last yearly_statistics are kept in retired_events
+        """
+        occupied = np.flatnonzero(sum(grid.reshape(-1)[self.land]
+                                      for grid in self.grids.values()))
+        emptied = np.isin(self.active, occupied, invert=True)
+        for slot in self.active[emptied].tolist():
+            for pop in self.land_cells[slot].populations():
+                retired = self.retired_events[pop.species.__name__]
+                for name, value in pop.events.items():
+                    retired[name] += value
+                pop.events = dict.fromkeys(pop.event_names, 0)
+        self.active = self.active[~emptied]
+        self.activate(occupied)
+
+    def settle_fodder(self):
+        """
+        Grows the fodder of every cell that was idle the last time the
+        island was fed, so the fodder of all cells is up to date
+        """
+        for slot in np.flatnonzero(self.grown_at < self.feeds).tolist():
+            self.land_cells[slot].grow_fodder()
+        self.grown_at[:] = self.feeds
+
+    def active_feed(self):
+        """
+        The feeding in cell mode. Only the cells with animals are fed,
+        the fodder of the others is settled when animals arrive
+        """
+        self.refresh_active()
+        self.add_work()
+        self.feeds += 1
+        self.grown_at[self.active] = self.feeds
+        self.animals_feed_all(self.active_cells(), self.streams['feed'])
+
+    def on_active_cells(self, phase, *args):
+        """
+        Runs a cell mode phase on the active cells
+
+        :param phase: one of the animals_ phases, taking the cells first
+        :param args: the other arguments of the phase
+        """
+        self.add_work()
+        phase(self.active_cells(), *args)
+
+    def on_cells(self, phase, cells, *args):
+        """
+        Runs a cell mode phase on the given cells
+
+        :param phase: one of the animals_ phases, taking the cells first
+        :param cells: list with the land cells of a map, see land_cells_of
+        :param args: the other arguments of the phase
+        """
+        self.add_work(cells)
+        phase(cells, *args)
+
+    def add_work(self, cells=None):
+        """
+        Counts the animals and the cells a phase is about to go through,
+        if count_work is set. A cell mode phase goes through the active
+        cells, or the cells it is given, a flat phase through the cells
+        that have animals
+
+        :param cells: list with the Cell objects the phase goes through,
+        or None for the active cells
+        """
+        if not self.count_work:
+            return
+        if cells is not None:
+            animals = sum(len(pop) for cel in cells for pop in cel.populations())
+            visited = len(cells)
+        elif self.flat:
+            animals = sum(len(pop) for pop in self.populations())
+            visited = int(np.count_nonzero(sum(self.grids.values())))
+        else:
+            index = self.land[self.active]
+            animals = sum(int(grid.reshape(-1)[index].sum()) for grid in self.grids.values())
+            visited = len(index)
+        self.work['animals_processed'] += animals
+        self.work['cells_visited'] += visited
+
+    def take_work(self):
+        """
+        :return: dict with the work counted since the last call, with the
+        names in work_names as keys, see add_work
+        """
+        work, self.work = self.work, dict.fromkeys(self.work_names, 0)
+        return work
+
+    def get_state(self):
+        """
+        Collects the animals and the fodder of the island in flat arrays.
+        In cell mode the animals are gathered cell by cell, keeping their
+        order within each cell
+
+        :return: dict with '<species>_<column>' keys for the age, weight,
+        fitness and cell columns of each species, and 'fodder'. A flat
+        island also gives the count grid of each species, '<species>_counts',
+        so set_state does not have to count the animals
+        """
+        state = {}
+        if self.flat:
+            parts = {pop.species.__name__: [pop] for pop in self.populations()}
+            state['fodder'] = self.fodder.copy()
+            for species, grid in self.grids.items():
+                state[species + '_counts'] = grid.reshape(-1).copy()
+        else:
+            self.refresh_active()
+            self.settle_fodder()
+            cells = self.cells()
+            parts = {species.__name__: [Population(species)]
+                     for species in (Herbivore, Carnivore)}
+            for index, cel in zip(self.land[self.active].tolist(), self.active_cells()):
+                for pop in cel.populations():
+                    if len(pop):
+                        part = pop.take(slice(None))
+                        part.cell[:] = index
+                        parts[pop.species.__name__].append(part)
+            state['fodder'] = np.zeros(self.landscape_codes.shape)
+            state['fodder'][self.land] = [cel.fodder for cel in cells]
+
+        for species, pops in parts.items():
+            for column in ('age', 'weight', 'fitness', 'cell'):
+                state[species + '_' + column] = np.concatenate(
+                    [getattr(pop, column) for pop in pops])
+        return state
+
+    def set_state(self, state):
+        """
+        Replaces the animals and the fodder with those in a state.
+        A flat island uses the columns of the state as its storage, without
+        copying them if they are writable arrays of the right type, such as
+        copy-on-write memory maps. In cell mode the animals are copied into
+        the populations of their cells
+
+        :param state: dict in the form returned by get_state
+        """
+        if self.flat:
+            self.fodder[:] = state['fodder']
+            pops = {pop.species.__name__: [pop] for pop in self.populations()}
+        else:
+            cells = self.cells()
+            for cel, fodder in zip(cells, np.asarray(state['fodder'])[self.land].tolist()):
+                cel.fodder = fodder
+            self.grown_at[:] = self.feeds
+            self.active = np.zeros(0, dtype=np.int64)
+            pops = {species.__name__: [cel.populations()[n] for cel in cells]
+                    for n, species in enumerate((Herbivore, Carnivore))}
+
+        for species, species_pops in pops.items():
+            for pop in species_pops:
+                pop.keep(np.zeros(len(pop), dtype=bool))
+            age, weight, fitness, cell = (state[species + '_' + column]
+                                          for column in ('age', 'weight', 'fitness', 'cell'))
+            if self.flat:
+                species_pops[0].attach(age, weight, fitness, cell,
+                                       state.get(species + '_counts'))
+                continue
+            cell_indices, starts = np.unique(cell, return_index=True)
+            stops = np.append(starts[1:], len(cell))
+            slots = self.land_slots(cell_indices)
+            self.activate(slots)
+            for slot, start, stop in zip(slots, starts, stops):
+                species_pops[slot].add(age[start:stop], weight[start:stop],
+                                        fitness[start:stop])
+
+    def yearly_statistics(self):
+        """
+        Collects the statistics of the year that just ended, and starts
+        counting births, deaths, kills and migrations from zero again
+
+        :return: dict with the species as keys and dicts with the count,
+        the events and the mean age, weight and fitness as values
+        """
+        if self.flat:
+            return self.combine_summaries([(pop.species.__name__, pop.summary())
+                                           for pop in self.populations()])
+        retired = [(species, dict(events, count=0, age=0, weight=0., fitness=0.))
+                   for species, events in self.retired_events.items()]
+        self.retired_events = {species: dict.fromkeys(Population.event_names, 0)
+                               for species in self.retired_events}
+        return self.combine_summaries(retired + [(pop.species.__name__, pop.summary())
+                                                 for cel in self.active_cells()
+                                                 for pop in cel.populations()])
+
+    def histograms(self, edges):
+        """
+        Counts the animals of each species in bins of age, weight or fitness
+
+        :param edges: dict with the column names as keys and bin edges as values
+
+        :return: dict with the column names as keys and dicts with the
+        count in each bin for each species as values
+        """
+        if self.flat:
+            pops = self.populations()
+        else:
+            pops = [pop for cel in self.active_cells() for pop in cel.populations() if len(pop)]
+        return self.combine_histograms([(pop.species.__name__,
+                                         {column: pop.histogram(column, column_edges)
+                                          for column, column_edges in edges.items()})
+                                        for pop in pops], edges)
+
+    @staticmethod
+    def combine_histograms(histograms, edges):
+        """
+        Adds up the histograms of several populations
+
+        :param histograms: list of (species name, dict of column histograms) pairs
+        :param edges: dict with the column names as keys and bin edges as values
+
+        :return: dict in the form returned by histograms
+        """
+        totals = {column: {species.__name__: np.zeros(len(column_edges) - 1, dtype=np.int64)
+                           for species in (Herbivore, Carnivore)}
+                  for column, column_edges in edges.items()}
+        for species, pop_histograms in histograms:
+            for column, counts in pop_histograms.items():
+                totals[column][species] += counts
+        return totals
+
+    @staticmethod
+    def combine_summaries(summaries):
+        """
+        Adds up population summaries and turns the column sums into means
+
+        :param summaries: list of (species name, Population.summary) pairs
+
+        :return: dict in the form returned by yearly_statistics
+        """
+        totals = {}
+        for species, summary in summaries:
+            total = totals.setdefault(species, dict.fromkeys(summary, 0))
+            for key, value in summary.items():
+                total[key] += value
+        for total in totals.values():
+            for column in ('age', 'weight', 'fitness'):
+                total['mean_' + column] = total.pop(column) / total['count'] \
+                    if total['count'] else np.nan
+        return totals
 
     @staticmethod
     def get_adjacent_cells(current_cell_coord):
@@ -101,69 +738,135 @@ class Island:
         four_adj_cells = [(x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)]
         return four_adj_cells
 
-    def start_migration(self, input_island):
+    def start_migration(self, input_island=None, rng=None):
         """
-        This handles how animals migrate. First we ensure that the animals can migrate
-        by setting the has_migrated flag to false. Due to the way my island is set up
-        we need the triple for-loops.
-        It then checks that the cell is habitable, then it proceeds to migrate the animals
-        Lastly the animals are removed from the current cell and added to the one they have
-        migrated too.
-
-        :param input_island: the map
+        This handles how animals migrate. The decisions and destinations of
+        every animal of a species on the island are drawn at once, from the
+        state before anyone has moved, so each animal decides only once.
+        Moves into cells that are not habitable are rejected with the
+        precomputed habitable mask. Then every cell drops its emigrants in
+        one go, and the migrants are handed out to their new cells sorted
+        by destination.
+
+        :param input_island: the map, see annual_cycle, or a list with
+        its land cells in the order of land. By default only the island's
+        active cells are gone through, and the cells that animals move
+        into become active. The cells of another map are never made active
+
+        :param rng: numpy Generator, the island's migration stream by default
         """
-        for row, rows_of_cell_obj in enumerate(input_island):
-            for col, cel in enumerate(rows_of_cell_obj):
-                for anim in cel.herbivore + cel.carnivore:
-                    anim.set_has_migrated(False)
+        own_cells = input_island is None or input_island is self._island
+        if input_island is None:
+            slots, cells, targets = self.active, self.active_cells(), self.land_cells
+        else:
+            if len(input_island) and isinstance(input_island[0], list):
+                input_island = self.land_cells_of(input_island)
+            slots, cells, targets = np.arange(len(input_island)), input_island, input_island
+        self.add_work(None if input_island is None else cells)
+        if rng is None:
+            rng = self.streams['migrate']
+
+        for species_num, species in enumerate((Herbivore, Carnivore)):
+            pops = [cel.populations()[species_num] for cel in cells]
+            sizes = np.array([len(pop) for pop in pops])
+            if sizes.sum() == 0:
+                continue
+            starts = np.cumsum(sizes) - sizes
+            source = np.repeat(np.arange(len(cells)), sizes)
+
+            fitness = np.concatenate([pop.fitness for pop in pops])
+            prob_move = species.params.mu * fitness
+            movers = np.flatnonzero(prob_move > rng.random(len(fitness)))
+            attempts = np.bincount(source[movers], minlength=len(cells))
+            for cell_index in np.flatnonzero(attempts):
+                pops[cell_index].events['migration_attempts'] += int(attempts[cell_index])
+            destination = self.land[slots[source[movers]]] + self.neighbour_offsets[
+                rng.integers(len(self.neighbour_offsets), size=len(movers))]
+            accepted = self.habitable[destination]
+            movers = movers[accepted]
+            destination = self.land_slots(destination[accepted])
+
+            in_transit = Population(species)
+            source_cells, first = np.unique(source[movers], return_index=True)
+            last = np.append(first[1:], len(movers))
+            for source_cell, start, stop in zip(source_cells, first, last):
+                pop = pops[source_cell]
+                leaving = movers[start:stop] - starts[source_cell]
+                migrants = pop.take(leaving)
+                migrants.cell[:] = destination[start:stop]
+                in_transit.extend(migrants)
+                pop.remove(leaving)
+                pop.events['migrations'] += len(leaving)
+
+            in_transit.reorder(np.argsort(in_transit.cell, kind='stable'))
+            dest_cells, dest_starts = np.unique(in_transit.cell, return_index=True)
+            dest_stops = np.append(dest_starts[1:], len(in_transit))
+            for dest_cell, start, stop in zip(dest_cells, dest_starts, dest_stops):
+                arriving = in_transit.take(slice(start, stop))
+                arriving.cell[:] = 0
+                targets[dest_cell].populations()[species_num].extend(arriving)
+            if own_cells:
+                self.activate(dest_cells)
 
-        for row, rows_of_cell_obj in enumerate(input_island):
-            for col, cel in enumerate(rows_of_cell_obj):
+    @staticmethod
+    def refresh_fitness(input_island):
+        """
+        Recomputes the fitness that is out of date after a phase, for all
+        animals of a species on the island in one go
 
-                if cel.habitable_cell:
-                    adjacent_cord = self.get_adjacent_cells((row, col))
-                    adjacent_cells = [input_island[row][col] for row, col in adjacent_cord]
-                    animals_dct = cel.migration(adjacent_cells)
-                    for migrating_cell, values in animals_dct.items():
-                        if migrating_cell.habitable_cell and values:
-                            migrating_cell.add_migrated_animals(values)
-                            cel.remove_animals(values)
+        :param input_island: the map
+        """
+        Population.refresh_fitness(pop for cel in np.asarray(input_island).flatten()
+                                   for pop in cel.populations())
 
-    @staticmethod
-    def animals_feed_all(input_island):
+    @classmethod
+    def animals_feed_all(cls, input_island, rng=None):
         """
         Here we iterate through all the cells and feed everyone
-        in each cell
+        in each cell. All herbivores graze before the carnivores hunt,
+        so the fitness of the herbivores can be updated in one batch
+        in between
 
         :param input_island: the map
-        """
-        for cel in np.asarray(input_island).flatten():
-            cel.feed_animals()
 
-    @staticmethod
-    def animals_procreate(input_island):
+        :param rng: numpy Generator, a shared one is used if None
+        """
+        cells = np.asarray(input_island).flatten()
+        for cel in cells:
+            cel.grow_fodder()
+            cel.feed_herbivores(rng)
+        cls.refresh_fitness(input_island)
+        for cel in cells:
+            cel.feed_carnivores(rng)
+
+    @classmethod
+    def animals_procreate(cls, input_island, rng=None):
         """
         Here we iterate through all the cells and procreate
         all the animals in each cell
 
         :param input_island: the map
+
+        :param rng: numpy Generator, a shared one is used if None
         """
         for cel in np.asarray(input_island).flatten():
-            cel.procreation_animals()
+            cel.procreation_animals(rng)
+        cls.refresh_fitness(input_island)
 
     @staticmethod
     def animals_age(input_island):
         """
         Here we iterate through all the cells and
-        age the animals
+        age the animals. The fitness is not needed again before the
+        weight loss, so it is recomputed after that phase
 
         :param input_island: the map
         """
         for cel in np.asarray(input_island).flatten():
             cel.aging_animals()
 
-    @staticmethod
-    def animals_weightloss(input_island):
+    @classmethod
+    def animals_weightloss(cls, input_island):
         """
         Here we iterate through all the cells and
         make the animals lose weight
@@ -172,14 +875,17 @@ class Island:
         """
         for cel in np.asarray(input_island).flatten():
             cel.animals_yearly_weight_loss()
+        cls.refresh_fitness(input_island)
 
     @staticmethod
-    def animals_die(input_island):
+    def animals_die(input_island, rng=None):
         """
         Here we iterate through all the cells and
         make the animals die
 
         :param input_island: the map
+
+        :param rng: numpy Generator, a shared one is used if None
         """
         for cel in np.asarray(input_island).flatten():
-            cel.animals_die()
+            cel.animals_die(rng)
@@ -6,9 +6,28 @@
 
 __author__ = 'Peter Langdalen'
 __email__ = 'pelangda@nmbu.no'
+from typing import NamedTuple
 import numpy as np
 from biosim.animals import Herbivore, Carnivore
-import operator
+from biosim.population import Population
+from biosim.random_streams import resolve_generator
+
+
+class LandscapeParameters(NamedTuple):
+    """
+    The parameters of a landscape compiled into an immutable block
+    """
+    f_max: float
+
+    @classmethod
+    def compile(cls, parameters):
+        """
+        :param parameters: dict with the parameters of a landscape.
+        Landscapes without f_max grow no fodder
+
+        :return: LandscapeParameters
+        """
+        return cls(f_max=float(parameters.get('f_max', 0.)))
 
 
 class Cell:
@@ -16,32 +35,101 @@ class Cell:
     This is documentation for the Cell class
     """
     parameters = {}
+    params = LandscapeParameters.compile(parameters)
+
+    def __init_subclass__(cls, **kwargs):
+        """
+        Gives every landscape its own parameters and compiles them
+        """
+        super().__init_subclass__(**kwargs)
+        if 'parameters' not in cls.__dict__:
+            cls.parameters = {}
+        cls.params = LandscapeParameters.compile(cls.parameters)
 
     @classmethod
     def set_parameters(cls, parameters):
         """
         This method allows the user to set the parameters for
         the landscapes themselves, if they dont want the default ones.
-        Only the values can be changed.
+        Only the values can be changed. The parameter block in params
+        is compiled again from the new values
 
         :param parameters: dict
-        If the user doesn't input a dictionary an error will be raised
+        If the user doesn't input a dictionary an error will be raised,
+        and so will it if a key is not a parameter of the landscape
+        or a value is not a positive number
         """
 
         if not isinstance(parameters, dict):
             raise TypeError('parameters must be of type dict')
 
+        for key, value in parameters.items():
+            if key not in cls.parameters:
+                raise KeyError('Invalid parameter name: ' + key)
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise TypeError('Parameter {} must be a number'.format(key))
+            if value < 0:
+                raise ValueError('Parameter {} can not be {}'.format(key, value))
+
+        cls.params = LandscapeParameters.compile(dict(cls.parameters, **parameters))
         cls.parameters.update(parameters)
 
     def __init__(self):
         """
         constructor for Cell superclass.
+        The animals are kept in one Population per species
         """
         self.fodder = 0
-        self.herbivore = []
-        self.carnivore = []
+        self._herbivore = Population(Herbivore)
+        self._carnivore = Population(Carnivore)
         self.habitable_cell = True
 
+    @property
+    def herbivore(self):
+        """
+        The herbivores in the cell, as a Population
+        """
+        return self._herbivore
+
+    @herbivore.setter
+    def herbivore(self, animals):
+        """
+        Replaces the herbivores in the cell
+
+        :param animals: Population or list of Herbivore instances
+        """
+        if not isinstance(animals, Population):
+            animals = Population.from_animals(Herbivore, animals)
+        if self._herbivore.counts is not None:
+            animals.track_counts(self._herbivore.counts)
+        self._herbivore = animals
+
+    @property
+    def carnivore(self):
+        """
+        The carnivores in the cell, as a Population
+        """
+        return self._carnivore
+
+    @carnivore.setter
+    def carnivore(self, animals):
+        """
+        Replaces the carnivores in the cell
+
+        :param animals: Population or list of Carnivore instances
+        """
+        if not isinstance(animals, Population):
+            animals = Population.from_animals(Carnivore, animals)
+        if self._carnivore.counts is not None:
+            animals.track_counts(self._carnivore.counts)
+        self._carnivore = animals
+
+    def populations(self):
+        """
+        :return: tuple with the herbivore and carnivore populations
+        """
+        return self._herbivore, self._carnivore
+
     def grow_fodder(self):
         """
         This happens in the subclasses so its
@@ -49,22 +137,21 @@ class Cell:
         """
         pass
 
-    def add_migrated_animals(self, listofanim):
+    def add_migrated_animals(self, migrated):
         """
         This method is used in the migration, and makes sure that the migrated
         animals are put in the correct cells.
-        it takes a list of animals and extend the corresponding list
-        
-        :param listofanim: list
-        the animals has to be sorted in a list
+
+        :param migrated: dict
+        species name as keys and a Population of arriving animals as values
         """
         if self.habitable_cell:
-            herbs = [anim for anim in listofanim if anim.__class__.__name__ == 'Herbivore']
-            carns = [anim for anim in listofanim if anim.__class__.__name__ == 'Carnivore']
-            self.herbivore.extend(herbs)
-            self.carnivore.extend(carns)
+            for pop in self.populations():
+                arriving = migrated.get(pop.species.__name__)
+                if arriving is not None:
+                    pop.extend(arriving)
 
-    def place_animals(self, list_animals):
+    def place_animals(self, list_animals, rng=None):
         """
         Takes a list of animals and place them in the cell.
         The list must contain dictionaries with the correct keys and values.
@@ -72,10 +159,14 @@ class Cell:
         
         :param list_animals: list
         if it's not a list an error will be raised
+
+        :param rng: numpy Generator for the birth weight of animals placed
+        without a weight, a shared one is used if None
         """
         if not isinstance(list_animals, list):
             raise TypeError('list_animals myst be type list')
 
+        new_animals = {'Herbivore': [], 'Carnivore': []}
         for animal in list_animals:
 
             age = animal['age']
@@ -83,126 +174,101 @@ class Cell:
             species = animal['species']
 
             if species == 'Herbivore':
-                self.herbivore.append(Herbivore(age, weight))
+                new_animals[species].append(Herbivore(age, weight, rng))
             elif species == 'Carnivore':
-                self.carnivore.append(Carnivore(age, weight))
+                new_animals[species].append(Carnivore(age, weight, rng))
             else:
                 raise KeyError('must be either herbivore or carnivore')
 
-    def remove_animals(self, animallist):
+        self.herbivore.extend(new_animals['Herbivore'])
+        self.carnivore.extend(new_animals['Carnivore'])
+
+    def remove_animals(self, rows):
         """
-        This method takes a list of animals and removes
-        them from the cell
+        This method removes animals from the cell, with one compaction
+        per species however many animals are removed
 
-        :param animallist: list
+        :param rows: dict
+        species name as keys and a boolean mask or index array
+        of the animals to remove as values
         """
-        for anim_to_remove in animallist:
-            if anim_to_remove.__class__.__name__ == 'Herbivore':
-                self.herbivore.remove(anim_to_remove)
-            if anim_to_remove.__class__.__name__ == 'Carnivore':
-                self.carnivore.remove(anim_to_remove)
+        for pop in self.populations():
+            remove = rows.get(pop.species.__name__)
+            if remove is not None:
+                pop.remove(remove)
 
-    def feed_herbivores(self):
+    def feed_herbivores(self, rng=None):
         """
         Feeds Herbivores in the cell until there is no fodder, or hungry
-        herbivores left
-        """
-        np.random.shuffle(self.herbivore)
+        herbivores left. The herbivores eat in random order, see
+        Population.graze
 
-        for herb in self.herbivore:
-            food_available = self.fodder
-            food_eaten = herb.eat(food_available)
-            self.fodder -= food_eaten
+        :param rng: numpy Generator, a shared one is used if None
+        """
+        fodder = np.array([self.fodder], dtype=float)
+        self.herbivore.graze(fodder, rng)
+        self.fodder = fodder[0]
 
-    def feed_carnivores(self):
+    def feed_carnivores(self, rng=None):
         """
         Feeds Carnivores in the cell until all carnivores have eaten
         or there are no herbivores left. The fittest carnivores eat first and
         they try to kill/eat the herbivores with the lowest fitness
+
+        :param rng: numpy Generator, a shared one is used if None
         """
-        self.carnivore.sort(key=operator.attrgetter("fitness"), reverse=True)
-        self.herbivore.sort(key=operator.attrgetter("fitness"))
+        carns = self.carnivore
+        herbs = self.herbivore
+        if len(carns) == 0 or len(herbs) == 0:
+            return
 
-        for carn in self.carnivore:
-            self.herbivore = carn.eat_a_herb(self.herbivore)
+        carns.reorder(np.argsort(-carns.fitness, kind='stable'))
+        herbs.reorder(np.argsort(herbs.fitness, kind='stable'))
+        herbs.keep(~carns.prey_on(herbs, rng=rng))
 
-    def feed_animals(self):
+    def feed_animals(self, rng=None):
         """
         This method handles the entire feeding cycle for all animals
+
+        :param rng: numpy Generator, a shared one is used if None
         """
         self.grow_fodder()
-        self.feed_herbivores()
-        self.feed_carnivores()
+        self.feed_herbivores(rng)
+        self.feed_carnivores(rng)
 
-    def procreation_animals(self):
+    def procreation_animals(self, rng=None):
         """
         This method will mate the animals and add the offspring
-        to the list of animals
-        """
-        herb_offspring = []
-        num_adult_herbs = len(self.herbivore)
-
-        if num_adult_herbs > 1:
-            for herb in self.herbivore:
-                new_offspring = herb.give_birth(num_adult_herbs)
-                if new_offspring:
-                    child = Herbivore()
-                    herb_offspring.append(child)
-                    herb.weight_after_birth(child.weight)
-
-        self.herbivore.extend(herb_offspring)
-
-        carn_offspring = []
-        num_adult_carns = len(self.carnivore)
-
-        if num_adult_carns > 1:
-            for carn in self.carnivore:
-                new_offspring = carn.give_birth(num_adult_carns)
-                if new_offspring:
-                    child = Carnivore()
-                    carn_offspring.append(child)
-                    carn.weight_after_birth(child.weight)
+        to the population of the same species
 
-        self.carnivore.extend(carn_offspring)
+        :param rng: numpy Generator, a shared one is used if None
+        """
+        for pop in self.populations():
+            pop.procreate(rng)
 
     def aging_animals(self):
         """
         ages the animals in a cell
         """
-        for herb in self.herbivore:
-            herb.update_age()
-
-        for carn in self.carnivore:
-            carn.update_age()
+        for pop in self.populations():
+            pop.update_age()
 
     def animals_yearly_weight_loss(self):
         """
         Updates the weight of the animals in a cell
         """
-        for herb in self.herbivore:
-            herb.yearly_weight_loss()
-
-        for carn in self.carnivore:
-            carn.yearly_weight_loss()
+        for pop in self.populations():
+            pop.yearly_weight_loss()
 
-    def animals_die(self):
+    def animals_die(self, rng=None):
         """
         Checks if any of the animals die or not.
-        If an animal dies it is removed from the respective list.
-        """
-        dead_herbivores = []
-        for herb in self.herbivore:
-            if herb.death():
-                dead_herbivores.append(herb)
-        for dead_herb in dead_herbivores:
-            self.herbivore.remove(dead_herb)
-
-        dead_carnivores = []
-        for carn in self.carnivore:
-            if carn.death():
-                dead_carnivores.append(carn)
-        for dead_carn in dead_carnivores:
-            self.carnivore.remove(dead_carn)
+        The survivors are kept, the rest are dropped in one go.
+
+        :param rng: numpy Generator, a shared one is used if None
+        """
+        for pop in self.populations():
+            pop.keep(~pop.death(rng))
 
     def get_remaining_fodder(self):
         """
@@ -212,32 +278,31 @@ class Cell:
         """
         return self.fodder
 
-    def migration(self, adj_cells):
+    def migration(self, adj_cells, rng=None):
         """
-        An empty dictionary is created and a list of all the animals are
-        created. At the end we also call on the set_has_migrated from animals
-        and set it to True
+        Decides which animals migrate and where to. Each animal decides
+        once, the island makes sure it is not asked again after moving
+
+        :param adj_cells: a list with the 4 adjacent cells
 
-        :param adj_cells: a list with 4 tuples
+        :param rng: numpy Generator, a shared one is used if None
 
         :return: dict
-        The empty dictionary is returned with each of the
-        adjacent cells as keys and the animals in each cell as values
-        the values are in list form
+        The adjacent cells that animals move to are keys,
+        the values are dicts with the species names as keys and the
+        rows of the animals moving there as values
         """
 
+        rng = resolve_generator(rng)
         anims_that_migrate = {}
-        anim_list = self.carnivore + self.herbivore
-        for anim in anim_list:
-            if anim.will_move() and not anim.animals_has_migrated:
-                destination_cell = np.random.choice(adj_cells)
-                if destination_cell in anims_that_migrate.keys():
-                    anims_that_migrate[destination_cell].append(anim)
-                else:
-                    anims_that_migrate[destination_cell] = [anim]
-
-        for anim in anim_list:
-            anim.set_has_migrated(True)
+        for pop in self.populations():
+            movers = np.flatnonzero(pop.will_move(rng))
+            destinations = rng.integers(len(adj_cells), size=len(movers))
+            for dest_num, destination_cell in enumerate(adj_cells):
+                rows = movers[destinations == dest_num]
+                if len(rows) > 0:
+                    dest_rows = anims_that_migrate.setdefault(destination_cell, {})
+                    dest_rows[pop.species.__name__] = rows
 
         return anims_that_migrate
 
@@ -279,14 +344,14 @@ class Lowland(Cell):
         We set the parameters since fodder can grow here
         """
         super().__init__()
-        self.fodder = self.parameters['f_max']
+        self.fodder = self.params.f_max
 
     def grow_fodder(self):
         """
         Sets the amount of fodder equal to the parameter
         its 800 by default but can be changed
         """
-        self.fodder = self.parameters['f_max']
+        self.fodder = self.params.f_max
 
 
 class Highland(Cell):
@@ -301,11 +366,11 @@ class Highland(Cell):
         We set the parameters since fodder can grow here
         """
         super().__init__()
-        self.fodder = self.parameters['f_max']
+        self.fodder = self.params.f_max
 
     def grow_fodder(self):
         """
         Sets the amount of fodder equal to the parameter
         its 300 by default but can be changed
         """
-        self.fodder = self.parameters['f_max']
+        self.fodder = self.params.f_max
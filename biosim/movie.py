@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+"""
+Writes the frames of a simulation to a movie while it runs. The frames
+are raw RGB arrays, which a background thread pipes into an ffmpeg
+process. Without ffmpeg the frames are streamed into a compressed
+NumPy archive instead, which np.load can read back.
+"""
+
+__author__ = 'Peter Langdalen'
+__email__ = 'pelangda@nmbu.no'
+
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import zipfile
+import numpy as np
+
+
+class MovieWriter:
+    """
+    Encodes frames in a thread of its own
+    """
+
+    def __init__(self, filename, fps=10, ffmpeg='ffmpeg', max_frames=4):
+        """
+        Constructor for the MovieWriter class
+
+        :param filename: str, the movie file, e.g. 'sim.mp4'
+        :param fps: int, frames per second in the movie
+        :param ffmpeg: str, name or path of the ffmpeg program
+        :param max_frames: int, the number of frames that can wait to be
+        encoded before add_frame waits for the encoder
+        """
+        self.fps = fps
+        self.ffmpeg = shutil.which(ffmpeg)
+        if self.ffmpeg is None:
+            filename = os.path.splitext(filename)[0] + '.npz'
+        self.filename = filename
+        self.frames = queue.Queue(max_frames)
+        self.encoder = None
+        self.error = None
+        self.num_frames = 0
+
+    def add_frame(self, frame):
+        """
+        Queues a frame. The encoder is started on the first frame,
+        since it needs the size of the frames
+
+        :param frame: uint8 array with shape (height, width, 3)
+        """
+        if self.error is not None:
+            raise self.error
+        if self.encoder is None:
+            target = self._pipe_to_ffmpeg if self.ffmpeg else self._write_archive
+            self.encoder = threading.Thread(target=target, args=(frame.shape,),
+                                            daemon=True)
+            self.encoder.start()
+        self.frames.put(frame)
+        self.num_frames += 1
+
+    def _next_frames(self):
+        """
+        :return: iterator over the queued frames, until close is called
+        """
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                return
+            yield frame
+
+    def _pipe_to_ffmpeg(self, shape):
+        """
+        The encoder loop when ffmpeg is found
+
+        :param shape: tuple, the shape of the frames
+        """
+        height, width = shape[:2]
+        command = [self.ffmpeg, '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                   '-s', '{}x{}'.format(width, height), '-r', str(self.fps),
+                   '-i', '-', '-an', '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+                   '-vcodec', 'libx264', '-pix_fmt', 'yuv420p', self.filename]
+        try:
+            process = subprocess.Popen(command, stdin=subprocess.PIPE)
+            for frame in self._next_frames():
+                process.stdin.write(np.ascontiguousarray(frame).tobytes())
+            process.stdin.close()
+            if process.wait() != 0:
+                raise RuntimeError('ffmpeg failed to write ' + self.filename)
+        except (OSError, RuntimeError) as error:
+            self.error = error
+            for _ in self._next_frames():
+                pass
+
+    def _write_archive(self, shape):
+        """
+        The encoder loop when there is no ffmpeg. Every frame is
+        a member of the archive, named frame_00000 and so on
+
+        :param shape: tuple, the shape of the frames
+        """
+        try:
+            with zipfile.ZipFile(self.filename, 'w', zipfile.ZIP_DEFLATED) as archive:
+                for number, frame in enumerate(self._next_frames()):
+                    with archive.open('frame_{:05d}.npy'.format(number), 'w') as member:
+                        np.lib.format.write_array(member, frame)
+        except OSError as error:
+            self.error = error
+            for _ in self._next_frames():
+                pass
+
+    def close(self):
+        """
+        Waits for the queued frames to be encoded and finishes the file
+        """
+        if self.encoder is not None:
+            self.frames.put(None)
+            self.encoder.join()
+            self.encoder = None
+        if self.error is not None:
+            raise self.error
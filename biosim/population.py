@@ -0,0 +1,550 @@
+# -*- coding: utf-8 -*-
+
+"""
+The animals of one species are stored column by column in numpy arrays
+instead of as one Python object per animal. Row i in every column
+belongs to the same animal, which lets the yearly phases work on whole
+arrays at once.
+"""
+
+__author__ = 'Peter Langdalen'
+__email__ = 'pelangda@nmbu.no'
+
+import numpy as np
+from biosim.random_streams import resolve_generator
+
+
+class Population:
+    """
+    Structure-of-arrays store for the animals of one species
+    """
+    initial_capacity = 8
+    _columns = ('_age', '_weight', '_fitness', '_cell')
+    event_names = ('births', 'deaths', 'kills', 'migrations', 'migration_attempts')
+
+    def __init__(self, species):
+        """
+        Constructor for the Population class
+
+        :param species: the animal class, Herbivore or Carnivore.
+        Its parameters are used by all the methods below
+        """
+        self.species = species
+        self._size = 0
+        self._age = np.zeros(self.initial_capacity, dtype=np.int64)
+        self._weight = np.zeros(self.initial_capacity)
+        self._fitness = np.zeros(self.initial_capacity)
+        self._cell = np.zeros(self.initial_capacity, dtype=np.int64)
+        self._fitness_stale = False
+        self.counts = None
+        self.events = dict.fromkeys(self.event_names, 0)
+
+    @classmethod
+    def from_animals(cls, species, animals):
+        """
+        Creates a population from a list of animal objects
+
+        :param species: the animal class
+        :param animals: iterable of Herbivore or Carnivore instances
+
+        :return: a new Population
+        """
+        pop = cls(species)
+        pop.extend(animals)
+        return pop
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        return '<Population of {} {}s>'.format(self._size,
+                                                self.species.__name__)
+
+    @property
+    def age(self):
+        """The age column, as a view of the live rows"""
+        return self._age[:self._size]
+
+    @property
+    def weight(self):
+        """The weight column, as a view of the live rows"""
+        return self._weight[:self._size]
+
+    @property
+    def fitness(self):
+        """
+        The fitness column, as a view of the live rows.
+        It is recomputed first if age or weight has changed since last time
+        """
+        if self._fitness_stale:
+            self.update_fitness()
+        return self._fitness[:self._size]
+
+    @property
+    def cell(self):
+        """
+        The cell index column, as a view of the live rows.
+        It is 0 for populations that belong to a single Cell, and the
+        flat index row * columns + col for island wide populations
+        """
+        return self._cell[:self._size]
+
+    def _reserve(self, extra):
+        """
+        Makes sure there is room for extra rows. The capacity is doubled
+        when it runs out, so appending n animals costs O(n) in total.
+
+        :param extra: int, number of rows about to be added
+        """
+        needed = self._size + extra
+        capacity = len(self._age)
+        if needed <= capacity:
+            return
+        capacity = max(capacity, self.initial_capacity)
+        while capacity < needed:
+            capacity *= 2
+        for name in self._columns:
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def add(self, age, weight, fitness=None, cell=0):
+        """
+        Appends a block of animals at the end of the columns
+
+        :param age: array of ints
+        :param weight: array of floats
+        :param fitness: array of floats, computed if not given
+        :param cell: int or array of ints, the cell index of the animals
+        """
+        age = np.asarray(age, dtype=np.int64)
+        n = len(age)
+        if n == 0:
+            return
+        self._reserve(n)
+        start, stop = self._size, self._size + n
+        self._age[start:stop] = age
+        self._weight[start:stop] = weight
+        self._cell[start:stop] = cell
+        self._size = stop
+        if self.counts is not None:
+            np.add.at(self.counts, self._cell[start:stop], 1)
+        if fitness is None:
+            self._fitness_stale = True
+        else:
+            self._fitness[start:stop] = fitness
+
+    def attach(self, age, weight, fitness, cell, counts=None):
+        """
+        Replaces the animals with the given columns. Columns of the right
+        type that can be written to become the storage of the population
+        without a copy, so copy-on-write memory maps from
+        np.load(mmap_mode='c') are only read as they are used. Other
+        columns are copied
+
+        :param age: array of ints
+        :param weight: array of floats
+        :param fitness: array of floats
+        :param cell: array of ints, the cell index of the animals
+        :param counts: array with the number of animals in each cell, used
+        for the tracked counts instead of counting the animals again
+        """
+        columns = []
+        for name, column in zip(self._columns, (age, weight, fitness, cell)):
+            dtype = getattr(self, name).dtype
+            if not (isinstance(column, np.ndarray) and column.ndim == 1
+                    and column.dtype == dtype and column.flags.writeable):
+                column = np.array(column, dtype=dtype).reshape(-1)
+            columns.append(column)
+        if len({len(column) for column in columns}) != 1:
+            raise ValueError('The columns must have the same length')
+        for name, column in zip(self._columns, columns):
+            setattr(self, name, column)
+        self._size = len(columns[0])
+        self._fitness_stale = False
+        if self.counts is not None:
+            self.counts[:] = np.bincount(self.cell, minlength=len(self.counts)) \
+                if counts is None else counts
+
+    def append(self, animal, cell=0):
+        """
+        Appends one animal object to the population
+
+        :param animal: Herbivore or Carnivore instance
+        :param cell: int, the cell index of the animal
+        """
+        self.add([animal.age], [animal.weight], cell=cell)
+
+    def extend(self, animals, cell=0):
+        """
+        Appends all animals from another population or from
+        an iterable of animal objects
+
+        :param animals: Population or iterable of animals
+        :param cell: int, the cell index of the animal objects.
+        Animals from a Population keep their own cell index
+        """
+        if isinstance(animals, Population):
+            self.add(animals.age, animals.weight, animals.fitness, animals.cell)
+        else:
+            animals = list(animals)
+            self.add([anim.age for anim in animals],
+                     [anim.weight for anim in animals], cell=cell)
+
+    def keep(self, mask):
+        """
+        Keeps the rows where mask is True and drops the rest.
+        The survivors are packed to the front of the columns in one pass,
+        so the cost is linear in the number of animals no matter how
+        many are dropped
+
+        :param mask: boolean array with one entry per animal
+        """
+        num_kept = int(np.count_nonzero(mask))
+        if num_kept == self._size:
+            return
+        if self.counts is not None:
+            np.subtract.at(self.counts, self.cell[~mask], 1)
+        for name in self._columns:
+            column = getattr(self, name)
+            np.compress(mask, column[:self._size], out=column[:num_kept])
+        self._size = num_kept
+
+    def remove(self, rows):
+        """
+        Drops the animals in rows, with a single compaction
+
+        :param rows: index array or boolean mask of the animals to drop
+        """
+        keep = np.ones(self._size, dtype=bool)
+        keep[rows] = False
+        self.keep(keep)
+
+    def move(self, rows, cells):
+        """
+        Gives some of the animals a new cell index
+
+        :param rows: index array of the animals that move
+        :param cells: array with the new cell index of each of them
+        """
+        if self.counts is not None:
+            np.subtract.at(self.counts, self.cell[rows], 1)
+            np.add.at(self.counts, cells, 1)
+        self.cell[rows] = cells
+
+    def track_counts(self, counts):
+        """
+        Keeps the number of animals in each cell in counts from now on.
+        Every method that adds, drops or moves animals updates it, so
+        the counts can be read at any time without a pass over the animals
+
+        :param counts: int array with one entry per cell. It can be a view
+        into a larger array, such as one cell of a grid for the whole island
+        """
+        counts[:] = np.bincount(self.cell, minlength=len(counts))
+        self.counts = counts
+
+    def histogram(self, column, edges):
+        """
+        Counts the animals in bins of one column, in a single pass
+
+        :param column: str, 'age', 'weight' or 'fitness'
+        :param edges: array with the bin edges
+
+        :return: array with the number of animals in each bin
+        """
+        return np.histogram(getattr(self, column), bins=edges)[0]
+
+    def summary(self):
+        """
+        Sums up the population for the statistics of a year, and
+        starts counting events from zero again
+
+        :return: dict with the number of animals, the sums of the age,
+        weight and fitness columns and the events since the last summary
+        """
+        summary = dict(self.events, count=self._size, age=int(self.age.sum()),
+                       weight=float(self.weight.sum()),
+                       fitness=float(self.fitness.sum()))
+        self.events = dict.fromkeys(self.event_names, 0)
+        return summary
+
+    def take(self, rows):
+        """
+        Copies some of the animals into a new population
+
+        :param rows: index array or boolean mask
+
+        :return: a new Population of the same species
+        """
+        pop = Population(self.species)
+        pop.add(self.age[rows], self.weight[rows], self.fitness[rows],
+                self.cell[rows])
+        return pop
+
+    def reorder(self, order):
+        """
+        Puts the rows in the given order
+
+        :param order: permutation of range(len(self))
+        """
+        for name in self._columns:
+            column = getattr(self, name)
+            column[:self._size] = column[:self._size][order]
+
+    def update_fitness(self, rows=None):
+        """
+        Recalculates the fitness of the given rows, or of every animal
+
+        :param rows: int, slice or index array, all rows by default
+        """
+        if rows is None:
+            self._fitness[:self._size] = self.species.fitness_kernel(
+                self.age, self.weight)
+            self._fitness_stale = False
+        else:
+            self._fitness[:self._size][rows] = self.species.fitness_kernel(
+                self.age[rows], self.weight[rows])
+
+    def invalidate_fitness(self):
+        """
+        Marks the fitness as out of date after age or weight has changed.
+        It is recomputed the next time it is needed, so several changes
+        in a row only cost one recomputation
+        """
+        self._fitness_stale = True
+
+    @staticmethod
+    def refresh_fitness(populations):
+        """
+        Recomputes the out of date fitness of many populations, typically
+        every population on the island, with one kernel call per species
+
+        :param populations: iterable of Population
+        """
+        stale = {}
+        for pop in populations:
+            if pop._fitness_stale:
+                stale.setdefault(pop.species, []).append(pop)
+
+        for species, pops in stale.items():
+            fitness = species.fitness_kernel(
+                np.concatenate([pop.age for pop in pops]),
+                np.concatenate([pop.weight for pop in pops]))
+            offsets = np.cumsum([len(pop) for pop in pops])[:-1]
+            for pop, pop_fitness in zip(pops, np.split(fitness, offsets)):
+                pop._fitness[:pop._size] = pop_fitness
+                pop._fitness_stale = False
+
+    def update_age(self):
+        """
+        Every animal ages one year
+        """
+        self.age[:] += 1
+        self.invalidate_fitness()
+
+    def yearly_weight_loss(self):
+        """
+        Every animal loses the fraction eta of its weight
+        """
+        self.weight[:] -= self.weight * self.species.params.eta
+        self.invalidate_fitness()
+
+    def death(self, rng=None):
+        """
+        Decides which animals die this year, using the same rule as
+        Animal.death but with one random number per animal drawn at once
+
+        :param rng: numpy Generator, a shared one is used if None
+
+        :return: boolean array, True for the animals that die
+        """
+        prob_death = self.species.params.omega * (1 - self.fitness)
+        random_num = resolve_generator(rng).random(self._size)
+        dies = (self.weight <= 0) | (prob_death > random_num)
+        self.events['deaths'] += int(np.count_nonzero(dies))
+        return dies
+
+    def will_move(self, rng=None):
+        """
+        Decides which animals want to migrate this year
+
+        :param rng: numpy Generator, a shared one is used if None
+
+        :return: boolean array, True for the animals that will move
+        """
+        prob_move = self.species.params.mu * self.fitness
+        random_num = resolve_generator(rng).random(self._size)
+        return prob_move > random_num
+
+    def count_per_cell(self, num_cells=0):
+        """
+        Counts the animals in each cell, a grouped reduction over the
+        cell index column
+
+        :param num_cells: int, the length of the result is at least this
+
+        :return: array with the number of animals in each cell
+        """
+        return np.bincount(self.cell, minlength=num_cells)
+
+    def cumsum_in_cell(self, values, order):
+        """
+        Cumulative sum of values that starts over in each cell
+
+        :param values: array with one value per row in order
+        :param order: permutation of the rows, grouped by cell
+
+        :return: array, the running total for row order[i] within its cell
+        """
+        cells = self.cell[order]
+        total = np.cumsum(values)
+        new_cell = np.ones(len(order), dtype=bool)
+        new_cell[1:] = cells[1:] != cells[:-1]
+        first_in_cell = np.maximum.accumulate(np.where(new_cell, np.arange(len(order)), 0))
+        return total - (total - values)[first_in_cell]
+
+    def graze(self, fodder, rng=None):
+        """
+        The herbivores eat in random order within each cell. Each one eats
+        its appetite F, or what is left of the fodder in its cell.
+        Since the grazing order is the only thing that links the animals,
+        the fodder left for each animal is the fodder of the cell minus the
+        cumulative appetite of the animals before it, clipped to [0, F]
+
+        :param fodder: array with the fodder in each cell, or a single
+        cell's fodder for a population that belongs to a Cell.
+        The eaten fodder is subtracted in place
+
+        :param rng: numpy Generator, a shared one is used if None
+        """
+        if self._size == 0:
+            return
+        p = self.species.params
+        order = resolve_generator(rng).permutation(self._size)
+        order = order[np.argsort(self.cell[order], kind='stable')]
+        cells = self.cell[order]
+
+        appetite = np.full(self._size, p.F)
+        eaten_before = self.cumsum_in_cell(appetite, order) - appetite
+        food_eaten = np.clip(fodder[cells] - eaten_before, 0, appetite)
+        if not food_eaten.any():
+            return
+        self.weight[order] += p.beta * food_eaten
+        fodder -= np.bincount(cells, weights=food_eaten, minlength=len(fodder))
+        self.invalidate_fitness()
+
+    def prey_on(self, prey, rows=slice(None), prey_rows=slice(None), rng=None):
+        """
+        The carnivores in rows hunt the herbivores in prey_rows, which
+        must be in the same cell. The carnivores must be sorted from highest
+        to lowest fitness, and the prey from lowest to highest.
+
+        Each carnivore only looks at the prey that is less fit than itself,
+        which is a prefix of the sorted prey. The kill probabilities for a
+        block of that prefix are computed at once from DeltaPhiMax, and the
+        first successful attempt is the kill. After a kill the carnivore's
+        fitness changes, so the search goes on from the next prey with the
+        new fitness, until the carnivore has eaten F or runs out of prey.
+
+        :param prey: the herbivore Population
+        :param rows: slice of the carnivores that hunt
+        :param prey_rows: slice of the herbivores they hunt
+        :param rng: numpy Generator, a shared one is used if None
+
+        :return: boolean array over prey_rows, True for the killed herbivores
+        """
+        rng = resolve_generator(rng)
+        p = self.species.params
+        fitness = self.fitness[rows]
+        weight = self.weight[rows]
+        first = range(self._size)[rows].start
+        prey_fitness = prey.fitness[prey_rows]
+        prey_weight = prey.weight[prey_rows]
+        killed = np.zeros(len(prey_fitness), dtype=bool)
+        first_alive = 0
+
+        for c in range(len(fitness)):
+            if np.searchsorted(prey_fitness, fitness[c], side='left') <= first_alive:
+                # The rest of the carnivores are even less fit
+                break
+            eaten_amount = 0
+            pos = first_alive
+            block = 16
+            while True:
+                num_weaker = np.searchsorted(prey_fitness, fitness[c], side='left')
+                if pos >= num_weaker:
+                    break
+                stop = min(pos + block, num_weaker)
+                candidates = pos + np.flatnonzero(~killed[pos:stop])
+                prob_kill = (fitness[c] - prey_fitness[candidates]) * p.inv_delta_phi_max
+                hits = np.flatnonzero(rng.random(len(candidates)) < prob_kill)
+                if len(hits) == 0:
+                    pos = stop
+                    block *= 2
+                    continue
+
+                h = candidates[hits[0]]
+                eats = min(prey_weight[h], p.F - eaten_amount)
+                eaten_amount += eats
+                weight[c] += p.beta * eats
+                self.update_fitness(first + c)
+                killed[h] = True
+                while first_alive < len(killed) and killed[first_alive]:
+                    first_alive += 1
+                pos = h + 1
+                block = 16
+                if eaten_amount >= p.F:
+                    break
+        self.events['kills'] += int(np.count_nonzero(killed))
+        return killed
+
+    def procreate(self, rng=None):
+        """
+        Each animal may give birth once a year, with a probability that
+        grows with its fitness and the number of animals in its cell.
+        The birth probabilities and the weight condition are computed for
+        the whole population at once, the newborn weights are drawn in one
+        normal sample, and the mothers lose xi times the weight of their
+        newborn before the newborns are appended as one block
+
+        :param rng: numpy Generator, a shared one is used if None
+        """
+        if self._size < 2:
+            return
+        rng = resolve_generator(rng)
+        p = self.species.params
+        num_in_cell = self.count_per_cell()[self.cell]
+        prob_birth = np.minimum(1, p.gamma * self.fitness * (num_in_cell - 1))
+        heavy_enough = self.weight >= p.birth_weight_limit
+        random_num = rng.random(self._size)
+        parents = np.flatnonzero(heavy_enough & (random_num < prob_birth))
+        if len(parents) == 0:
+            return
+
+        self.events['births'] += len(parents)
+        newborn_weight = rng.normal(p.w_birth, p.sigma_birth, len(parents))
+        self.weight[parents] -= p.xi * newborn_weight
+        self.invalidate_fitness()
+        self.add(np.zeros(len(parents), dtype=np.int64), newborn_weight,
+                 cell=self.cell[parents])
+
+    def migrate(self, offsets, habitable, rng=None):
+        """
+        Moves the animals of an island wide population to a random
+        neighbouring cell. Moves into cells that are not habitable
+        are rejected and the animal stays where it is
+
+        :param offsets: array with the flat index offset to each neighbour
+        :param habitable: boolean array, True for every habitable cell
+        :param rng: numpy Generator, a shared one is used if None
+        """
+        rng = resolve_generator(rng)
+        movers = np.flatnonzero(self.will_move(rng) & habitable[self.cell])
+        self.events['migration_attempts'] += len(movers)
+        destinations = self.cell[movers] + \
+            offsets[rng.integers(len(offsets), size=len(movers))]
+        accepted = habitable[destinations]
+        self.events['migrations'] += int(np.count_nonzero(accepted))
+        self.move(movers[accepted], destinations[accepted])
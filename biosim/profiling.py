@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""
+Instruments the annual cycle of a simulation. Every phase of every
+year is timed, and the events of the year are turned into counters
+of the work done. A range of years can also be run under cProfile,
+with the profile dumped to file when the range is over.
+"""
+
+__author__ = 'Peter Langdalen'
+__email__ = 'pelangda@nmbu.no'
+
+import cProfile
+import pstats
+import timeit
+
+
+class SimulationStats:
+    """
+    Wall time per phase and work counters for every simulated year
+    """
+    counter_names = ('animals_processed', 'births', 'deaths', 'kills',
+                     'migration_attempts', 'migrations', 'cells_visited')
+
+    def __init__(self, callback=None, profile_years=None, profile_path='biosim.prof'):
+        """
+        Constructor for the SimulationStats class
+
+        :param callback: function called with the year and the stats of
+        the year, see finish_year, as soon as the year is done
+        :param profile_years: (first, last) pair of years that are run
+        under cProfile, both included. Nothing is profiled if None
+        :param profile_path: str, the file the profile is dumped to. A text
+        report sorted by cumulative time is written next to it, with .txt added
+        """
+        self.callback = callback
+        self.profile_years = profile_years
+        self.profile_path = profile_path
+        self.profiler = None
+        self.years = []
+        self._seconds = {}
+
+    def time_phases(self, year, stepper):
+        """
+        Runs the annual cycle phase by phase, timing each phase. The
+        stepper counts the animals and cells each phase goes through,
+        see Island.add_work
+
+        :param year: int, the year that is simulated
+        :param stepper: Island or TiledIsland
+        """
+        profiling = self.profile_years is not None and \
+            self.profile_years[0] <= year <= self.profile_years[1]
+        if profiling and self.profiler is None:
+            self.profiler = cProfile.Profile()
+        self._seconds = {}
+        stepper.count_work = True
+        if profiling:
+            self.profiler.enable()
+        for name, phase in stepper.phases():
+            start = timeit.default_timer()
+            phase()
+            self._seconds[name] = timeit.default_timer() - start
+        if profiling:
+            self.profiler.disable()
+            if year == self.profile_years[1]:
+                self.dump_profile()
+
+    def finish_year(self, year, statistics, stepper):
+        """
+        Stores the stats of the year timed by time_phases
+
+        :param year: int
+        :param statistics: dict from yearly_statistics
+        :param stepper: Island or TiledIsland that was stepped
+
+        :return: dict with the year, the seconds of each phase and the total,
+        and the counters in counter_names
+        """
+        def total(event):
+            return sum(species[event] for species in statistics.values())
+
+        year_stats = {'year': year, 'phases': self._seconds,
+                      'seconds': sum(self._seconds.values()),
+                      'births': total('births'), 'deaths': total('deaths'),
+                      'kills': total('kills'),
+                      'migration_attempts': total('migration_attempts'),
+                      'migrations': total('migrations')}
+        year_stats.update(stepper.take_work())
+        self.years.append(year_stats)
+        if self.callback is not None:
+            self.callback(year, year_stats)
+        return year_stats
+
+    def dump_profile(self):
+        """
+        Writes the profile collected so far and starts a new one
+        """
+        if self.profiler is None:
+            return
+        self.profiler.dump_stats(self.profile_path)
+        with open(self.profile_path + '.txt', 'w') as report:
+            pstats.Stats(self.profiler, stream=report).sort_stats('cumulative').print_stats()
+        self.profiler = None
+
+    def totals(self):
+        """
+        :return: dict with the seconds spent in each phase and the
+        counters, summed over all years
+        """
+        totals = dict.fromkeys(self.counter_names, 0)
+        totals['seconds'] = 0.
+        totals['phases'] = {}
+        for year_stats in self.years:
+            for name in self.counter_names + ('seconds',):
+                totals[name] += year_stats[name]
+            for name, seconds in year_stats['phases'].items():
+                totals['phases'][name] = totals['phases'].get(name, 0.) + seconds
+        return totals
+
+    def report(self):
+        """
+        :return: str with a table of the time spent in each phase
+        and the counters, summed over all years
+        """
+        totals = self.totals()
+        lines = ['{:>20} {:>10} {:>7}'.format('phase', 'seconds', '%')]
+        for name, seconds in totals['phases'].items():
+            lines.append('{:>20} {:>10.4f} {:>7.1f}'.format(
+                name, seconds, 100 * seconds / totals['seconds'] if totals['seconds'] else 0))
+        lines.append('{:>20} {:>10.4f}'.format('total', totals['seconds']))
+        for name in self.counter_names:
+            lines.append('{:>20} {:>10}'.format(name, totals[name]))
+        return '\n'.join(lines)
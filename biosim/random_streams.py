@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+"""
+Random number streams for a simulation. Every simulation owns its own
+numpy Generator, and each phase of the annual cycle draws from a child
+stream spawned from the same SeedSequence, so the phases do not
+disturb each other's draws. Streams for a region of the island in a
+given year can also be spawned, which keeps results the same no matter
+how the regions are divided between workers.
+"""
+
+__author__ = 'Peter Langdalen'
+__email__ = 'pelangda@nmbu.no'
+
+import numpy as np
+
+_fallback_generator = np.random.default_rng()
+
+
+def resolve_generator(rng):
+    """
+    Used by methods that take an optional generator. Animals and cells
+    that are used on their own, outside a simulation, share one
+    module level generator
+
+    :param rng: numpy Generator or None
+
+    :return: rng, or the shared generator if rng is None
+    """
+    if rng is None:
+        return _fallback_generator
+    return rng
+
+
+class RandomStreams:
+    """
+    The random streams of one simulation
+    """
+    phases = ('place', 'feed', 'procreate', 'migrate', 'death')
+
+    def __init__(self, seed=None):
+        """
+        Constructor for RandomStreams
+
+        :param seed: int, SeedSequence or None.
+        The same seed always gives the same streams
+        """
+        if isinstance(seed, np.random.SeedSequence):
+            self.seed_sequence = seed
+        else:
+            self.seed_sequence = np.random.SeedSequence(seed)
+        self.generator = np.random.default_rng(self.seed_sequence)
+        self.phase_generators = {
+            phase: np.random.default_rng(child)
+            for phase, child in zip(self.phases,
+                                    self.seed_sequence.spawn(len(self.phases)))}
+
+    def __getitem__(self, phase):
+        """
+        :param phase: str, one of the names in phases
+
+        :return: the Generator of that phase
+        """
+        return self.phase_generators[phase]
+
+    def region(self, phase, year, region):
+        """
+        Creates the stream for one region of the island in one year.
+        It only depends on the seed and the three arguments,
+        not on the order the regions are processed in
+
+        :param phase: str, one of the names in phases
+        :param year: int
+        :param region: int, the number of the region
+
+        :return: a new Generator
+        """
+        spawn_key = self.seed_sequence.spawn_key + (self.phases.index(phase),
+                                                    year, region)
+        return np.random.default_rng(np.random.SeedSequence(
+            self.seed_sequence.entropy, spawn_key=spawn_key,
+            pool_size=self.seed_sequence.pool_size))
+
+    def get_state(self):
+        """
+        :return: dict with the state of the root and every phase generator
+        """
+        state = {phase: gen.bit_generator.state
+                 for phase, gen in self.phase_generators.items()}
+        state['root'] = self.generator.bit_generator.state
+        return state
+
+    def set_state(self, state):
+        """
+        Restores the state saved by get_state
+
+        :param state: dict from get_state
+        """
+        self.generator.bit_generator.state = state['root']
+        for phase, gen in self.phase_generators.items():
+            gen.bit_generator.state = state[phase]
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+"""
+Records the statistics of every simulated year in columns. The rows
+are kept in a preallocated array, and each full chunk is handed to a
+background thread that writes it to disk as .npy and appends it to a
+CSV file, so a long run never holds more than one chunk in memory.
+"""
+
+__author__ = 'Peter Langdalen'
+__email__ = 'pelangda@nmbu.no'
+
+import glob
+import os
+import queue
+import threading
+import numpy as np
+
+
+class Recorder:
+    """
+    Writes yearly statistics to a directory
+    """
+    species = ('Herbivore', 'Carnivore')
+    fields = ('count', 'births', 'deaths', 'kills', 'migrations',
+              'mean_age', 'mean_weight', 'mean_fitness')
+
+    def __init__(self, path, chunk_years=1000):
+        """
+        Constructor for the Recorder class
+
+        :param path: str, the directory the files are written to.
+        It is made if it does not exist, and the chunks and statistics
+        of an earlier run in it are replaced
+        :param chunk_years: int, the number of years kept in memory
+        before they are written
+        """
+        self.path = path
+        self.columns = self.column_names()
+        self.buffer = np.zeros((chunk_years, len(self.columns)))
+        self.num_rows = 0
+        self.num_chunks = 0
+        self.error = None
+
+        os.makedirs(path, exist_ok=True)
+        for old_chunk in glob.glob(os.path.join(path, 'chunk_*.npy')):
+            os.remove(old_chunk)
+        with open(os.path.join(path, 'statistics.csv'), 'w') as csv_file:
+            csv_file.write(','.join(self.columns) + '\n')
+        self.chunks = queue.Queue()
+        self.writer = threading.Thread(target=self._write_chunks, daemon=True)
+        self.writer.start()
+
+    @classmethod
+    def column_names(cls):
+        """
+        :return: list with the year column and one column
+        per species and field
+        """
+        return ['year'] + ['{}_{}'.format(species, field)
+                           for species in cls.species for field in cls.fields]
+
+    def record(self, year, statistics):
+        """
+        Adds the statistics of a year
+
+        :param year: int
+        :param statistics: dict from Island.yearly_statistics
+        """
+        row = self.buffer[self.num_rows]
+        row[0] = year
+        row[1:] = [statistics[species][field]
+                   for species in self.species for field in self.fields]
+        self.num_rows += 1
+        if self.num_rows == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        """
+        Hands the recorded rows to the writer and starts on a new chunk
+        """
+        if self.error is not None:
+            raise self.error
+        if self.num_rows == 0:
+            return
+        self.chunks.put((self.num_chunks, self.buffer[:self.num_rows]))
+        self.buffer = np.zeros_like(self.buffer)
+        self.num_rows = 0
+        self.num_chunks += 1
+
+    def _write_chunks(self):
+        """
+        The loop of the writer thread, which writes chunks until it gets None
+        """
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                break
+            number, rows = chunk
+            try:
+                np.save(os.path.join(self.path, 'chunk_{:05d}.npy'.format(number)), rows)
+                with open(os.path.join(self.path, 'statistics.csv'), 'a') as csv_file:
+                    np.savetxt(csv_file, rows, delimiter=',', fmt='%.10g')
+            except OSError as error:
+                self.error = error
+
+    def close(self):
+        """
+        Writes the rest of the rows and waits for the writer to finish
+        """
+        self.flush()
+        self.chunks.put(None)
+        self.writer.join()
+        if self.error is not None:
+            raise self.error
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads the chunks written to a directory
+
+        :param path: str, the directory given to the Recorder
+
+        :return: dict with the column names as keys and arrays as values
+        """
+        columns = cls.column_names()
+        chunks = [np.load(name) for name in
+                  sorted(glob.glob(os.path.join(path, 'chunk_*.npy')))]
+        rows = np.concatenate(chunks) if chunks else np.zeros((0, len(columns)))
+        return {name: rows[:, n] for n, name in enumerate(columns)}
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+"""
+Draws the per-year snapshots of a simulation. The simulation pushes
+the count grids and species totals of a year to a renderer. Renderer
+draws them straight away, AsyncRenderer hands them to a separate
+process through a bounded queue and drops frames when that process
+falls behind, so the simulation never waits for matplotlib.
+"""
+
+__author__ = 'Peter Langdalen'
+__email__ = 'pelangda@nmbu.no'
+
+import multiprocessing
+import queue
+
+from biosim.movie import MovieWriter
+
+
+def draw_frame(visuals, year, grids, totals, histograms, filename, movie=None):
+    """
+    Draws one snapshot on the figure
+
+    :param visuals: Visuals
+    :param year: int, the year of the snapshot
+    :param grids: dict with the count grid of each species
+    :param totals: list with the species totals of every year since
+    the last frame that was drawn
+    :param histograms: dict from Island.histograms, or None
+    :param filename: str or None, the figure is saved to this file
+    :param movie: MovieWriter or None. If given, the figure is added
+    to the movie instead of saved to filename
+    """
+    for year_totals in totals:
+        visuals.update_line_plt(year_totals)
+    if histograms is not None:
+        visuals.update_histograms(histograms)
+    visuals.update_heat_maps(anim_distribution_dict=grids)
+    visuals.update_year(year)
+    if filename is None:
+        return
+    if movie is None:
+        visuals.fig.savefig(filename)
+    else:
+        movie.add_frame(visuals.canvas_rgb())
+
+
+def make_visuals(rgb_map, ymax=None, hist_edges=None):
+    """
+    Creates the figure. matplotlib is first imported here
+
+    :param rgb_map: the colored island map
+    :param ymax: the y-axis limit of the line plot, None to follow the counts
+    :param hist_edges: dict with the bin edges of each histogram
+    :return: Visuals
+    """
+    from biosim.visuals import Visuals
+    visuals = Visuals(ymax, hist_edges)
+    visuals.set_plots(rgb_map=rgb_map)
+    return visuals
+
+
+class Renderer:
+    """
+    Draws every snapshot in this process, before the simulation goes on
+    """
+
+    def __init__(self, rgb_map, ymax=None, hist_edges=None, movie=None):
+        """
+        Constructor for the Renderer class
+
+        :param rgb_map: the colored island map
+        :param ymax: the y-axis limit of the line plot, None to follow the counts
+        :param hist_edges: dict with the bin edges of each histogram
+        :param movie: str, file name of a movie that the saved frames are
+        streamed to, instead of one image file per frame
+        """
+        self.visuals = make_visuals(rgb_map, ymax, hist_edges)
+        self.movie = None if movie is None else MovieWriter(movie)
+
+    def push(self, year, grids, totals=None, filename=None, histograms=None):
+        """
+        Draws a snapshot
+
+        :param year: int, the year of the snapshot
+        :param grids: dict with the count grid of each species
+        :param totals: dict with the total of each species, None if
+        the snapshot should not be added to the line plot
+        :param filename: str or None, the figure is saved to this file
+        :param histograms: dict from Island.histograms, or None
+        """
+        draw_frame(self.visuals, year, grids,
+                   [] if totals is None else [totals], histograms, filename, self.movie)
+
+    def close(self):
+        """
+        Finishes the movie, if there is one
+        """
+        if self.movie is not None:
+            self.movie.close()
+
+
+def _render_loop(frames, rgb_map, ymax, hist_edges, movie):
+    """
+    The loop of the rendering process, which draws frames until it gets None
+
+    :param frames: multiprocessing Queue with the frames
+    :param rgb_map: the colored island map
+    :param ymax: the y-axis limit of the line plot, None to follow the counts
+    :param hist_edges: dict with the bin edges of each histogram
+    :param movie: str or None, file name of a movie to stream frames to
+    """
+    visuals = make_visuals(rgb_map, ymax, hist_edges)
+    movie = None if movie is None else MovieWriter(movie)
+    while True:
+        frame = frames.get()
+        if frame is None:
+            break
+        draw_frame(visuals, *frame, movie=movie)
+    if movie is not None:
+        movie.close()
+
+
+class AsyncRenderer:
+    """
+    Draws snapshots in a separate process
+    """
+
+    def __init__(self, rgb_map, ymax=None, hist_edges=None, movie=None, max_frames=2):
+        """
+        Constructor for the AsyncRenderer class
+
+        :param rgb_map: the colored island map
+        :param ymax: the y-axis limit of the line plot, None to follow the counts
+        :param hist_edges: dict with the bin edges of each histogram
+        :param movie: str, file name of a movie that the saved frames are
+        streamed to, instead of one image file per frame
+        :param max_frames: int, the number of frames that can wait to be drawn
+        """
+        self.frames = multiprocessing.Queue(max_frames)
+        self.pending_totals = []
+        self.dropped = 0
+        self.process = multiprocessing.Process(target=_render_loop,
+                                               args=(self.frames, rgb_map, ymax, hist_edges, movie),
+                                               daemon=True)
+        self.process.start()
+
+    def push(self, year, grids, totals=None, filename=None, histograms=None):
+        """
+        Queues a snapshot. If the queue is full the snapshot is dropped,
+        but its totals are sent with the next frame, so the line plot
+        stays complete. Snapshots that are saved to file are never dropped
+
+        :param year: int, the year of the snapshot
+        :param grids: dict with the count grid of each species
+        :param totals: dict with the total of each species, None if
+        the snapshot should not be added to the line plot
+        :param filename: str or None, the figure is saved to this file
+        :param histograms: dict from Island.histograms, or None
+        """
+        if totals is not None:
+            self.pending_totals.append(totals)
+        frame = (year, grids, self.pending_totals, histograms, filename)
+        if filename is None:
+            try:
+                self.frames.put_nowait(frame)
+            except queue.Full:
+                self.dropped += 1
+                return
+        else:
+            self.frames.put(frame)
+        self.pending_totals = []
+
+    def close(self):
+        """
+        Waits for the queued frames to be drawn, which also finishes
+        the movie, and stops the process
+        """
+        if self.process.is_alive():
+            self.frames.put(None)
+            self.process.join()
@@ -10,10 +10,15 @@ __email__ = 'pelangda@nmbu.no'
 from biosim.animals import Herbivore, Carnivore
 from biosim.landscape import Lowland, Highland, Desert, Water
 from biosim.island import Island
-from biosim.visuals import Visuals
+from biosim.tiles import TiledIsland
+from biosim.random_streams import RandomStreams
+from biosim.renderer import Renderer, AsyncRenderer
+from biosim.profiling import SimulationStats
 import numpy as np
-import matplotlib.pyplot as plt
+import glob
+import json
 import os
+import subprocess
 
 FFMPEG_BINARY = 'ffmpeg'
 CONVERT_BINARY = 'magick'
@@ -30,11 +35,14 @@ class BioSim:
 
     def __init__(self, island_map, ini_pop, seed,
                  ymax_animals=None, cmax_animals=None,
-                 hist_specs=None, img_base=None, img_fmt='png'):
+                 hist_specs=None, img_base=None, img_fmt='png', flat=False,
+                 workers=None, tile_shape=(64, 64), render_async=False,
+                 stream_movie=False):
         """
         :param island_map: Multi-line string specifying island geography
         :param ini_pop: List of dictionaries specifying initial population
-        :param seed: Integer used as random number seed
+        :param seed: Integer used as random number seed. The simulation
+        draws all its random numbers from its own streams made from this seed
         :param ymax_animals: Number specifying y-axis limit for graph showing animal numbers
         :param cmax_animals: Dict specifying color-code limits for animal densities
         :param hist_specs: Specifications for histograms, see below
@@ -54,13 +62,28 @@ class BioSim:
         ’{}_{:05d}.{}’.format(img_base, img_no, img_fmt)
         where img_no are consecutive image numbers starting from 0.
         img_base should contain a path and beginning of a file name.
+        :param flat: If True the island keeps one population per species
+        with a cell index column, see Island
+        :param workers: If not None the island is flat and split into tiles
+        that are stepped by this many worker processes, see TiledIsland.
+        0 steps the tiles in this process
+        :param tile_shape: Tuple with the number of rows and columns of a tile
+        :param render_async: If True the figure is drawn in a separate process,
+        and years are skipped in the figure when drawing falls behind
+        :param stream_movie: If True the figures are not written as image
+        files, but streamed to the movie img_base.mp4 while the simulation
+        runs. Without ffmpeg the frames go to the archive img_base.npz
         """
         self.current_year = 0
         self.final_year = None
-        self.island = Island(island_map).island
-
-        if ymax_animals is None:
-            ymax_animals = 20000
+        self.seed = seed
+        self.streams = RandomStreams(seed)
+        self.sim_island = Island(island_map, flat=flat or workers is not None,
+                                 streams=self.streams)
+        if workers is None:
+            self.stepper = self.sim_island
+        else:
+            self.stepper = TiledIsland(self.sim_island, tile_shape, workers)
 
         self.ymax = ymax_animals
 
@@ -73,16 +96,87 @@ class BioSim:
 
         self.cmax_herb = cmax_herb
         self.cmax_carn = cmax_carn
+        self.hist_edges = self.histogram_edges(hist_specs)
 
         self.add_population(ini_pop)
-        self.seed = np.random.seed(seed)
         self.img_fmt = img_fmt
         self.img_ctr = 0
+        self.movie_part = 0
         self.img_base = img_base
+        self.island_map = island_map
+        self.render_async = render_async
+        self.stream_movie = stream_movie
+        self.renderer = None
+        self.stats = None
+
+    def enable_stats(self, callback=None, profile_years=None, profile_path='biosim.prof'):
+        """
+        Starts timing the phases and counting the work of every
+        simulated year in self.stats
+
+        :param callback: function called with the year and its stats
+        after every year, see SimulationStats.finish_year
+        :param profile_years: (first, last) pair of years run under cProfile
+        :param profile_path: str, the file the profile is dumped to
+
+        :return: SimulationStats
+        """
+        self.stats = SimulationStats(callback, profile_years, profile_path)
+        return self.stats
+
+    def step(self, recorder=None):
+        """
+        Simulates one year, and records it and adds it to the stats
+        if there are any
+
+        :param recorder: Recorder or None
+        """
+        self.current_year += 1
+        if self.stats is None:
+            self.stepper.annual_cycle()
+        else:
+            self.stats.time_phases(self.current_year, self.stepper)
+        if recorder is None and self.stats is None:
+            return
+        statistics = self.stepper.yearly_statistics()
+        if recorder is not None:
+            recorder.record(self.current_year, statistics)
+        if self.stats is not None:
+            self.stats.finish_year(self.current_year, statistics, self.stepper)
+
+    def setup_graphics(self):
+        """
+        Creates the renderer the first time the simulation is visualized.
+        matplotlib is only imported by the renderer, so a simulation that
+        is never visualized runs without it
+        """
+        if self.renderer is not None:
+            return
+        movie = None
+        if self.stream_movie and self.img_base is not None:
+            movie = '{}.{}'.format(self.movie_base(), DEFAULT_MOVIE_FORMAT)
+        rgb_map = self.rgb_map(self.sim_island.code_grid)
+        if self.render_async:
+            self.renderer = AsyncRenderer(rgb_map, self.ymax, self.hist_edges, movie)
+        else:
+            self.renderer = Renderer(rgb_map, self.ymax, self.hist_edges, movie)
+
+    @staticmethod
+    def histogram_edges(hist_specs):
+        """
+        Makes the bin edges of the histograms from hist_specs
 
-        self.visuals = Visuals()
+        :param hist_specs: dict, see the constructor, or None
 
-        self.visuals.set_plots(rgb_map=self.rgb_map(island_map))
+        :return: dict with the properties as keys and arrays of bin edges
+        from 0 to max in steps of delta as values
+        """
+        edges = {}
+        for prop, spec in (hist_specs or {}).items():
+            if prop not in ('weight', 'age', 'fitness'):
+                raise ValueError('Histograms can only be made of weight, age and fitness')
+            edges[prop] = np.arange(0, spec['max'] + spec['delta'] / 2, spec['delta'])
+        return edges
 
     @staticmethod
     def set_animal_parameters(species, params):
@@ -115,32 +209,48 @@ class BioSim:
             raise ValueError('Lowland and Highland are the'
                              'only ones that can have different parameters')
 
-    def simulate(self, num_years, vis_years=1, img_years=None):
+    def simulate(self, num_years, vis_years=1, img_years=None, recorder=None):
         """
         Run simulation while visualizing the result.
 
         :param num_years: number of years to simulate
 
-        :param vis_years: years between visualization updates
+        :param vis_years: years between visualization updates. If None
+        no figure is made and the simulation runs headless
 
         :param img_years: years between visualizations saved to files (default: vis_years)
 
+        :param recorder: Recorder that gets the statistics of every year.
+        It is flushed at the end, but not closed
+
+        Each year is timed phase by phase if enable_stats has been called.
+
         Image files will be numbered consecutively.
         """
-        i = Island("""\
-               WW""")
-        for yr in range(num_years):
-            self.current_year += 1
-            i.annual_cycle(self.island)
-            if yr % vis_years == 0:
-
-                self.visuals.update_heat_maps(anim_distribution_dict=self.heatmap_of_population()
-                                          )
-                self.visuals.update_line_plt(self.heat_num_animals)
-                self.visuals.update_year()
+        if recorder is not None or self.stats is not None:
+            # Events from years that were not recorded are thrown away
+            self.stepper.yearly_statistics()
+
+        if vis_years is None:
+            for _ in range(num_years):
+                self.step(recorder)
+            if recorder is not None:
+                recorder.flush()
+            return
 
-            if yr % img_years == 0:
-                self.save_graphic()
+        if img_years is None:
+            img_years = vis_years
+        self.setup_graphics()
+        for yr in range(num_years):
+            self.step(recorder)
+            visualize = yr % vis_years == 0
+            save = yr % img_years == 0 and self.img_base is not None
+            if visualize or save:
+                histograms = self.stepper.histograms(self.hist_edges) \
+                    if visualize and self.hist_edges else None
+                self.renderer.push(self.current_year, self.heatmap_of_population(),
+                                   self.heat_num_animals if visualize else None,
+                                   self.image_name() if save else None, histograms)
 
     @staticmethod
     def rgb_map(string_input):
@@ -150,40 +260,38 @@ class BioSim:
         the example directory
 
         :param string_input:
-        it takes the map as a multi line string
+        it takes the map as a multi line string, or the landscape
+        code grid of an Island, which saves parsing the map again
 
-        :return: a list
+        :return: array with shape (rows, cols, 3)
         """
         rgb_value = {'W': (0.0, 0.0, 1.0),  # blue
                      'L': (0.0, 0.6, 0.0),  # dark green
                      'H': (0.5, 1.0, 0.5),  # light green
                      'D': (1.0, 1.0, 0.5)}  # light yellow
-        map_rgb = [[rgb_value[col] for col in row]
-                   for row in string_input.splitlines()]
+        codes = string_input if isinstance(string_input, np.ndarray) \
+            else Island.parse_map(string_input)
+        return np.array([rgb_value[letter] for letter in Island.type_of_landscape])[codes]
 
-        return map_rgb
+    @property
+    def island(self):
+        """
+        The map as a nested list of Cell objects, see Island.island.
+        In flat mode and for tiles it is a copy, see Island.cell_view
+        """
+        if self.stepper is not self.sim_island:
+            return self.sim_island.cell_view(self.stepper.populations())
+        return self.sim_island.island
 
     def heatmap_of_population(self):
         """
-        iterates through the island and gets the total number
-        of herbivores and carnivores, is used for the visuals
+        gets the number of herbivores and carnivores in every cell,
+        is used for the visuals
 
         :return: dict
         The animals are sorted in a dictionary
         """
-        row_num = np.shape(self.island)[0]
-        column_num = np.shape(self.island)[1]
-
-        herb_arr = np.zeros((row_num, column_num))
-        carn_arr = np.zeros((row_num, column_num))
-
-        for row, lines in enumerate(self.island):
-            for col, cell in enumerate(lines):
-                herb_arr[row][col] = len(cell.herbivore)
-                carn_arr[row][col] = len(cell.carnivore)
-
-        animal_distribution_dict = {"Herbivore": herb_arr, "Carnivore": carn_arr}
-        return animal_distribution_dict
+        return self.stepper.count_grids()
 
     def add_population(self, population):
         """
@@ -191,9 +299,77 @@ class BioSim:
 
         :param population: List of dictionaries specifying population
         """
-        for cell_coord in population:
-            x, y = cell_coord.get('loc')
-            self.island[x][y].place_animals(cell_coord.get('pop'))
+        self.stepper.add_population(population)
+
+    def save_checkpoint(self, path):
+        """
+        Saves the state of the simulation to a directory. The columns of
+        the animals and the fodder are written as .npy files, which
+        load_checkpoint memory maps, and everything else to state.json
+
+        :param path: str, the directory. It is made if it does not exist
+        """
+        os.makedirs(path, exist_ok=True)
+        for name, column in self.stepper.get_state().items():
+            np.save(os.path.join(path, name + '.npy'), column)
+        tiled = self.stepper is not self.sim_island
+        state = {'year': self.current_year,
+                 'island_map': self.island_map,
+                 'flat': self.sim_island.flat,
+                 'tile_shape': list(self.stepper.tile_shape) if tiled else None,
+                 'entropy': self.streams.seed_sequence.entropy,
+                 'streams': self.streams.get_state(),
+                 'img_ctr': self.img_ctr,
+                 'movie_part': self.movie_part,
+                 'parameters': {'Herbivore': Herbivore.parameters,
+                                'Carnivore': Carnivore.parameters,
+                                'L': Lowland.parameters,
+                                'H': Highland.parameters}}
+        with open(os.path.join(path, 'state.json'), 'w') as state_file:
+            json.dump(state, state_file)
+
+    @classmethod
+    def load_checkpoint(cls, path, workers=None, **kwargs):
+        """
+        Makes a simulation from a checkpoint. Going on from it gives
+        the same result as a simulation that was never stopped.
+        The .npy files are memory mapped copy-on-write. A flat island
+        uses them as its columns, so the animals are only read from disk
+        as the simulation touches them. In cell mode and for tiles the
+        animals are copied into their cells or tiles while loading
+
+        :param path: str, a directory written by save_checkpoint
+        :param workers: the number of tile workers, only used if the saved
+        simulation was split into tiles. The result does not depend on it
+        :param kwargs: other arguments for the constructor, such as img_base
+
+        :return: BioSim
+        """
+        with open(os.path.join(path, 'state.json')) as state_file:
+            state = json.load(state_file)
+        for name, params in state['parameters'].items():
+            if name in ('Herbivore', 'Carnivore'):
+                cls.set_animal_parameters(name, params)
+            else:
+                cls.set_landscape_parameters(name, params)
+
+        if state['tile_shape'] is None:
+            workers = None
+        elif workers is None:
+            workers = 0
+        sim = cls(state['island_map'], [], state['entropy'], flat=state['flat'],
+                  workers=workers, tile_shape=tuple(state['tile_shape'] or (64, 64)),
+                  **kwargs)
+        columns = {os.path.splitext(os.path.basename(name))[0]: np.load(name, mmap_mode='c')
+                   for name in glob.glob(os.path.join(path, '*.npy'))}
+        sim.stepper.set_state(columns)
+        sim.streams.set_state(state['streams'])
+        sim.current_year = state['year']
+        sim.img_ctr = state['img_ctr']
+        sim.movie_part = state.get('movie_part', 0)
+        if sim.stepper is not sim.sim_island:
+            sim.stepper.year = state['year']
+        return sim
 
     @property
     def year(self):
@@ -203,16 +379,12 @@ class BioSim:
     @property
     def heat_num_animals(self):
         """
-        Takes the number of animals throughout the island and sum
-        them up
+        Gets the number of animals of each species on the island
 
         :return: a dictionary with the species as keys, and the total number of
         animals as values
         """
-        total_herbivores = sum(sum(self.heatmap_of_population()['Herbivore']))
-        total_carnivores = sum(sum(self.heatmap_of_population()['Carnivore']))
-        animal_count_dict = {"Herbivore": total_herbivores, "Carnivore": total_carnivores}
-        return animal_count_dict
+        return self.stepper.count_animals()
 
     @property
     def num_animals(self):
@@ -231,20 +403,83 @@ class BioSim:
         """Number of animals per species in island, as dictionary."""
         return self.heat_num_animals
 
+    def image_name(self):
+        """
+        Makes the file name of the next figure, taken from randvis.
+
+        :return: str
+        """
+        name = '{base}_{num:05d}.{type}'.format(base=self.img_base,
+                                                num=self.img_ctr,
+                                                type=self.img_fmt)
+        self.img_ctr += 1
+        return name
+
     def save_graphic(self):
         """
-        Saves graphics to file, taken from randvis.
+        Saves graphics to file.
         """
 
-        if self.img_base is None:
+        if self.img_base is None or self.renderer is None:
             return
 
-        plt.savefig('{base}_{num:05d}.{type}'.format(base=self.img_base,
-                                                     num=self.img_ctr,
-                                                     type=self.img_fmt))
-        self.img_ctr += 1
+        self.renderer.push(self.current_year, self.heatmap_of_population(),
+                           filename=self.image_name())
+
+    def close(self):
+        """
+        Stops the renderer and the tile workers, if there are any.
+        A profile of years that were not all simulated is dumped
+        """
+        if self.renderer is not None:
+            self.renderer.close()
+        if self.stats is not None:
+            self.stats.dump_profile()
+        if self.stepper is not self.sim_island:
+            self.stepper.close()
+
+    def movie_base(self):
+        """
+        :return: str, the file name without extension of the streamed
+        movie. The first part is img_base, the parts started after
+        make_movie are img_base_part1, img_base_part2 and so on
+        """
+        if self.movie_part == 0:
+            return self.img_base
+        return '{}_part{}'.format(self.img_base, self.movie_part)
 
-    def make_movie(self):
-        """Create MPEG4 movie from visualization images saved."""
-        pass
+    def make_movie(self, movie_fmt=DEFAULT_MOVIE_FORMAT):
+        """
+        Create MPEG4 movie from visualization images saved.
+        If the frames were streamed, the movie is finished instead.
+        If the simulation goes on, its frames are streamed to a new
+        part, see movie_base, so the finished movie is kept
+
+        :param movie_fmt: str, 'mp4' or 'gif'
+        """
+        if self.img_base is None:
+            raise RuntimeError("No filename defined.")
+
+        if self.stream_movie:
+            if self.renderer is not None:
+                self.renderer.close()
+                self.renderer = None
+                self.movie_part += 1
+            return
+
+        images = '{}_%05d.{}'.format(self.img_base, self.img_fmt)
+        if movie_fmt == 'mp4':
+            command = [FFMPEG_BINARY, '-y', '-i', images, '-profile:v', 'baseline',
+                       '-level', '3.0', '-pix_fmt', 'yuv420p',
+                       '{}.{}'.format(self.img_base, movie_fmt)]
+        elif movie_fmt == 'gif':
+            command = [CONVERT_BINARY, '-delay', '1', '-loop', '0',
+                       '{}_*.{}'.format(self.img_base, self.img_fmt),
+                       '{}.{}'.format(self.img_base, movie_fmt)]
+        else:
+            raise ValueError('Unknown movie format: ' + movie_fmt)
+        try:
+            subprocess.check_call(command)
+        except (OSError, subprocess.CalledProcessError) as err:
+            raise RuntimeError('Converting the images failed: {}'.format(err))
 
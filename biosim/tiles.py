@@ -0,0 +1,567 @@
+# -*- coding: utf-8 -*-
+
+"""
+Runs a flat island split into rectangular tiles, with the tiles spread
+over worker processes. Each worker keeps the animals of its own tiles
+between years, only the animals that migrate across a tile border are
+sent through the main process. Every tile draws from its own random
+stream for each phase and year, so the result for a given seed is the
+same no matter how many workers are used.
+"""
+
+__author__ = 'Peter Langdalen'
+__email__ = 'pelangda@nmbu.no'
+
+import multiprocessing
+import os
+import numpy as np
+
+from biosim.animals import Herbivore, Carnivore
+from biosim.island import Island
+from biosim.population import Population
+from biosim.random_streams import RandomStreams
+
+
+class Tile:
+    """
+    A rectangular part of the island with its own populations.
+    The cell index column of the populations is local to the tile
+    """
+    species = (Herbivore, Carnivore)
+
+    def __init__(self, number, rows, cols, island_shape, codes, habitable):
+        """
+        Constructor for the Tile class
+
+        :param number: int, the number of the tile, also used for its streams
+        :param rows: tuple with the first and one past the last row
+        :param cols: tuple with the first and one past the last column
+        :param island_shape: tuple, the shape of the whole island
+        :param codes: array with the landscape code of the tile's cells
+        :param habitable: boolean array over the cells of the whole island
+        """
+        self.number = number
+        self.rows = rows
+        self.cols = cols
+        self.width = cols[1] - cols[0]
+        self.island_shape = island_shape
+        self.codes = codes
+        self.habitable = habitable
+        self.neighbour_offsets = np.array([-island_shape[1], island_shape[1], -1, 1])
+        self.populations = tuple(Population(species) for species in self.species)
+        self.fodder = np.zeros(codes.size)
+        self.work = dict.fromkeys(Island.work_names, 0)
+
+    def to_global(self, local):
+        """
+        :param local: array of cell indices in the tile
+        :return: the same cells as flat indices in the island
+        """
+        row, col = np.divmod(local, self.width)
+        return (row + self.rows[0]) * self.island_shape[1] + col + self.cols[0]
+
+    def to_local(self, cell):
+        """
+        :param cell: array of flat cell indices in the island
+        :return: the same cells as indices in the tile
+        """
+        row, col = np.divmod(cell, self.island_shape[1])
+        return (row - self.rows[0]) * self.width + col - self.cols[0]
+
+    def contains(self, cell):
+        """
+        :param cell: array of flat cell indices in the island
+        :return: boolean array, True for the cells inside the tile
+        """
+        row, col = np.divmod(cell, self.island_shape[1])
+        return ((self.rows[0] <= row) & (row < self.rows[1]) &
+                (self.cols[0] <= col) & (col < self.cols[1]))
+
+    def add(self, columns):
+        """
+        Adds animals to the tile
+
+        :param columns: dict with species names as keys and tuples of
+        age, weight, fitness and island cell index arrays as values
+        """
+        for pop in self.populations:
+            age, weight, fitness, cell = columns[pop.species.__name__]
+            pop.add(age, weight, fitness, self.to_local(cell))
+
+    def columns(self):
+        """
+        :return: dict with species names as keys and tuples of age, weight,
+        fitness and island cell index arrays as values
+        """
+        return {pop.species.__name__: (pop.age.copy(), pop.weight.copy(),
+                                       pop.fitness.copy(), self.to_global(pop.cell))
+                for pop in self.populations}
+
+    def counts(self):
+        """
+        :return: dict with species names as keys and the number of animals
+        in each cell of the tile as values
+        """
+        shape = (self.rows[1] - self.rows[0], self.width)
+        return {pop.species.__name__:
+                pop.count_per_cell(self.codes.size).reshape(shape)
+                for pop in self.populations}
+
+    def add_work(self):
+        """
+        Counts the animals of the tile and the cells that have animals,
+        in the same way as Island.add_work
+        """
+        occupied = sum(pop.count_per_cell(self.codes.size) for pop in self.populations)
+        self.work['animals_processed'] += int(occupied.sum())
+        self.work['cells_visited'] += int(np.count_nonzero(occupied))
+
+    def first_half(self, year, streams, f_max, count_work=False):
+        """
+        Feeding, procreation and migration for one year
+
+        :param year: int, used to pick the random streams
+        :param streams: RandomStreams of the simulation
+        :param f_max: array with the f_max of each landscape code
+        :param count_work: bool, counts the work of the half year if True
+
+        :return: dict with the animals that leave the tile, in the same
+        form as the argument to add, with the destination cells
+        """
+        if count_work:
+            self.add_work()
+        herbs, carns = self.populations
+        rng = streams.region('feed', year, self.number)
+        self.fodder = f_max[self.codes]
+        herbs.graze(self.fodder, rng)
+        Island.hunt(herbs, carns, rng)
+
+        rng = streams.region('procreate', year, self.number)
+        for pop in self.populations:
+            pop.procreate(rng)
+
+        rng = streams.region('migrate', year, self.number)
+        return {pop.species.__name__: self.migrate(pop, rng)
+                for pop in self.populations}
+
+    def migrate(self, pop, rng):
+        """
+        Moves animals inside the tile and takes out the animals
+        that move to another tile
+
+        :param pop: one of the tile's populations
+        :param rng: numpy Generator
+
+        :return: tuple with the age, weight, fitness and destination
+        cell of the animals that leave the tile
+        """
+        cell = self.to_global(pop.cell)
+        movers = np.flatnonzero(pop.will_move(rng) & self.habitable[cell])
+        pop.events['migration_attempts'] += len(movers)
+        destination = cell[movers] + self.neighbour_offsets[
+            rng.integers(len(self.neighbour_offsets), size=len(movers))]
+        accepted = self.habitable[destination]
+        movers, destination = movers[accepted], destination[accepted]
+
+        pop.events['migrations'] += len(movers)
+        inside = self.contains(destination)
+        pop.move(movers[inside], self.to_local(destination[inside]))
+        leaving = movers[~inside]
+        emigrants = (pop.age[leaving], pop.weight[leaving],
+                     pop.fitness[leaving], destination[~inside])
+        pop.remove(leaving)
+        return emigrants
+
+    def second_half(self, year, streams, immigrants, count_work=False):
+        """
+        Adds the animals that migrated into the tile, then aging,
+        weight loss and death for one year
+
+        :param year: int, used to pick the random streams
+        :param streams: RandomStreams of the simulation
+        :param immigrants: dict in the same form as the argument to add
+        :param count_work: bool, counts the work of the half year if True
+        """
+        self.add(immigrants)
+        if count_work:
+            self.add_work()
+        for pop in self.populations:
+            pop.update_age()
+            pop.yearly_weight_loss()
+        rng = streams.region('death', year, self.number)
+        for pop in self.populations:
+            pop.keep(~pop.death(rng))
+
+
+def _handle(tiles, streams, command, payload):
+    """
+    Runs a command on a group of tiles, in a worker or in the main process
+
+    :param tiles: dict with tile numbers as keys and Tiles as values
+    :param streams: RandomStreams of the simulation
+    :param command: str, the name of the command
+    :param payload: the arguments of the command
+
+    :return: dict with tile numbers as keys and the result for each tile
+    """
+    if command == 'first_half':
+        year, parameters, f_max, count_work = payload
+        for species in Tile.species:
+            if parameters[species.__name__] != species.parameters:
+                species.set_parameters(parameters[species.__name__])
+        return {number: tile.first_half(year, streams, f_max, count_work)
+                for number, tile in tiles.items()}
+    if command == 'second_half':
+        year, immigrants, count_work = payload
+        for number, tile in tiles.items():
+            tile.second_half(year, streams, immigrants[number], count_work)
+        return {}
+    if command == 'work':
+        work = {number: tile.work for number, tile in tiles.items()}
+        for tile in tiles.values():
+            tile.work = dict.fromkeys(Island.work_names, 0)
+        return work
+    if command == 'clear':
+        for tile in tiles.values():
+            for pop in tile.populations:
+                pop.keep(np.zeros(len(pop), dtype=bool))
+        return {}
+    if command == 'add':
+        for number, columns in payload.items():
+            tiles[number].add(columns)
+        return {}
+    if command == 'fodder':
+        return {number: tile.fodder.copy() for number, tile in tiles.items()}
+    if command == 'set_fodder':
+        for number, fodder in payload.items():
+            tiles[number].fodder = fodder
+        return {}
+    if command == 'columns':
+        return {number: tile.columns() for number, tile in tiles.items()}
+    if command == 'counts':
+        return {number: tile.counts() for number, tile in tiles.items()}
+    if command == 'summaries':
+        return {number: [(pop.species.__name__, pop.summary())
+                         for pop in tile.populations]
+                for number, tile in tiles.items()}
+    if command == 'histograms':
+        return {number: [(pop.species.__name__,
+                          {column: pop.histogram(column, edges)
+                           for column, edges in payload.items()})
+                         for pop in tile.populations]
+                for number, tile in tiles.items()}
+    if command == 'totals':
+        return {number: {pop.species.__name__: len(pop) for pop in tile.populations}
+                for number, tile in tiles.items()}
+    raise ValueError('Unknown command: ' + command)
+
+
+def _worker(conn, tiles, seed_sequence):
+    """
+    The loop that runs in each worker process
+
+    :param conn: the worker's end of a Pipe
+    :param tiles: dict with tile numbers as keys and Tiles as values
+    :param seed_sequence: SeedSequence of the simulation
+    """
+    streams = RandomStreams(seed_sequence)
+    while True:
+        command, payload = conn.recv()
+        if command == 'close':
+            break
+        conn.send(_handle(tiles, streams, command, payload))
+    conn.close()
+
+
+class TiledIsland:
+    """
+    Steps a flat island tile by tile in worker processes
+    """
+
+    def __init__(self, island, tile_shape=(64, 64), workers=None):
+        """
+        Constructor for the TiledIsland class. The animals already on the
+        island are moved into the tiles
+
+        :param island: a flat Island
+        :param tile_shape: tuple with the number of rows and columns of a tile
+        :param workers: int, the number of worker processes. All cores are
+        used if None, and 0 runs the tiles in this process
+        """
+        if not island.flat:
+            raise ValueError('Only a flat island can be split into tiles')
+        self.island = island
+        self.year = 0
+        self._emigrants = None
+        self.tile_shape = tile_shape
+        self.count_work = False
+
+        rows, cols = island.shape
+        self.tiles_per_row = -(-cols // tile_shape[1])
+        codes = island.landscape_codes.reshape(island.shape)
+        tiles = []
+        for r0 in range(0, rows, tile_shape[0]):
+            for c0 in range(0, cols, tile_shape[1]):
+                r1, c1 = min(r0 + tile_shape[0], rows), min(c0 + tile_shape[1], cols)
+                tiles.append(Tile(len(tiles), (r0, r1), (c0, c1), island.shape,
+                                  codes[r0:r1, c0:c1].flatten(), island.habitable))
+        self.tiles = tiles
+
+        if workers is None:
+            workers = os.cpu_count()
+        workers = min(workers, len(tiles))
+        self.owner = [number % max(workers, 1) for number in range(len(tiles))]
+        self.connections = []
+        self.processes = []
+        if workers == 0:
+            self.local_tiles = {tile.number: tile for tile in tiles}
+        else:
+            self.local_tiles = None
+            for worker in range(workers):
+                parent_conn, child_conn = multiprocessing.Pipe()
+                own = {tile.number: tile for tile in tiles
+                       if self.owner[tile.number] == worker}
+                process = multiprocessing.Process(
+                    target=_worker, args=(child_conn, own, island.streams.seed_sequence),
+                    daemon=True)
+                process.start()
+                child_conn.close()
+                self.connections.append(parent_conn)
+                self.processes.append(process)
+
+        self.move_island_animals()
+
+    def tile_of(self, cell):
+        """
+        :param cell: array of flat cell indices in the island
+        :return: array with the number of the tile of each cell
+        """
+        row, col = np.divmod(cell, self.island.shape[1])
+        return (row // self.tile_shape[0]) * self.tiles_per_row + col // self.tile_shape[1]
+
+    def _run(self, command, payloads):
+        """
+        Runs a command on every tile
+
+        :param command: str, the name of the command
+        :param payloads: list with the payload for each worker
+
+        :return: dict with tile numbers as keys and the result for each tile
+        """
+        if self.local_tiles is not None:
+            return _handle(self.local_tiles, self.island.streams, command, payloads[0])
+        for conn, payload in zip(self.connections, payloads):
+            conn.send((command, payload))
+        results = {}
+        for conn in self.connections:
+            results.update(conn.recv())
+        return results
+
+    def _per_worker(self, per_tile):
+        """
+        :param per_tile: dict with tile numbers as keys
+        :return: list with one dict per worker, holding that worker's tiles
+        """
+        per_worker = [{} for _ in range(max(len(self.connections), 1))]
+        for number, value in per_tile.items():
+            per_worker[self.owner[number]][number] = value
+        return per_worker
+
+    def route(self, columns_per_tile):
+        """
+        Sorts animals by the tile of their cell
+
+        :param columns_per_tile: dict with tile numbers as keys and columns
+        in the form used by Tile.add as values, visited in tile order
+
+        :return: dict with every tile number as key and the columns of
+        the animals that belong to that tile as values
+        """
+        routed = {tile.number: {} for tile in self.tiles}
+        for species in Tile.species:
+            name = species.__name__
+            parts = [columns_per_tile[number][name]
+                     for number in sorted(columns_per_tile)]
+            columns = [np.concatenate([part[i] for part in parts])
+                       if parts else np.zeros(0) for i in range(4)]
+            columns[3] = columns[3].astype(np.int64)
+            destination = self.tile_of(columns[3])
+            order = np.argsort(destination, kind='stable')
+            bounds = np.searchsorted(destination[order], np.arange(len(self.tiles) + 1))
+            for number in range(len(self.tiles)):
+                rows = order[bounds[number]:bounds[number + 1]]
+                routed[number][name] = tuple(column[rows] for column in columns)
+        return routed
+
+    def move_island_animals(self):
+        """
+        Moves the animals in the island's own populations into the tiles,
+        which leaves the island's populations empty
+        """
+        columns = {name: (pop.age, pop.weight, pop.fitness, pop.cell)
+                   for name, pop in zip(('Herbivore', 'Carnivore'),
+                                        self.island.populations())}
+        self._run('add', self._per_worker(self.route({0: columns})))
+        for pop in self.island.populations():
+            pop.keep(np.zeros(len(pop), dtype=bool))
+
+    def add_population(self, population):
+        """
+        Adds animals to the island, in the same way as Island.add_population
+
+        :param population: List of dictionaries specifying population
+        """
+        self.island.add_population(population)
+        self.move_island_animals()
+
+    phase_names = ('first_half', 'second_half')
+
+    def annual_cycle(self):
+        """
+        Runs one year on every tile. The animals that cross a tile border
+        in the migration are handed to their new tile in between
+        """
+        for _, phase in self.phases():
+            phase()
+
+    def phases(self):
+        """
+        The year in two halves, so they can be timed one by one. The
+        first half runs up to the migration, the second half routes
+        the emigrants and runs the rest of the year
+
+        :return: list with a (name, function) pair for each half
+        """
+        return list(zip(self.phase_names, (self._first_half, self._second_half)))
+
+    def _first_half(self):
+        """
+        Starts a new year on every tile and keeps the emigrants
+        """
+        self.year += 1
+        parameters = {species.__name__: dict(species.parameters)
+                      for species in Tile.species}
+        payload = (self.year, parameters, self.island.f_max_per_code(), self.count_work)
+        self._emigrants = self._run('first_half', [payload] * max(len(self.connections), 1))
+
+    def _second_half(self):
+        """
+        Hands the emigrants to their new tiles and finishes the year
+        """
+        immigrants = self.route(self._emigrants)
+        self._emigrants = None
+        self._run('second_half', [(self.year, tile_immigrants, self.count_work)
+                                  for tile_immigrants in self._per_worker(immigrants)])
+
+    def take_work(self):
+        """
+        Collects the work the tiles have counted since the last call,
+        see Island.take_work
+
+        :return: dict with the names in Island.work_names as keys
+        """
+        work = dict.fromkeys(Island.work_names, 0)
+        for tile_work in self._run('work', [None] * max(len(self.connections), 1)).values():
+            for name, value in tile_work.items():
+                work[name] += value
+        return work
+
+    def count_grids(self):
+        """
+        Counts the animals of each species in every cell
+
+        :return: dict
+        The species are keys, arrays with the same shape as the map are values
+        """
+        counts = self._run('counts', [None] * max(len(self.connections), 1))
+        grids = {species.__name__: np.zeros(self.island.shape, dtype=np.int64)
+                 for species in Tile.species}
+        for number, tile_counts in counts.items():
+            tile = self.tiles[number]
+            for name, count in tile_counts.items():
+                grids[name][tile.rows[0]:tile.rows[1], tile.cols[0]:tile.cols[1]] = count
+        return grids
+
+    def count_animals(self):
+        """
+        :return: dict with the species as keys and the number
+        of animals on the island as values
+        """
+        totals = self._run('totals', [None] * max(len(self.connections), 1))
+        return {species.__name__: sum(tile_totals[species.__name__]
+                                      for tile_totals in totals.values())
+                for species in Tile.species}
+
+    def yearly_statistics(self):
+        """
+        :return: the statistics of the year, see Island.yearly_statistics
+        """
+        summaries = self._run('summaries', [None] * max(len(self.connections), 1))
+        return Island.combine_summaries(
+            [summary for number in sorted(summaries) for summary in summaries[number]])
+
+    def histograms(self, edges):
+        """
+        :param edges: dict with the column names as keys and bin edges as values
+        :return: the histograms of all tiles, see Island.histograms
+        """
+        histograms = self._run('histograms', [edges] * max(len(self.connections), 1))
+        return Island.combine_histograms(
+            [pair for number in sorted(histograms) for pair in histograms[number]], edges)
+
+    def populations(self):
+        """
+        Collects the animals of all tiles, in tile order
+
+        :return: tuple with a herbivore and a carnivore Population
+        with island cell indices
+        """
+        columns = self._run('columns', [None] * max(len(self.connections), 1))
+        pops = tuple(Population(species) for species in Tile.species)
+        for number in sorted(columns):
+            for pop in pops:
+                age, weight, fitness, cell = columns[number][pop.species.__name__]
+                pop.add(age, weight, fitness, cell)
+        return pops
+
+    def get_state(self):
+        """
+        :return: the animals and the fodder of all tiles, in the form
+        returned by Island.get_state
+        """
+        state = {'fodder': np.zeros(self.island.landscape_codes.shape)}
+        fodder = self._run('fodder', [None] * max(len(self.connections), 1))
+        for tile in self.tiles:
+            state['fodder'][tile.to_global(np.arange(tile.codes.size))] = fodder[tile.number]
+        for pop in self.populations():
+            for column in ('age', 'weight', 'fitness', 'cell'):
+                state[pop.species.__name__ + '_' + column] = getattr(pop, column)
+        return state
+
+    def set_state(self, state):
+        """
+        Replaces the animals and the fodder in the tiles with those in a state
+
+        :param state: dict in the form returned by Island.get_state
+        """
+        self._run('clear', [None] * max(len(self.connections), 1))
+        columns = {species.__name__: tuple(state[species.__name__ + '_' + column]
+                                           for column in ('age', 'weight', 'fitness', 'cell'))
+                   for species in Tile.species}
+        self._run('add', self._per_worker(self.route({0: columns})))
+        fodder = np.asarray(state['fodder'])
+        self._run('set_fodder', self._per_worker(
+            {tile.number: fodder[tile.to_global(np.arange(tile.codes.size))]
+             for tile in self.tiles}))
+
+    def close(self):
+        """
+        Stops the worker processes
+        """
+        for conn in self.connections:
+            conn.send(('close', None))
+            conn.close()
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
@@ -16,15 +16,25 @@ class Visuals:
     This is documentation for the Visuals class
     """
 
-    def __init__(self):
+    initial_history = 64
+
+    def __init__(self, ymax=None, hist_edges=None):
         """
         Constructor for visuals, there are a lot of variables here
         but all of these are called upon later.
+
+        :param ymax: the y-axis limit of the line plot.
+        If None the limit follows the number of animals
+        :param hist_edges: dict with 'age', 'weight' or 'fitness' as keys
+        and the bin edges of the histogram of that property as values
         """
         self.fig = plt.figure(figsize=(32, 20))
         self.steps = 0
-        self.herb_data_list = []
-        self.carn_data_list = []
+        self.ymax = ymax
+        self.num_points = 0
+        self.history = np.zeros((3, self.initial_history))
+        self.herb_line = None
+        self.carn_line = None
 
         self.heatmap_herb = None
         self.herb_axis = None
@@ -34,6 +44,9 @@ class Visuals:
         self.line_plot_axis = None
         self.year_counter = None
         self.changing_year = None
+        self.hist_edges = hist_edges or {}
+        self.hist_axes = {}
+        self.hist_bars = {}
 
     def set_plots(self, rgb_map=None):
         """
@@ -60,18 +73,47 @@ class Visuals:
         self.island_axis.imshow(rgb_map)
 
         self.line_plot_axis = self.fig.add_axes([0.55, 0.65, 0.35, 0.3])
-        plt.pause(1)
+        self.line_plot_axis.set_xlabel('Years')
+        self.line_plot_axis.set_ylabel('Number of Species')
+        self.herb_line, = self.line_plot_axis.plot([], [], '-', color='g')
+        self.carn_line, = self.line_plot_axis.plot([], [], '-', color='r')
+        self.line_plot_axis.set_xlim(0, self.history.shape[1])
+        self.line_plot_axis.set_ylim(0, self.ymax or 1)
+
+        width = 0.8 / max(len(self.hist_edges), 1)
+        for n, (prop, edges) in enumerate(self.hist_edges.items()):
+            axis = self.fig.add_axes([0.1 + n * width, 0.02, 0.8 * width, 0.08])
+            axis.title.set_text('Histogram of ' + prop)
+            axis.set_xlim(edges[0], edges[-1])
+            axis.set_ylim(0, 1)
+            empty = np.zeros(len(edges) - 1)
+            self.hist_bars[prop] = {
+                'Herbivore': axis.stairs(empty, edges, color='g', fill=True, alpha=0.5),
+                'Carnivore': axis.stairs(empty, edges, color='r', fill=True, alpha=0.5)}
+            self.hist_axes[prop] = axis
+        plt.pause(1e-3)
 
         self.year_counter = self.fig.add_axes([0.4, 0.5, 0.05, 0.05])
         self.year_counter.axis('off')
         self.changing_year = self.year_counter.text(0.2, 0.5, "Year: " + str(0)
                                                     , fontdict={'weight': 'bold', 'size': 16})
 
-    def update_year(self):
+    def canvas_rgb(self):
+        """
+        Draws the figure and copies it out as an image
+
+        :return: uint8 array with shape (height, width, 3)
+        """
+        self.fig.canvas.draw()
+        return np.asarray(self.fig.canvas.buffer_rgba())[..., :3].copy()
+
+    def update_year(self, year=None):
         """
         This method updates the year.
+
+        :param year: int, the year to show. If None the year is counted up by one
         """
-        self.steps += 1
+        self.steps = self.steps + 1 if year is None else year
         self.changing_year.set_text("Year: " + str(self.steps))
 
     def update_heat_maps(self, anim_distribution_dict=None):
@@ -102,21 +144,44 @@ class Visuals:
         else:
             self.carn_axis.set_data(anim_distribution_dict['Carnivore'])
 
-        plt.pause(1)
+        plt.pause(1e-3)
 
-    def update_line_plt(self, num_animals_per_species):
+    def update_histograms(self, histograms):
         """
-        This takes care of the line plot
+        Updates the bars of the histograms in place
 
-        :param num_animals_per_species: int, number of animals per species
+        :param histograms: dict with the properties as keys and dicts with
+        the count in each bin for each species as values
         """
+        for prop, counts in histograms.items():
+            for species, bars in self.hist_bars[prop].items():
+                bars.set_data(counts[species])
+            top = max(counts[species].max(initial=0) for species in counts)
+            if top > self.hist_axes[prop].get_ylim()[1]:
+                self.hist_axes[prop].set_ylim(0, 1.5 * top)
 
-        self.herb_data_list.append(num_animals_per_species['Herbivore'])
-        self.carn_data_list.append(num_animals_per_species['Carnivore'])
-        length = len(self.carn_data_list)
-        xlist = list(np.arange(length))
+    def update_line_plt(self, num_animals_per_species):
+        """
+        This takes care of the line plot. The history of the counts is
+        kept in an array that doubles in size when it is full, and the two
+        lines are updated with it, so a frame costs the same every year
 
-        self.line_plot_axis.set_xlabel('Years')
-        self.line_plot_axis.set_ylabel('Number of Species')
-        self.line_plot_axis.plot(xlist, self.herb_data_list, '-', color='g')
-        self.line_plot_axis.plot(xlist, self.carn_data_list, '-', color='r')
+        :param num_animals_per_species: int, number of animals per species
+        """
+        if self.num_points == self.history.shape[1]:
+            self.history = np.concatenate((self.history, np.zeros_like(self.history)),
+                                          axis=1)
+            self.line_plot_axis.set_xlim(0, self.history.shape[1])
+
+        self.history[:, self.num_points] = (self.num_points,
+                                            num_animals_per_species['Herbivore'],
+                                            num_animals_per_species['Carnivore'])
+        self.num_points += 1
+        years, herbs, carns = self.history[:, :self.num_points]
+        self.herb_line.set_data(years, herbs)
+        self.carn_line.set_data(years, carns)
+
+        if self.ymax is None:
+            top = self.history[1:, self.num_points - 1].max()
+            if top > self.line_plot_axis.get_ylim()[1]:
+                self.line_plot_axis.set_ylim(0, 1.5 * top)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""
+The small island and population shared by the tests that step
+a simulation in cell mode, flat mode or split into tiles
+"""
+
+__author__ = 'Peter Langdalen'
+__email__ = 'pelangda@nmbu.no'
+
+from biosim.island import Island
+from biosim.random_streams import RandomStreams
+from biosim.simulation import BioSim
+from biosim.tiles import TiledIsland
+import pytest
+
+
+@pytest.fixture
+def small_map():
+    """
+    A small island with a few landscape types
+    """
+    return """\
+        WWWWWWW
+        WLLHLLW
+        WLDLLHW
+        WLLLHLW
+        WWWWWWW"""
+
+
+@pytest.fixture
+def ini_pop():
+    """
+    60 herbivores and 8 carnivores in one cell of small_map
+    """
+    return [{'loc': (2, 2),
+             'pop': [{'species': 'Herbivore', 'age': 5, 'weight': 20}
+                     for _ in range(60)] +
+                    [{'species': 'Carnivore', 'age': 5, 'weight': 20}
+                     for _ in range(8)]}]
+
+
+@pytest.fixture(params=['cell', 'flat', 'tiles'])
+def mode(request):
+    """
+    Each of the ways an island can be stepped
+    """
+    return request.param
+
+
+@pytest.fixture
+def make_stepper(small_map, ini_pop):
+    """
+    Makes islands with ini_pop on small_map, in cell mode, flat mode
+    or split into tiles. The tiled islands are closed after the test
+    """
+    tiled = []
+
+    def make(mode, seed=4, tile_shape=(2, 3), workers=0):
+        island = Island(small_map, flat=mode != 'cell', streams=RandomStreams(seed))
+        island.add_population(ini_pop)
+        if mode != 'tiles':
+            return island
+        tiled.append(TiledIsland(island, tile_shape=tile_shape, workers=workers))
+        return tiled[-1]
+
+    yield make
+    for stepper in tiled:
+        stepper.close()
+
+
+@pytest.fixture
+def make_sim(small_map, ini_pop):
+    """
+    Makes simulations with ini_pop on small_map, in cell mode, flat mode
+    or split into tiles in this process
+    """
+    def make(mode, seed=4, **kwargs):
+        return BioSim(small_map, ini_pop, seed=seed, flat=mode == 'flat',
+                      workers=0 if mode == 'tiles' else None, tile_shape=(2, 3), **kwargs)
+
+    return make
@@ -9,6 +9,7 @@ __email__ = 'pelangda@nmbu.no'
 
 from biosim.animals import Animal, Herbivore, Carnivore
 import pytest
+import numpy as np
 
 
 class TestAnimal:
@@ -51,6 +52,27 @@ class TestAnimal:
         h.set_parameters(new_params)
         assert h.parameters == new_params
 
+    def test_compiled_parameters(self):
+        """
+        Tests that the parameter block follows set_parameters, with the
+        derived constants, and that a bad value changes nothing
+        """
+        old = dict(Carnivore.parameters)
+        try:
+            Carnivore.set_parameters({'zeta': 2.0, 'DeltaPhiMax': 4.0})
+            p = Carnivore.params
+            assert p.zeta == 2.0
+            assert p.birth_weight_limit == 2.0 * (p.w_birth + p.sigma_birth)
+            assert p.inv_delta_phi_max == 0.25
+            with pytest.raises(ValueError):
+                Carnivore.set_parameters({'F': 10.0, 'DeltaPhiMax': 0})
+            assert Carnivore.params == p
+            assert Carnivore.parameters['F'] == old['F']
+            with pytest.raises(AttributeError):
+                Carnivore.params.zeta = 1.0
+        finally:
+            Carnivore.set_parameters(old)
+
     @pytest.mark.parametrize("animal_class", [Herbivore, Carnivore])
     def test_constructor(self, animal_class):
         """
@@ -169,11 +191,12 @@ class TestAnimal:
         Tests that the give_birth function works as intended
         :return:
         """
-        mocker.patch("numpy.random.random", return_value=0)
+        rng = mocker.Mock(wraps=np.random.default_rng(1))
+        rng.random.return_value = 0
         h = Herbivore(5, 50)
         c = Carnivore(5, 50)
-        herbs = h.give_birth(10)
-        carns = c.give_birth(10)
+        herbs = h.give_birth(10, rng)
+        carns = c.give_birth(10, rng)
         assert herbs
         assert carns
 
@@ -183,10 +206,11 @@ class TestAnimal:
         Tests that the death method works as intended
         :return:
         """
-        mocker.patch("numpy.random.random", return_value=0)
+        rng = mocker.Mock(wraps=np.random.default_rng(1))
+        rng.random.return_value = 0
 
         a = animal_class(5, 0)
-        dead_animal = a.death()
+        dead_animal = a.death(rng)
         assert dead_animal
 
     @pytest.mark.parametrize("animal_class", [Herbivore, Carnivore])
@@ -203,3 +227,16 @@ class TestAnimal:
             list_of_ini_weights.append(a.weight)
             ks, p_value = kstest(list_of_ini_weights, 'norm')
             assert p_value < alpha
+
+    @pytest.mark.parametrize("animal_class", [Herbivore, Carnivore])
+    def test_fitness_kernel_same_as_compute_fitness(self, animal_class):
+        """
+        Tests that the batched fitness kernel gives the same fitness as
+        compute_fitness, also for an animal without weight
+        """
+        ages = [0, 1, 5, 40, 80, 3]
+        weights = [8.0, 0.0, 20, 35.5, 60, 1e-3]
+        animals = [animal_class(age, weight) for age, weight in zip(ages, weights)]
+        batch = animal_class.fitness_kernel(ages, weights)
+        assert list(batch) == [a.fitness for a in animals]
+        assert batch[1] == 0
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+"""
+
+__author__ = 'Peter Langdalen'
+__email__ = 'pelangda@nmbu.no'
+
+from biosim import ensemble
+from biosim.animals import Herbivore
+from biosim.ensemble import Ensemble, run_replicate
+from biosim.landscape import Lowland
+import multiprocessing
+import os
+import pytest
+
+
+class TestEnsemble:
+    """
+    The Ensemble testclass
+    """
+
+    def test_replicate_matches_island(self, small_map, ini_pop, make_stepper):
+        """
+        Tests that a replicate counts the same animals as an island
+        run with the same seed
+        """
+        counts = run_replicate(small_map, ini_pop, 7, 4)
+        island = make_stepper('flat', seed=7)
+        for year in range(4):
+            island.annual_cycle()
+            assert list(counts[year]) == [len(pop) for pop in island.populations()]
+
+    @pytest.mark.parametrize("processes", [0, 2])
+    def test_run(self, processes, small_map, ini_pop):
+        """
+        Tests that every year of every replicate is reported and stored,
+        the same for a pool and for a run in this process
+        """
+        seen = []
+        ensemble = Ensemble(small_map, ini_pop, [1, 2, 3], processes=processes)
+        result = ensemble.run(5, callback=lambda i, year, c: seen.append((i, year)))
+        assert sorted(seen) == [(i, year) for i in range(3) for year in range(1, 6)]
+        for index, seed in enumerate([1, 2, 3]):
+            assert (result.counts[index] ==
+                    run_replicate(small_map, ini_pop, seed, 5)).all()
+
+    def test_aggregates(self, small_map, ini_pop):
+        """
+        Tests the mean and quantiles over replicates
+        """
+        result = Ensemble(small_map, ini_pop, range(4), processes=0).run(3)
+        mean = result.mean()
+        quantiles = result.quantiles((0, 1))
+        assert list(result.years) == [1, 2, 3]
+        assert mean['Herbivore'] == pytest.approx(result.counts[:, :, 0].mean(axis=0))
+        assert list(quantiles['Carnivore'][0]) == list(result.counts[:, :, 1].min(axis=0))
+        assert list(quantiles['Carnivore'][1]) == list(result.counts[:, :, 1].max(axis=0))
+
+    def test_parameters_restored(self, small_map, ini_pop):
+        """
+        Tests that the parameters a replicate overrides are set back
+        when it is done, also when it fails
+        """
+        herbivore, lowland = dict(Herbivore.parameters), dict(Lowland.parameters)
+        params = Herbivore.params
+        run_replicate(small_map, ini_pop, 1, 2, {'Herbivore': {'F': 3.}, 'L': {'f_max': 50.}})
+        assert Herbivore.parameters == herbivore
+        assert Lowland.parameters == lowland
+        assert Herbivore.params == params
+        with pytest.raises(KeyError):
+            run_replicate(small_map, ini_pop, 1, 2, {'Herbivore': {'F': 3.}, 'X': {}})
+        assert Herbivore.parameters == herbivore
+
+    @pytest.mark.parametrize("processes", [0, 2])
+    def test_no_seeds(self, processes, small_map, ini_pop):
+        """
+        Tests that an ensemble without seeds gives an empty result
+        """
+        result = Ensemble(small_map, ini_pop, [], processes=processes).run(3)
+        assert result.seeds == []
+        assert result.counts.shape == (0, 3, 2)
+
+    @pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                        reason='the workers must be forked to see the patched replicate')
+    def test_worker_stopped(self, small_map, ini_pop, monkeypatch):
+        """
+        Tests that a pool worker that dies in a replicate stops the run
+        with an error, instead of leaving it waiting forever
+        """
+        monkeypatch.setattr(ensemble, 'run_replicate', lambda *task, report: os._exit(1))
+        with pytest.raises(RuntimeError, match='replicate'):
+            Ensemble(small_map, ini_pop, [1], processes=1).run(3)
@@ -10,6 +10,7 @@ __email__ = 'pelangda@nmbu.no'
 from biosim.animals import Herbivore, Carnivore
 from biosim.landscape import Cell, Lowland, Highland, Desert, Water
 from biosim.island import Island
+from biosim.random_streams import RandomStreams
 import pytest
 import textwrap
 import numpy as np
@@ -55,5 +56,220 @@ class TestIsland:
             i.create_map("""WL
                             LW""")
 
+    @pytest.mark.parametrize("island_map, message", [
+        ("WWW\nWLLW\nWWW", 'equal length'),
+        ("WWWW\nWLW\nWWWWW", 'equal length'),
+        ("WWW\nWRW\nWWW", 'Invalid landscape'),
+        ("WWW\nWLL\nWWW", 'water')])
+    def test_parse_map_errors(self, island_map, message):
+        """
+        Tests that parse_map tells what is wrong with a map
+        """
+        with pytest.raises(ValueError, match=message):
+            Island.parse_map(island_map)
+
+    def test_map_from_file(self, tmp_path):
+        """
+        Tests that a map file with Windows line endings gives the same
+        island as the string, and that a flat island makes no cells
+        """
+        path = tmp_path / 'island.map'
+        path.write_bytes(default_map.strip().replace('\n', '\r\n').encode() + b'\r\n')
+        from_file = Island.from_file(str(path), flat=True)
+        from_string = Island(default_map)
+        assert from_file._island is None
+        assert (from_file.code_grid == from_string.code_grid).all()
+        assert (from_file.habitable == from_string.habitable).all()
+        assert type(from_file.island[2][6]) is type(from_string.island[2][6]) is Lowland
+
+    @pytest.mark.parametrize("flat", [False, True])
+    def test_add_population(self, flat):
+        """
+        Tests that animals placed on the island are counted in the right cell
+        """
+        i = Island(default_map, flat=flat)
+        i.add_population([{'loc': (10, 10),
+                           'pop': [{'species': 'Herbivore', 'age': 5, 'weight': 20}
+                                   for _ in range(15)] +
+                                  [{'species': 'Carnivore', 'age': 5, 'weight': 20}
+                                   for _ in range(4)]}])
+        grids = i.count_grids()
+        assert grids['Herbivore'][10, 10] == 15
+        assert grids['Carnivore'][10, 10] == 4
+        assert grids['Herbivore'].sum() == 15
+
+    def test_flat_cell_view(self):
+        """
+        Tests that the cells of a flat island are a copy of its
+        animals and fodder, made again every time they are asked for
+        """
+        i = Island(default_map, flat=True, streams=RandomStreams(6))
+        i.add_population([{'loc': (10, 10),
+                           'pop': [{'species': 'Herbivore', 'age': 5, 'weight': 20}
+                                   for _ in range(40)]}])
+        i.annual_cycle()
+        cells = i.island
+        grids = i.count_grids()
+        assert (np.array([[len(cel.herbivore) for cel in row] for row in cells]) ==
+                grids['Herbivore']).all()
+        assert cells[10][10].fodder == i.fodder[10 * i.shape[1] + 10]
+        assert sum(cel.herbivore.weight.sum() for row in cells for cel in row) == \
+            pytest.approx(i.herbivores.weight.sum())
+        cells[10][10].herbivore.keep(np.zeros(len(cells[10][10].herbivore), dtype=bool))
+        assert i.island is not cells
+        assert i.count_grids()['Herbivore'].sum() == len(i.herbivores) > 0
+
+    def test_only_land_cells_stored(self):
+        """
+        Tests that a cell mode island keeps Cell objects for the land only
+        and nothing island wide, and that animals given a water cell are left out
+        """
+        i = Island(default_map)
+        assert len(i.land_cells) == i.habitable.sum()
+        assert i.fodder is None and i.herbivores is None and i.carnivores is None
+        assert not any(isinstance(cel, Water) for cel in i.land_cells)
+        assert i.island[10][10] is i.land_cells[i.land_slots(10 * i.shape[1] + 10)]
+        with pytest.warns(UserWarning):
+            i.add_population([{'loc': (0, 0),
+                               'pop': [{'species': 'Herbivore', 'age': 5, 'weight': 20}]}])
+        assert i.count_animals()['Herbivore'] == 0
+        with pytest.raises(ValueError):
+            i.add_population([{'loc': (20, 0), 'pop': []}])
+
+    def test_active_cells(self):
+        """
+        Tests that only the cells with animals are active, and that an
+        idle cell has grown its fodder when animals arrive
+        """
+        i = Island(default_map, streams=RandomStreams(3))
+        i.add_population([{'loc': (10, 10),
+                           'pop': [{'species': 'Herbivore', 'age': 5, 'weight': 20}
+                                   for _ in range(40)]}])
+        assert list(i.land[i.active]) == [10 * i.shape[1] + 10]
+        idle = i.land_cells[i.land_slots(2 * i.shape[1] + 2)]
+        idle.fodder = 0
+        for _ in range(3):
+            i.annual_cycle()
+            occupied = [slot for slot, cel in enumerate(i.land_cells)
+                        if len(cel.herbivore) + len(cel.carnivore)]
+            assert set(occupied) <= set(i.active)
+            assert len(i.active) < len(i.land_cells)
+        assert idle.fodder == 0
+        i.activate(i.land_slots([2 * i.shape[1] + 2]))
+        assert idle.fodder == Highland.parameters['f_max']
 
+    def test_animals_placed_in_cell(self):
+        """
+        Tests that animals placed straight into a cell are counted
+        and go through the next year
+        """
+        i = Island(default_map, streams=RandomStreams(4))
+        i.island[10][10].place_animals([{'species': 'Herbivore', 'age': 5, 'weight': 20}
+                                        for _ in range(10)])
+        assert i.count_animals()['Herbivore'] == 10
+        i.annual_cycle(i.island)
+        herbs = [cel.herbivore for row in i.island for cel in row if len(cel.herbivore)]
+        assert i.count_animals()['Herbivore'] == sum(len(pop) for pop in herbs) > 0
+        assert all((pop.age == 6).all() for pop in herbs)
+
+    def test_annual_cycle_with_nested_map(self):
+        """
+        Tests that annual_cycle takes the map as a nested list of cells,
+        both the island's own and another one of the same shape
+        """
+        pop = [{'loc': (10, 10),
+                'pop': [{'species': 'Herbivore', 'age': 5, 'weight': 20}
+                        for _ in range(40)]}]
+        own, plain = (Island(default_map, streams=RandomStreams(5)) for _ in range(2))
+        for i in (own, plain):
+            i.add_population(pop)
+        for _ in range(3):
+            own.annual_cycle(own.island)
+            plain.annual_cycle()
+        for species in ('Herbivore', 'Carnivore'):
+            assert (own.count_grids()[species] == plain.count_grids()[species]).all()
+
+        i = Island(default_map, streams=RandomStreams(5))
+        other = i.create_map(default_map)
+        other[10][10].place_animals(pop[0]['pop'])
+        for _ in range(3):
+            i.annual_cycle(other)
+        assert sum(len(cel.herbivore) for row in other for cel in row) > 0
+        assert not any(len(cel.herbivore) for row in other for cel in row
+                       if not cel.habitable_cell)
+        assert len(i.active) == 0
+        with pytest.raises(ValueError):
+            i.annual_cycle(other[1:])
+
+    def test_flat_animals_stay_on_land(self):
+        """
+        Tests that animals in a flat island never migrate into water
+        """
+        i = Island(default_map, flat=True, streams=RandomStreams(1))
+        i.add_population([{'loc': (10, 10),
+                           'pop': [{'species': 'Herbivore', 'age': 5, 'weight': 20}
+                                   for _ in range(100)]}])
+        for _ in range(10):
+            i.annual_cycle()
+        assert i.habitable[i.herbivores.cell].all()
+        assert len(i.herbivores) > 0
 
+    def test_migration_to_neighbours(self, mocker):
+        """
+        Tests that every animal that wants to move ends up in a neighbouring
+        land cell, and that no animal is lost on the way
+        """
+        rng = mocker.Mock(wraps=np.random.default_rng(1))
+        rng.random.return_value = 0
+        i = Island(default_map)
+        i.add_population([{'loc': (1, 8),
+                           'pop': [{'species': 'Herbivore', 'age': 5, 'weight': 20}
+                                   for _ in range(50)]}])
+        i.start_migration(rng=rng)
+        grids = i.count_grids()
+        assert grids['Herbivore'].sum() == 50
+        assert grids['Herbivore'][0, 8] == 0
+        assert grids['Herbivore'][1, 8] + grids['Herbivore'][2, 8] == 50
+
+    @pytest.mark.parametrize("flat", [False, True])
+    def test_count_grids_kept_up_to_date(self, flat):
+        """
+        Tests that the kept count grids match a fresh count after
+        births, deaths, predation and migration
+        """
+        i = Island(default_map, flat=flat, streams=RandomStreams(2))
+        i.add_population([{'loc': (10, 10),
+                           'pop': [{'species': 'Herbivore', 'age': 5, 'weight': 20}
+                                   for _ in range(60)] +
+                                  [{'species': 'Carnivore', 'age': 5, 'weight': 20}
+                                   for _ in range(10)]}])
+        for _ in range(8):
+            i.annual_cycle()
+        if flat:
+            fresh = {pop.species.__name__:
+                     pop.count_per_cell(i.habitable.size).reshape(i.shape)
+                     for pop in i.populations()}
+        else:
+            fresh = {'Herbivore': np.array([[len(c.herbivore) for c in row]
+                                            for row in i.island]),
+                     'Carnivore': np.array([[len(c.carnivore) for c in row]
+                                            for row in i.island])}
+        grids = i.count_grids()
+        for species in ('Herbivore', 'Carnivore'):
+            assert (grids[species] == fresh[species]).all()
+            assert i.count_animals()[species] == fresh[species].sum()
+
+    @pytest.mark.parametrize("flat", [False, True])
+    def test_histograms(self, flat):
+        """
+        Tests that the histograms count every animal in the right bin
+        """
+        i = Island(default_map, flat=flat)
+        i.add_population([{'loc': (10, 10),
+                           'pop': [{'species': 'Herbivore', 'age': age, 'weight': 20}
+                                   for age in (1, 1, 3, 7)]},
+                          {'loc': (2, 8),
+                           'pop': [{'species': 'Herbivore', 'age': 3, 'weight': 20}]}])
+        hist = i.histograms({'age': np.arange(0, 10, 2.)})
+        assert list(hist['age']['Herbivore']) == [2, 2, 0, 1]
+        assert hist['age']['Carnivore'].sum() == 0
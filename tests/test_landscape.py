@@ -10,6 +10,7 @@ __email__ = 'pelangda@nmbu.no'
 from biosim.landscape import Cell, Lowland, Highland, Desert, Water
 from biosim.animals import Herbivore, Carnivore
 import pytest
+import numpy as np
 
 
 class TestCell:
@@ -40,6 +41,32 @@ class TestCell:
             ll = Lowland
             ll.set_parameters([1, 2, 3])
 
+    @pytest.mark.parametrize("landscape, params", [(Lowland, {'f_max': 800.0, 'alpha': 1.0}),
+                                                   (Desert, {'f_max': 10.0})])
+    def test_key_error_parameters(self, landscape, params):
+        """
+        Tests that a KeyError is raised for keys that are not
+        parameters of the landscape, and that nothing is changed
+        """
+        old = landscape.params
+        with pytest.raises(KeyError):
+            landscape.set_parameters(params)
+        assert landscape.params == old
+        assert 'alpha' not in landscape.parameters
+
+    def test_compiled_parameters(self):
+        """
+        Tests that new fodder grows from the parameter block
+        """
+        old = Highland.parameters['f_max']
+        try:
+            Highland.set_parameters({'f_max': 123.0})
+            h = Highland()
+            assert Highland.params.f_max == h.fodder == 123.0
+            assert Water.params.f_max == Desert.params.f_max == 0
+        finally:
+            Highland.set_parameters({'f_max': old})
+
     def test_is_there_fodder(self):
         """
         Tests that there is fodder in a Lowland cell
@@ -63,19 +90,22 @@ class TestCell:
                            'weight': 20}
                           for _ in range(40)]
 
-        assert c.place_animals(herbs) == c.herbivore.append(herbs)
-        assert c.place_animals(carns) == c.carnivore.append(carns)
+        c.place_animals(herbs)
+        c.place_animals(carns)
+        assert len(c.herbivore) == 40
+        assert len(c.carnivore) == 40
 
     def test_procreation(self, mocker):
         """
         Tests that animals can procreate
         :return:
         """
-        mocker.patch('numpy.random.random', return_value=0)
+        rng = mocker.Mock(wraps=np.random.default_rng(1))
+        rng.random.return_value = 0
         l = Lowland()
         l.herbivore = [Herbivore(5, 50), Herbivore(5, 50)]
         l.carnivore = [Carnivore(5, 50), Carnivore(5, 50)]
-        l.procreation_animals()
+        l.procreation_animals(rng)
 
         assert len(l.herbivore) >= 3
         assert len(l.carnivore) >= 3
@@ -88,12 +118,23 @@ class TestCell:
         c = Cell()
         c.herbivore = [Herbivore(5, 0), Herbivore(5, 100)]
         c.carnivore = [Carnivore(5, 0), Carnivore(5, 100)]
-        c.herbivore[0].fitness = 0
-        c.herbivore[1].fitness = 1
-        c.carnivore[0].fitness = 0
-        c.carnivore[1].fitness = 1
+        c.herbivore.fitness[:] = [0, 1]
+        c.carnivore.fitness[:] = [0, 1]
         c.animals_die()
 
         assert len(c.herbivore) == 1
         assert len(c.carnivore) == 1
 
+    def test_feed_herbivores_partial_meal(self):
+        """
+        Tests that the fodder runs out, and that the last herbivore
+        to eat only gets what is left
+        """
+        p = Herbivore.parameters
+        c = Cell()
+        c.herbivore = [Herbivore(5, 20) for _ in range(4)]
+        c.fodder = 2.5 * p['F']
+        c.feed_herbivores()
+        gained = np.sort(c.herbivore.weight - 20) / p['beta']
+        assert c.fodder == 0
+        assert gained == pytest.approx([0, 0.5 * p['F'], p['F'], p['F']])
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+"""
+
+__author__ = 'Peter Langdalen'
+__email__ = 'pelangda@nmbu.no'
+
+from biosim.movie import MovieWriter
+import numpy as np
+import os
+import sys
+import textwrap
+
+fake_ffmpeg = textwrap.dedent("""\
+    #!{}
+    import sys
+    with open(sys.argv[-1], 'wb') as out:
+        out.write(sys.stdin.buffer.read())
+    """)
+
+
+def frames(num):
+    """
+    Makes num small frames with different content
+    """
+    return [np.full((4, 6, 3), n, dtype=np.uint8) for n in range(num)]
+
+
+class TestMovieWriter:
+    """
+    The MovieWriter testclass
+    """
+
+    def test_archive_without_ffmpeg(self, tmp_path):
+        """
+        Tests that the frames go to a NumPy archive when there is no ffmpeg
+        """
+        movie = MovieWriter(str(tmp_path / 'sim.mp4'), ffmpeg='no-such-ffmpeg')
+        for frame in frames(3):
+            movie.add_frame(frame)
+        movie.close()
+        assert movie.filename == str(tmp_path / 'sim.npz')
+        archive = np.load(movie.filename)
+        assert sorted(archive.files) == ['frame_00000', 'frame_00001', 'frame_00002']
+        assert (archive['frame_00002'] == 2).all()
+
+    def test_frames_piped_to_ffmpeg(self, tmp_path):
+        """
+        Tests that the raw frames are written to the stdin of ffmpeg, in order
+        """
+        ffmpeg = tmp_path / 'ffmpeg'
+        ffmpeg.write_text(fake_ffmpeg.format(sys.executable))
+        os.chmod(ffmpeg, 0o755)
+        movie = MovieWriter(str(tmp_path / 'sim.mp4'), ffmpeg=str(ffmpeg))
+        for frame in frames(3):
+            movie.add_frame(frame)
+        movie.close()
+        written = np.frombuffer((tmp_path / 'sim.mp4').read_bytes(), dtype=np.uint8)
+        assert (written == np.concatenate([f.ravel() for f in frames(3)])).all()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+"""
+
+__author__ = 'Peter Langdalen'
+__email__ = 'pelangda@nmbu.no'
+
+from biosim.animals import Herbivore, Carnivore
+from biosim.population import Population
+import numpy as np
+import pytest
+
+
+class TestPopulation:
+    """
+    The Population testclass
+    """
+
+    def test_from_animals(self):
+        """
+        Tests that the columns hold the values of the animal objects
+        """
+        animals = [Herbivore(3, 10), Herbivore(5, 20)]
+        pop = Population.from_animals(Herbivore, animals)
+        assert len(pop) == 2
+        assert list(pop.age) == [3, 5]
+        assert list(pop.weight) == [10, 20]
+        assert pop.fitness == pytest.approx([a.fitness for a in animals])
+
+    def test_capacity_grows(self):
+        """
+        Tests that the population can grow past its initial capacity
+        """
+        pop = Population(Carnivore)
+        n = 10 * Population.initial_capacity
+        pop.add(np.arange(n), np.full(n, 20.0))
+        assert len(pop) == n
+        assert list(pop.age) == list(range(n))
+
+    def test_keep(self):
+        """
+        Tests that only the rows in the mask are kept, in order
+        """
+        pop = Population(Herbivore)
+        pop.add([1, 2, 3, 4], [10., 20., 30., 40.])
+        pop.keep(np.array([True, False, True, False]))
+        assert list(pop.age) == [1, 3]
+        assert list(pop.weight) == [10., 30.]
+
+    @pytest.mark.parametrize("animal_class", [Herbivore, Carnivore])
+    def test_update_age(self, animal_class):
+        """
+        Tests that the whole population ages, and the fitness
+        matches the one computed for a single animal
+        """
+        pop = Population(animal_class)
+        pop.add([0, 10], [15., 25.])
+        pop.update_age()
+        assert list(pop.age) == [1, 11]
+        assert pop.fitness[1] == pytest.approx(animal_class(11, 25.).fitness)
+
+    def test_death_no_weight(self):
+        """
+        Tests that animals without weight always die
+        """
+        pop = Population(Herbivore)
+        pop.add([5, 5], [0., 50.])
+        pop.fitness[:] = [0, 1]
+        assert list(pop.death()) == [True, False]
+
+    def test_refresh_fitness(self):
+        """
+        Tests that stale fitness is recomputed for several
+        populations at once
+        """
+        pops = [Population(Herbivore) for _ in range(3)]
+        for n, pop in enumerate(pops):
+            pop.add(np.arange(n + 1), np.full(n + 1, 30.))
+            pop.update_age()
+        Population.refresh_fitness(pops)
+        for pop in pops:
+            expected = Herbivore.fitness_kernel(pop.age, pop.weight)
+            assert list(pop._fitness[:len(pop)]) == list(expected)
+            assert not pop._fitness_stale
+
+    def test_graze_per_cell(self):
+        """
+        Tests that the herbivores in each cell share the fodder of that cell only
+        """
+        pop = Population(Herbivore)
+        pop.add(np.full(6, 5), np.full(6, 20.), cell=[0, 0, 0, 1, 1, 1])
+        fodder = np.array([25., 100.])
+        pop.graze(fodder)
+        beta = Herbivore.parameters['beta']
+        assert list(fodder) == [0., 100. - 3 * Herbivore.parameters['F']]
+        assert pop.weight[:3].sum() == pytest.approx(60. + beta * 25.)
+
+    def test_remove(self):
+        """
+        Tests that the given rows are dropped and the rest keep their order
+        """
+        pop = Population(Carnivore)
+        pop.add(np.arange(10), np.arange(10) + 1.)
+        pop.remove([0, 3, 9])
+        assert list(pop.age) == [1, 2, 4, 5, 6, 7, 8]
+        assert list(pop.weight) == [2., 3., 5., 6., 7., 8., 9.]
+
+    def test_prey_on_stops_when_full(self, mocker):
+        """
+        Tests that a carnivore that always succeeds stops hunting when it
+        has eaten F, and never kills prey that is fitter than itself
+        """
+        rng = mocker.Mock(wraps=np.random.default_rng(1))
+        rng.random.return_value = 0
+        p = Carnivore.parameters
+        carns = Population(Carnivore)
+        carns.add([5], [50.])
+        carns.fitness[:] = 0.5
+        herbs = Population(Herbivore)
+        num_herbs = int(np.ceil(p['F'] / 20)) + 3
+        herbs.add(np.full(num_herbs, 5), np.full(num_herbs, 20.))
+        herbs.fitness[:] = np.linspace(0, 0.4, num_herbs)
+        herbs.fitness[-1] = 0.9
+
+        killed = carns.prey_on(herbs, rng=rng)
+        assert killed.sum() == np.ceil(p['F'] / 20)
+        assert not killed[-1]
+        assert carns.weight[0] == pytest.approx(50 + p['beta'] * p['F'])
+
+    def test_procreate_block(self, mocker):
+        """
+        Tests that every heavy animal gives birth when the draw allows it,
+        and that each mother loses xi times the weight of her newborn
+        """
+        rng = mocker.Mock(wraps=np.random.default_rng(1))
+        rng.random.return_value = 0
+        p = Herbivore.parameters
+        pop = Population(Herbivore)
+        heavy = 2 * p['zeta'] * (p['w_birth'] + p['sigma_birth'])
+        pop.add([5, 5, 5], [heavy, heavy, 0.1])
+        pop.procreate(rng)
+        assert len(pop) == 5
+        assert list(pop.age[3:]) == [0, 0]
+        lost = heavy - pop.weight[:2]
+        assert lost == pytest.approx(p['xi'] * pop.weight[3:])
+        assert pop.weight[2] == 0.1
+
+    def test_track_counts(self):
+        """
+        Tests that tracked counts follow adds, drops and moves
+        """
+        pop = Population(Herbivore)
+        pop.add([1, 2], [10., 20.], cell=[0, 2])
+        counts = np.zeros(3, dtype=np.int64)
+        pop.track_counts(counts)
+        assert list(counts) == [1, 0, 1]
+        pop.add([3, 4, 5], [10., 20., 30.], cell=[1, 1, 2])
+        pop.remove([0])
+        pop.move(np.array([0]), np.array([0]))
+        assert list(counts) == list(pop.count_per_cell(3))
+        assert list(counts) == [1, 2, 1]
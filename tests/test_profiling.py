@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+"""
+
+__author__ = 'Peter Langdalen'
+__email__ = 'pelangda@nmbu.no'
+
+import pstats
+import pytest
+
+
+class TestSimulationStats:
+    """
+    The SimulationStats testclass
+    """
+
+    def test_counters(self, mode, make_sim, mocker):
+        """
+        Tests that every phase is timed, that the counters agree with
+        the animals on the island, and that the animals are not counted
+        in between the phases
+        """
+        sim = make_sim(mode)
+        stats = sim.enable_stats()
+        count_animals = mocker.spy(sim.stepper, 'count_animals')
+        sim.simulate(5, vis_years=None)
+        assert count_animals.call_count == 0
+        assert [year_stats['year'] for year_stats in stats.years] == [1, 2, 3, 4, 5]
+        land = sim.sim_island.habitable.sum()
+        for year_stats in stats.years:
+            phases = len(year_stats['phases'])
+            assert list(year_stats['phases']) == \
+                [name for name, _ in sim.stepper.phases()]
+            assert year_stats['seconds'] == pytest.approx(sum(year_stats['phases'].values()))
+            assert year_stats['migrations'] <= year_stats['migration_attempts']
+            assert phases <= year_stats['cells_visited'] <= phases * land
+        assert stats.years[0]['animals_processed'] > 68
+        totals = stats.totals()
+        assert totals['migrations'] > 0
+        assert sum(sim.stepper.count_animals().values()) == \
+            68 + totals['births'] - totals['deaths'] - totals['kills']
+        sim.close()
+
+    def test_callback(self, make_sim):
+        """
+        Tests that the callback gets every year and that stepping
+        with stats gives the same simulation as without
+        """
+        calls = []
+        sim = make_sim('flat')
+        sim.enable_stats(callback=lambda year, year_stats: calls.append(year))
+        sim.simulate(4, vis_years=None)
+        plain = make_sim('flat')
+        plain.simulate(4, vis_years=None)
+        assert calls == [1, 2, 3, 4]
+        assert sim.stepper.count_animals() == plain.stepper.count_animals()
+        assert 'feed' in sim.stats.report()
+
+    def test_profile_dumped(self, make_sim, tmp_path):
+        """
+        Tests that only the chosen years are profiled, and that
+        the profile is written when the last of them is done
+        """
+        path = str(tmp_path / 'years.prof')
+        sim = make_sim('flat')
+        sim.enable_stats(profile_years=(2, 3), profile_path=path)
+        sim.simulate(2, vis_years=None)
+        assert not (tmp_path / 'years.prof').exists()
+        sim.simulate(2, vis_years=None)
+        assert (tmp_path / 'years.prof').exists()
+        assert (tmp_path / 'years.prof.txt').exists()
+        assert sim.stats.profiler is None
+        functions = [function for _, _, function in pstats.Stats(path).stats]
+        assert 'flat_feed' in functions
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+"""
+
+__author__ = 'Peter Langdalen'
+__email__ = 'pelangda@nmbu.no'
+
+from biosim.random_streams import RandomStreams
+import numpy as np
+
+
+class TestRandomStreams:
+    """
+    The RandomStreams testclass
+    """
+
+    def test_phases_are_independent(self):
+        """
+        Tests that every phase gets its own stream
+        """
+        streams = RandomStreams(1)
+        draws = [streams[phase].random() for phase in RandomStreams.phases]
+        assert len(set(draws)) == len(draws)
+
+    def test_region_streams_reproducible(self):
+        """
+        Tests that a region stream only depends on the seed and its key
+        """
+        first = RandomStreams(7)
+        second = RandomStreams(7)
+        first['feed'].random(100)
+        assert first.region('feed', 3, 2).random() == second.region('feed', 3, 2).random()
+        assert first.region('feed', 3, 2).random() != first.region('feed', 3, 1).random()
+
+    def test_state_round_trip(self):
+        """
+        Tests that restoring the state gives the same draws again
+        """
+        streams = RandomStreams(3)
+        state = streams.get_state()
+        expected = streams['death'].random(5)
+        streams.set_state(state)
+        assert list(streams['death'].random(5)) == list(expected)
+
+    def test_same_seed_same_island(self, mode, make_stepper):
+        """
+        Tests that two islands with the same seed evolve the same way,
+        also when they are run side by side in the same process
+        """
+        alone = make_stepper(mode, seed=12)
+        grids = []
+        for _ in range(5):
+            alone.annual_cycle()
+            grids.append(alone.count_grids())
+        np.random.seed(99)
+        first = make_stepper(mode, seed=12)
+        other = make_stepper(mode, seed=13)
+        for year in range(5):
+            first.annual_cycle()
+            other.annual_cycle()
+            for species in ('Herbivore', 'Carnivore'):
+                assert (first.count_grids()[species] == grids[year][species]).all()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+"""
+
+__author__ = 'Peter Langdalen'
+__email__ = 'pelangda@nmbu.no'
+
+from biosim.recorder import Recorder
+import numpy as np
+import pytest
+
+
+class TestRecorder:
+    """
+    The Recorder testclass
+    """
+
+    def test_events_add_up(self, mode, make_stepper):
+        """
+        Tests that the change in herbivores each year is the births
+        minus the deaths and the kills by carnivores
+        """
+        stepper = make_stepper(mode)
+        stepper.yearly_statistics()
+        count = 60
+        for _ in range(6):
+            stepper.annual_cycle()
+            stats = stepper.yearly_statistics()
+            herbs = stats['Herbivore']
+            assert herbs['count'] == count + herbs['births'] - herbs['deaths'] - \
+                stats['Carnivore']['kills']
+            count = herbs['count']
+        assert herbs['migrations'] > 0
+
+    def test_written_in_chunks(self, make_stepper, tmp_path):
+        """
+        Tests that every year is written, also the ones in the last part chunk
+        """
+        stepper = make_stepper('flat')
+        recorder = Recorder(str(tmp_path), chunk_years=3)
+        counts = []
+        for year in range(1, 8):
+            stepper.annual_cycle()
+            recorder.record(year, stepper.yearly_statistics())
+            counts.append(len(stepper.herbivores))
+        recorder.close()
+
+        data = Recorder.load(str(tmp_path))
+        assert list(data['year']) == list(range(1, 8))
+        assert list(data['Herbivore_count']) == counts
+        assert len(list(tmp_path.glob('chunk_*.npy'))) == 3
+        csv = np.loadtxt(tmp_path / 'statistics.csv', delimiter=',', skiprows=1)
+        assert csv == pytest.approx(np.column_stack(list(data.values())), nan_ok=True)
+
+    def test_earlier_run_replaced(self, make_stepper, tmp_path):
+        """
+        Tests that a second run in the same directory only loads its own years
+        """
+        for num_years in (7, 2):
+            stepper = make_stepper('flat')
+            recorder = Recorder(str(tmp_path), chunk_years=3)
+            for year in range(1, num_years + 1):
+                stepper.annual_cycle()
+                recorder.record(year, stepper.yearly_statistics())
+            recorder.close()
+        data = Recorder.load(str(tmp_path))
+        assert list(data['year']) == [1, 2]
+        assert len(list(tmp_path.glob('chunk_*.npy'))) == 1
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+"""
+
+__author__ = 'Peter Langdalen'
+__email__ = 'pelangda@nmbu.no'
+
+from biosim.renderer import AsyncRenderer
+import numpy as np
+
+
+class TestAsyncRenderer:
+    """
+    The AsyncRenderer testclass
+    """
+
+    def test_drops_frames_but_keeps_totals(self, mocker):
+        """
+        Tests that a frame is dropped when the queue is full, and that
+        its totals are sent with the next frame
+        """
+        mocker.patch('biosim.renderer.multiprocessing.Process')
+        renderer = AsyncRenderer(None, max_frames=1)
+        grids = {'Herbivore': np.zeros((2, 2)), 'Carnivore': np.zeros((2, 2))}
+        renderer.push(1, grids, {'Herbivore': 1, 'Carnivore': 0})
+        renderer.push(2, grids, {'Herbivore': 2, 'Carnivore': 0})
+        assert renderer.dropped == 1
+        assert renderer.frames.get(timeout=5)[0] == 1
+
+        renderer.push(3, grids, {'Herbivore': 3, 'Carnivore': 0})
+        year, _, totals, _, filename = renderer.frames.get(timeout=5)
+        assert year == 3
+        assert [t['Herbivore'] for t in totals] == [2, 3]
+        assert filename is None
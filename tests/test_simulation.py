@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+"""
+
+__author__ = 'Peter Langdalen'
+__email__ = 'pelangda@nmbu.no'
+
+from biosim.simulation import BioSim
+import numpy as np
+import pytest
+import shutil
+import subprocess
+import sys
+import textwrap
+
+headless_script = textwrap.dedent("""\
+    import sys
+    from biosim.simulation import BioSim
+    sim = BioSim('WWWW\\nWLHW\\nWWWW',
+                 [{'loc': (1, 1), 'pop': [{'species': 'Herbivore', 'age': 5, 'weight': 20}
+                                          for _ in range(10)]}], seed=1)
+    sim.simulate(3, vis_years=None)
+    assert sim.renderer is None
+    assert sim.year == 3
+    assert sim.num_animals == sum(sim.num_animals_per_species.values()) > 0
+    assert 'matplotlib' not in sys.modules
+    """)
+
+
+class TestBioSim:
+    """
+    The BioSim testclass
+    """
+
+    def test_headless(self):
+        """
+        Tests that a simulation without visualization never makes a figure
+        or imports matplotlib, but still counts the animals
+        """
+        result = subprocess.run([sys.executable, '-c', headless_script],
+                                capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+
+    @pytest.mark.skipif(shutil.which('ffmpeg') is not None,
+                        reason='the frames are counted in the archive written without ffmpeg')
+    @pytest.mark.parametrize("render_async", [False, True])
+    def test_streamed_movie_kept_after_make_movie(self, render_async, make_sim, tmp_path):
+        """
+        Tests that simulating on after make_movie streams to a new part,
+        so no frames of the finished movie are lost
+        """
+        base = str(tmp_path / 'sim')
+        sim = make_sim('cell', img_base=base, stream_movie=True, render_async=render_async)
+        sim.simulate(3)
+        sim.make_movie()
+        sim.simulate(2)
+        sim.make_movie()
+        sim.close()
+        assert len(np.load(base + '.npz').files) == 3
+        assert len(np.load(base + '_part1.npz').files) == 2
+
+    def test_island_cells_hold_animals(self, mode, make_sim):
+        """
+        Tests that the cells of the island hold the animals of the
+        simulation, also when they are kept in flat columns or tiles
+        """
+        sim = make_sim(mode)
+        sim.simulate(3, vis_years=None)
+        cells = [cel for row in sim.island for cel in row]
+        assert sum(len(cel.herbivore) for cel in cells) == \
+            sim.num_animals_per_species['Herbivore'] > 0
+        assert sum(len(cel.carnivore) for cel in cells) == \
+            sim.num_animals_per_species['Carnivore']
+        sim.close()
+
+
+class TestCheckpoint:
+    """
+    Tests for save_checkpoint and load_checkpoint
+    """
+
+    def test_resume_bit_for_bit(self, mode, make_sim, tmp_path):
+        """
+        Tests that a resumed run ends in exactly the same state as a run
+        that was never stopped
+        """
+        uninterrupted = make_sim(mode)
+        uninterrupted.simulate(6, vis_years=None)
+
+        first = make_sim(mode)
+        first.simulate(3, vis_years=None)
+        first.save_checkpoint(str(tmp_path))
+        resumed = BioSim.load_checkpoint(str(tmp_path))
+        assert resumed.year == 3
+        resumed.simulate(3, vis_years=None)
+
+        expected = uninterrupted.stepper.get_state()
+        state = resumed.stepper.get_state()
+        assert expected.keys() == state.keys()
+        for name in expected:
+            assert np.array_equal(expected[name], state[name]), name
+        assert resumed.num_animals == uninterrupted.num_animals > 0
+
+    def test_flat_load_maps_columns(self, make_sim, tmp_path):
+        """
+        Tests that a flat island loaded from a checkpoint uses the memory
+        mapped files as its columns, and never writes to them
+        """
+        first = make_sim('flat')
+        first.simulate(3, vis_years=None)
+        first.save_checkpoint(str(tmp_path))
+        saved = np.load(str(tmp_path / 'Herbivore_weight.npy'))
+        resumed = BioSim.load_checkpoint(str(tmp_path))
+        assert isinstance(resumed.sim_island.herbivores._weight, np.memmap)
+        assert resumed.heat_num_animals == first.heat_num_animals
+        resumed.simulate(2, vis_years=None)
+        assert np.array_equal(np.load(str(tmp_path / 'Herbivore_weight.npy')), saved)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+"""
+
+__author__ = 'Peter Langdalen'
+__email__ = 'pelangda@nmbu.no'
+
+from biosim.island import Island
+from biosim.tiles import TiledIsland
+import numpy as np
+import pytest
+
+
+class TestTiledIsland:
+    """
+    The TiledIsland testclass
+    """
+
+    def test_tiles_cover_map(self, small_map):
+        """
+        Tests that the tiles cover every cell once, also when the map
+        is not a multiple of the tile shape
+        """
+        tiled = TiledIsland(Island(small_map, flat=True), tile_shape=(2, 3), workers=0)
+        covered = np.zeros((5, 7), dtype=int)
+        for tile in tiled.tiles:
+            covered[tile.rows[0]:tile.rows[1], tile.cols[0]:tile.cols[1]] += 1
+        assert (covered == 1).all()
+        assert len(tiled.tiles) == 9
+
+    def test_animals_moved_into_tiles(self, small_map):
+        """
+        Tests that the island's animals are handed to the tiles
+        """
+        i = Island(small_map, flat=True)
+        i.add_population([{'loc': (3, 5), 'pop': [
+            {'species': 'Herbivore', 'age': 5, 'weight': 20} for _ in range(4)]}])
+        tiled = TiledIsland(i, tile_shape=(2, 3), workers=0)
+        assert len(i.herbivores) == 0
+        assert tiled.count_grids()['Herbivore'][3, 5] == 4
+        herbs, _ = tiled.populations()
+        assert list(herbs.cell) == [3 * 7 + 5] * 4
+
+    @pytest.mark.parametrize("workers", [1, 3])
+    def test_same_result_for_any_workers(self, workers, make_stepper):
+        """
+        Tests that the result only depends on the seed,
+        not on the number of worker processes
+        """
+        in_process = make_stepper('tiles', seed=3)
+        in_workers = make_stepper('tiles', seed=3, workers=workers)
+        for _ in range(6):
+            in_process.annual_cycle()
+            in_workers.annual_cycle()
+            for species in ('Herbivore', 'Carnivore'):
+                assert (in_process.count_grids()[species] ==
+                        in_workers.count_grids()[species]).all()
+
+    def test_animals_stay_on_land(self, make_stepper):
+        """
+        Tests that no animals cross into water at tile borders
+        """
+        tiled = make_stepper('tiles', seed=3)
+        water = ~tiled.island.habitable.reshape(tiled.island.shape)
+        for _ in range(6):
+            tiled.annual_cycle()
+            assert tiled.count_grids()['Herbivore'][water].sum() == 0
+
+    def test_fodder_in_state(self, make_stepper):
+        """
+        Tests that the state holds the fodder left after grazing,
+        and that setting it gives the same state back
+        """
+        tiled = make_stepper('tiles', seed=3)
+        for _ in range(3):
+            tiled.annual_cycle()
+        state = tiled.get_state()
+        f_max = tiled.island.f_max_per_code()[tiled.island.landscape_codes]
+        assert (state['fodder'] <= f_max).all()
+        assert (state['fodder'] < f_max).any()
+        other = make_stepper('tiles', seed=3)
+        other.set_state(state)
+        assert np.array_equal(other.get_state()['fodder'], state['fodder'])
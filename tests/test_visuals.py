@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+"""
+
+__author__ = 'Peter Langdalen'
+__email__ = 'pelangda@nmbu.no'
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from biosim.visuals import Visuals
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def visuals():
+    """
+    Visuals with the plots set up on a tiny map
+    """
+    vis = Visuals()
+    vis.set_plots(rgb_map=[[(0.0, 0.0, 1.0)]])
+    yield vis
+    plt.close(vis.fig)
+
+
+class TestVisuals:
+    """
+    The Visuals testclass
+    """
+
+    def test_line_plot_reuses_lines(self, visuals):
+        """
+        Tests that the line plot keeps one line per species, holding every year
+        """
+        for year in range(100):
+            visuals.update_line_plt({'Herbivore': 2 * year, 'Carnivore': year})
+        assert len(visuals.line_plot_axis.lines) == 2
+        years, herbs = visuals.herb_line.get_data()
+        assert len(years) == 100
+        assert herbs[-1] == 198
+        assert visuals.history.shape[1] == 128
+
+    def test_line_plot_ylim_follows_counts(self, visuals):
+        """
+        Tests that the y-axis grows with the counts when no ymax is given
+        """
+        visuals.update_line_plt({'Herbivore': 1000, 'Carnivore': 10})
+        assert visuals.line_plot_axis.get_ylim()[1] >= 1000
+
+    def test_heat_maps_do_not_wait(self, visuals, mocker):
+        """
+        Tests that updating the heat maps only gives the GUI a moment
+        to draw, instead of sleeping for every frame
+        """
+        pause = mocker.spy(plt, 'pause')
+        grids = {'Herbivore': np.ones((1, 1)), 'Carnivore': np.zeros((1, 1))}
+        for _ in range(3):
+            visuals.update_heat_maps(grids)
+        assert pause.call_count == 3
+        assert all(call.args[0] <= 0.01 for call in pause.call_args_list)
+
+    def test_histograms_update_in_place(self):
+        """
+        Tests that the histogram bars are made once and then get new heights
+        """
+        edges = np.arange(0, 61, 2.)
+        vis = Visuals(hist_edges={'weight': edges})
+        vis.set_plots(rgb_map=[[(0.0, 0.0, 1.0)]])
+        bars = vis.hist_bars['weight']['Herbivore']
+        counts = np.arange(30)
+        vis.update_histograms({'weight': {'Herbivore': counts,
+                                          'Carnivore': np.zeros(30, dtype=int)}})
+        assert vis.hist_bars['weight']['Herbivore'] is bars
+        assert list(bars.get_data().values) == list(counts)
+        assert vis.hist_axes['weight'].get_ylim()[1] >= 29
+        plt.close(vis.fig)